@@ -1,130 +1,617 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from time import perf_counter
+IMPORT_STARTED = perf_counter()     # taken first, for the startup report
+
+from flask import Flask, Response, render_template, stream_template, request, redirect, url_for, session, jsonify, g
+from flask import before_render_template, template_rendered, has_request_context, stream_with_context
+from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
 import sqlite3
 import os
 import json
+import hmac
+import time
+import logging
 from functools import wraps
+from contextlib import contextmanager
+import click
+
+from availability import AvailabilityIndex
+from matching import solve_cover
+from migrations import migrate, full_scans, LATEST_VERSION
+from pagination import KeysetPage, keyset_query, page_size
+from stats import StatsCache
+from login_activity import record_login, record_logout, rollup_logins, archive_logins
+from bulk_import import read_rows, import_staff, import_timetable
+from conflicts import ConflictIndex, find_all_conflicts
+from events import EventHub
+from term_calendar import TermCalendar, parse_date
+from metrics import Metrics, InstrumentedConnection
+import exports
+from jobs import JobQueue
+from group_commit import GroupCommitWriter, WriterBusy
+from snapshot import Snapshot, sync_version_triggers
+from partitions import Partitions
+from auth import PasswordVerifier, CredentialCache, VerifierBusy, tune_pbkdf2
+from assets import AssetBundle, DYNAMIC_ENCODINGS, choose_encoding, compress_body, compress_stream
+import simulator
+from attendance import record_attendance, record_leaves, clear_leave, rebuild_summary, daily_overview, department_statuses
 
 app = Flask(__name__)
 app.secret_key = 'college_staff_secret_key_2025'
 
+# Reassignment solver: 'matching' fills each group of overlapping periods
+# with a load-balanced maximum matching, group by group through the day;
+# 'greedy' takes the first free staff member per period
+app.config.update(
+    REASSIGN_MODE='matching',
+    REASSIGN_DEPARTMENT_WEIGHT=1.0,
+    REASSIGN_LOAD_WEIGHT=1.0,
+)
+
+# SQLite connection tuning, applied to every connection
+app.config.update(
+    SQLITE_JOURNAL_MODE='WAL',
+    SQLITE_BUSY_TIMEOUT_MS=5000,
+    SQLITE_SYNCHRONOUS='NORMAL',
+    SQLITE_CACHE_SIZE_KB=20000,
+)
+
+# Dashboard statistics cache; STATS_CACHE_SHARED keeps entries in the
+# stats_cache table so all gunicorn workers share them
+app.config.update(
+    STATS_CACHE_TTL=60,
+    STATS_CACHE_MAX_ENTRIES=256,
+    STATS_CACHE_SHARED=False,
+)
+
+# Raw login_logs rows older than this move to login_logs_archive
+app.config.update(
+    LOGIN_RETENTION_DAYS=90,
+)
+
+# Bulk import: rows per insert transaction and password hashing processes
+# (None = one per CPU)
+app.config.update(
+    IMPORT_CHUNK_SIZE=500,
+    IMPORT_HASH_WORKERS=None,
+)
+
+# Live admin events (server-sent events). EVENTS_SHARED routes events through
+# the events table so every gunicorn worker's streams receive them
+app.config.update(
+    EVENTS_SHARED=False,
+    EVENTS_POLL_INTERVAL=1.0,
+    EVENTS_HEARTBEAT_SECONDS=15,
+)
+
+# Term calendar: day orders I-VI rotate over working days from the term
+# start, skipping holidays. Without a term start Monday is day I.
+app.config.update(
+    CALENDAR_TERM_START=None,       # e.g. '2025-06-02'
+    CALENDAR_WORKING_WEEKDAYS=6,    # Monday-Saturday
+)
+
+# Request/SQL instrumentation behind /admin/metrics. SLOW_QUERY_MS logs any
+# statement slower than that to the 'slow_queries' logger; METRICS_TOKEN lets
+# a Prometheus scraper authenticate with "Authorization: Bearer <token>".
+app.config.update(
+    METRICS_ENABLED=True,
+    METRICS_TOKEN=None,
+    METRICS_MAX_STATEMENTS=500,
+    SLOW_QUERY_MS=None,
+)
+
+# Background jobs (cover planning, web imports, login rollups) run on
+# JOBS_WORKERS threads per process; 0 leaves them to `flask run-jobs`.
+# Failed jobs are retried JOBS_MAX_ATTEMPTS times with doubling delays.
+app.config.update(
+    JOBS_WORKERS=2,
+    JOBS_POLL_INTERVAL=2.0,
+    JOBS_LEASE_SECONDS=300,
+    JOBS_MAX_ATTEMPTS=5,
+    JOBS_RETRY_SECONDS=10,
+    JOBS_RETENTION_DAYS=30,
+)
+
+# Login records and attendance marks are written by one writer thread per
+# process that commits concurrent requests' rows together: a batch closes
+# after GROUP_COMMIT_MAX_DELAY_MS or GROUP_COMMIT_MAX_ROWS writes (a delay of
+# 0 commits whatever queued up during the previous commit). Requests wait up
+# to GROUP_COMMIT_TIMEOUT seconds for their row to be committed, then get a
+# 503 asking them to retry after GROUP_COMMIT_RETRY_AFTER seconds.
+app.config.update(
+    GROUP_COMMIT_ENABLED=True,
+    GROUP_COMMIT_MAX_ROWS=100,
+    GROUP_COMMIT_MAX_DELAY_MS=5,
+    GROUP_COMMIT_TIMEOUT=10,
+    GROUP_COMMIT_RETRY_AFTER=2,
+)
+
+# Read-only pages (staff schedule and dashboard, timetable and staff lists)
+# can be served from an in-memory snapshot of the scheduling tables in each
+# worker, at most SNAPSHOT_MAX_STALENESS seconds behind the database. A
+# user's own changes show up straight away.
+app.config.update(
+    SNAPSHOT_ENABLED=False,
+    SNAPSHOT_MAX_STALENESS=1.0,
+)
+
+# Files under static/ are served from /assets/ under content-hashed names
+# and cached by browsers for ASSET_MAX_AGE seconds. HTML and JSON responses
+# of at least COMPRESS_MIN_SIZE bytes are compressed (gzip, or brotli when
+# installed) for clients that accept it.
+app.config.update(
+    ASSET_MAX_AGE=365 * 24 * 3600,
+    COMPRESS_RESPONSES=True,
+    COMPRESS_MIMETYPES=('text/html', 'application/json'),
+    COMPRESS_LEVEL=6,
+    COMPRESS_MIN_SIZE=500,
+)
+
+# Startup under gunicorn ('app:create_app()'): STARTUP_MIGRATE upgrades the
+# schema before the worker serves anything (turn it off if deploys run
+# `flask migrate` as a release step); STARTUP_WARMUP compiles every template
+# and warms the database and caches so the first request isn't the slow one
+app.config.update(
+    STARTUP_MIGRATE=True,
+    STARTUP_WARMUP=True,
+)
+
+# What-if leave simulation (needs numpy): at most SIMULATION_MAX_DAYS dates
+# and SIMULATION_MAX_SAMPLES leave combinations per request, scored
+# SIMULATION_BATCH_SIZE combinations at a time
+app.config.update(
+    SIMULATION_MAX_DAYS=31,
+    SIMULATION_MAX_SAMPLES=20000,
+    SIMULATION_BATCH_SIZE=500,
+)
+
+# Department partitions: PARTITIONS maps departments to partition names, e.g.
+# {'Physics': 'science', 'Chemistry': 'science', 'History': 'arts'}, and the
+# timetable, cover, attendance and leave of each partition's staff are kept
+# in a SQLite file of its own (college_staff.science.db), so departments in
+# different partitions don't wait on one writer lock. Other departments go to
+# PARTITION_DEFAULT. None keeps everything in the main database; run
+# `flask partition-data` after switching it on for an existing database.
+app.config.update(
+    PARTITIONS=None,
+    PARTITION_DEFAULT='default',
+)
+
+# Login password checks run in AUTH_WORKERS processes per gunicorn worker (0
+# checks in the request thread). Once AUTH_MAX_PENDING checks are waiting,
+# further logins get a 503 at once, asking the browser to retry after
+# AUTH_RETRY_AFTER seconds. PASSWORD_HASH_METHOD is the method and cost for
+# new hashes, e.g. 'pbkdf2:sha256:400000' as printed by `flask
+# tune-password-hash` for PASSWORD_HASH_TARGET_MS; a stored hash made
+# otherwise is replaced when its user next logs in. None keeps werkzeug's
+# default. Accounts are looked up through a per-worker cache kept for
+# CREDENTIAL_CACHE_TTL seconds.
+app.config.update(
+    AUTH_WORKERS=2,
+    AUTH_MAX_PENDING=32,
+    AUTH_TIMEOUT=5.0,
+    AUTH_RETRY_AFTER=2,
+    PASSWORD_HASH_METHOD=None,
+    PASSWORD_HASH_TARGET_MS=250,
+    CREDENTIAL_CACHE_TTL=60,
+    CREDENTIAL_CACHE_MAX_ENTRIES=4096,
+)
+
+stats_cache = StatsCache(app.config['STATS_CACHE_TTL'],
+                         app.config['STATS_CACHE_MAX_ENTRIES'],
+                         app.config['STATS_CACHE_SHARED'],
+                         lambda: sqlite3.connect(DATABASE, timeout=app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000))
+
+verifier = PasswordVerifier(app.config['AUTH_WORKERS'], app.config['AUTH_MAX_PENDING'],
+                            app.config['AUTH_TIMEOUT'], app.config['PASSWORD_HASH_METHOD'])
+credential_cache = CredentialCache(app.config['CREDENTIAL_CACHE_TTL'],
+                                   app.config['CREDENTIAL_CACHE_MAX_ENTRIES'])
+
 # Database initialization
 DATABASE = 'college_staff.db'
 
-def get_db():
-    conn = sqlite3.connect(DATABASE)
+def connect_db(partition=None, attach=True):
+    # The main database, with the partitions attached behind it when
+    # partitioning is on, or one partition's own file with the main
+    # database's staff directory; attach=False opens the file alone
+    path = DATABASE if partition is None else partitions.path(DATABASE, partition)
+    instrumented = app.config['METRICS_ENABLED']
+    conn = sqlite3.connect(path, timeout=app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+                           factory=InstrumentedConnection if instrumented else sqlite3.Connection)
+    if instrumented:
+        # Statements are counted against the route that opened the connection
+        conn.metrics = metrics
+        conn.route = request.endpoint if has_request_context() else None
     conn.row_factory = sqlite3.Row
+    if partition is not None and attach:
+        partitions.attach_shared(conn, DATABASE)
+    elif partitions is not None and attach:
+        partitions.attach(conn, DATABASE)
+    conn.execute(f"PRAGMA journal_mode = {app.config['SQLITE_JOURNAL_MODE']}")
+    conn.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    conn.execute(f"PRAGMA synchronous = {app.config['SQLITE_SYNCHRONOUS']}")
+    # Negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = {-int(app.config['SQLITE_CACHE_SIZE_KB'])}")
     return conn
 
-def init_db():
-    if not os.path.exists(DATABASE):
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Admins table
-        cursor.execute('''
-            CREATE TABLE admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Staff table
-        cursor.execute('''
-            CREATE TABLE staff (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                department TEXT,
-                phone TEXT,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Timetable table
-        cursor.execute('''
-            CREATE TABLE timetable (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                staff_id INTEGER NOT NULL,
-                day TEXT NOT NULL,
-                start_time TEXT NOT NULL,
-                end_time TEXT NOT NULL,
-                location TEXT,
-                class_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(staff_id) REFERENCES staff(id)
-            )
-        ''')
-        
-        # Attendance table
-        cursor.execute('''
-            CREATE TABLE attendance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                staff_id INTEGER NOT NULL,
-                date TEXT NOT NULL,
-                status TEXT,
-                reason TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(staff_id) REFERENCES staff(id)
-            )
-        ''')
-        
-        # Login logs table
-        cursor.execute('''
-            CREATE TABLE login_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                staff_id INTEGER,
-                admin_id INTEGER,
-                login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                logout_time TIMESTAMP,
-                session_type TEXT
-            )
-        ''')
-        
-        # Leave requests table
-        cursor.execute('''
-            CREATE TABLE leave_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                staff_id INTEGER NOT NULL,
-                leave_date TEXT NOT NULL,
-                reason TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(staff_id) REFERENCES staff(id)
-            )
-        ''')
-        
-        # Reassignment history table
-        cursor.execute('''
-            CREATE TABLE reassignments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                original_staff_id INTEGER NOT NULL,
-                new_staff_id INTEGER NOT NULL,
-                timetable_id INTEGER NOT NULL,
-                leave_date TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(original_staff_id) REFERENCES staff(id),
-                FOREIGN KEY(new_staff_id) REFERENCES staff(id),
-                FOREIGN KEY(timetable_id) REFERENCES timetable(id)
-            )
-        ''')
-        
-        # Create default admin
-        admin_password = generate_password_hash('admin123')
-        cursor.execute('''
-            INSERT INTO admins (username, password, email)
-            VALUES (?, ?, ?)
-        ''', ('admin', admin_password, 'admin@college.edu'))
-        
+metrics = Metrics(app.config['SLOW_QUERY_MS'], app.config['METRICS_MAX_STATEMENTS'])
+
+term_calendar = TermCalendar(app.config['CALENDAR_TERM_START'],
+                             app.config['CALENDAR_WORKING_WEEKDAYS'])
+
+partitions = (Partitions(app.config['PARTITIONS'], app.config['PARTITION_DEFAULT'])
+              if app.config['PARTITIONS'] else None)
+
+events = EventHub(lambda: connect_db(), app.config['EVENTS_SHARED'],
+                  app.config['EVENTS_POLL_INTERVAL'])
+
+# One group commit writer per database file: the main one (None) and each
+# partition's, started on first use
+group_writers = {}
+
+def group_writer(partition=None):
+    if partition not in group_writers:
+        group_writers.setdefault(partition, GroupCommitWriter(
+            lambda: connect_db(partition), app.config['GROUP_COMMIT_MAX_ROWS'],
+            app.config['GROUP_COMMIT_MAX_DELAY_MS']))
+    return group_writers[partition]
+
+def batched_write(write, partition=None):
+    # Run write(conn) in the next group commit and return its result once
+    # committed; without group commit it runs and commits on the request's
+    # connection. partition names the file the rows belong to (default: the
+    # main database). Raises WriterBusy if the commit takes longer than
+    # GROUP_COMMIT_TIMEOUT.
+    if partitions is None:
+        partition = None
+    if not app.config['GROUP_COMMIT_ENABLED']:
+        conn = partition_db(partition) if partition else get_db()
+        result = write(conn)
+        conn.commit()
+        return result
+    return group_writer(partition).write(write, app.config['GROUP_COMMIT_TIMEOUT'])
+
+def get_db():
+    # One connection per app context (i.e. per request), closed on teardown
+    if 'db' not in g:
+        g.db = connect_db()
+    return g.db
+
+# Routing of writes to the partitioned tables. Reads go through get_db(),
+# whose views span every partition; writes go through the connection of the
+# partition that owns the rows. Without partitions all of these return
+# get_db(), so the writes share the request's transaction as before.
+def partition_db(name):
+    # A partition's own file, one connection per app context
+    if partitions is None:
+        return get_db()
+    if 'partition_dbs' not in g:
+        g.partition_dbs = {}
+    if name not in g.partition_dbs:
+        g.partition_dbs[name] = connect_db(name)
+    return g.partition_dbs[name]
+
+def staff_partitions(staff_ids):
+    # {staff_id: partition name} by each staff member's department,
+    # remembered for the rest of the app context; staff not found are sent
+    # to the default partition
+    if partitions is None:
+        return dict.fromkeys(staff_ids)
+    known = g.setdefault('staff_partitions', {})
+    missing = {staff_id for staff_id in staff_ids if staff_id not in known}
+    if missing:
+        found = partitions.locate(get_db(), missing)
+        known.update((staff_id, found.get(staff_id, partitions.default)) for staff_id in missing)
+    return {staff_id: known[staff_id] for staff_id in staff_ids}
+
+def staff_db(staff_id):
+    # Where a staff member's rows are written
+    return partition_db(staff_partitions([staff_id])[staff_id])
+
+def by_staff_db(rows, staff_id=lambda row: row):
+    # [(connection, rows)]: rows grouped by where their staff member's rows
+    # are written
+    names = staff_partitions({staff_id(row) for row in rows})
+    groups = {}
+    for row in rows:
+        groups.setdefault(names[staff_id(row)], []).append(row)
+    return [(partition_db(name), group) for name, group in groups.items()]
+
+def timetable_dbs():
+    # Every database holding a timetable and a calendar, the default
+    # partition first
+    if partitions is None:
+        return [get_db()]
+    return [partition_db(name) for name in partitions.names]
+
+def commit_partitions():
+    for conn in g.get('partition_dbs', {}).values():
         conn.commit()
+
+def commit_db():
+    # Commit the partitions' writes, then the main database's. Each file
+    # commits on its own, so a crash in between can keep the first ones only.
+    commit_partitions()
+    get_db().commit()
+
+def snapshot_enabled():
+    # The snapshot copies the main database only, so partitions turn it off
+    return app.config['SNAPSHOT_ENABLED'] and partitions is None
+
+snapshot = Snapshot(lambda: sqlite3.connect(DATABASE, check_same_thread=False,
+                                            timeout=app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000),
+                    app.config['SNAPSHOT_MAX_STALENESS'])
+
+def read_db():
+    # Connection for read-only pages: the snapshot when enabled, kept for
+    # the rest of the request, otherwise the request's own connection
+    if not snapshot_enabled():
+        return get_db()
+    if 'read_db' not in g:
+        if has_request_context() and session.get('wrote_at', 0) > snapshot.checked_at:
+            snapshot.refresh(force=True)
+        g.read_db = snapshot.connection()
+    return g.read_db
+
+@contextmanager
+def job_session():
+    # Each job runs in its own app context, so get_db() and publish_event()
+    # work in handlers and the connection is closed afterwards
+    with app.app_context():
+        yield get_db()
+
+jobs = JobQueue(job_session, app.config['JOBS_WORKERS'], app.config['JOBS_POLL_INTERVAL'],
+                app.config['JOBS_LEASE_SECONDS'], app.config['JOBS_MAX_ATTEMPTS'],
+                app.config['JOBS_RETRY_SECONDS'], app.config['JOBS_RETENTION_DAYS'])
+
+@app.before_request
+def start_job_workers():
+    # Started by the first request rather than at import, so CLI commands
+    # don't run jobs; jobs left over from before a restart resume here
+    jobs.start()
+
+# Long-lived streams would swamp the latency histogram; they are only counted
+UNTIMED_ENDPOINTS = {'admin_events'}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.after_request
+def remember_write(response):
+    # Pages read after this user's own changes skip the snapshot's staleness
+    if snapshot_enabled() and request.method == 'POST' and 'user_type' in session:
+        session['wrote_at'] = time.time()
+    return response
+
+@app.teardown_request
+def record_request(exception):
+    # Runs once the whole body has been sent, so streamed pages are timed
+    # to their last byte
+    started = g.pop('request_started', None)
+    if started is None or not app.config['METRICS_ENABLED']:
+        return
+    seconds = None if request.endpoint in UNTIMED_ENDPOINTS else perf_counter() - started
+    metrics.observe_request(request.endpoint, request.method,
+                            500 if exception else g.get('response_status', 500), seconds)
+
+def start_render_timer(sender, template, context, **extra):
+    if has_request_context():
+        g.render_started = perf_counter()
+
+def record_render(sender, template, context, **extra):
+    if has_request_context() and 'render_started' in g and app.config['METRICS_ENABLED']:
+        metrics.observe_render(request.endpoint, perf_counter() - g.pop('render_started'))
+
+before_render_template.connect(start_render_timer, app)
+template_rendered.connect(record_render, app)
+
+# Static assets are hashed and pre-compressed once per process, at startup
+assets = AssetBundle(app.static_folder)
+assets.build()
+
+@app.template_global()
+def asset_url(path):
+    return url_for('static_asset', filename=assets.hashed(path))
+
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    asset = assets.get(filename)
+    if asset is None:
+        return Response('not found\n', status=404, mimetype='text/plain')
+    encoding = choose_encoding(request.accept_encodings, asset.variants)
+    response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # The name changes with the content, so the file never needs revalidating
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['ASSET_MAX_AGE']
+    response.cache_control.immutable = True
+    # One ETag per encoding: each variant is different bytes
+    response.set_etag(asset.digest if encoding == 'identity' else f'{asset.digest}-{encoding}')
+    return response.make_conditional(request)
+
+@app.after_request
+def compress_response(response):
+    if not app.config['COMPRESS_RESPONSES'] or response.direct_passthrough or \
+            response.status_code in (204, 304) or 'Content-Encoding' in response.headers or \
+            response.mimetype not in app.config['COMPRESS_MIMETYPES']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings, DYNAMIC_ENCODINGS)
+    if encoding == 'identity':
+        return response
+    level = app.config['COMPRESS_LEVEL']
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress_body(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        # A strong ETag names exact bytes, so the compressed body needs its own
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+@app.teardown_appcontext
+def close_db(exception):
+    # Uncommitted partition writes are rolled back as their connections close
+    for conn in g.pop('partition_dbs', {}).values():
+        conn.close()
+    conn = g.pop('db', None)
+    if conn is not None:
         conn.close()
 
+def init_db():
+    # Create or upgrade the schema in place; safe to run on every start.
+    # With partitions every partition file is set up too. The snapshot's
+    # change-counting triggers are installed only while it is enabled, and
+    # the hourly login rollup is queued if it isn't already.
+    conn = connect_db(attach=False)
+    applied = migrate(conn)
+    sync_version_triggers(conn, snapshot_enabled())
+    queue_login_rollup(conn)
+    conn.commit()
+    if partitions is not None:
+        connect = lambda name: connect_db(name, attach=False)
+        for name, partition_applied in partitions.prepare(conn, connect).items():
+            applied += [(version, f'{migration} ({name} partition)') for version, migration in partition_applied]
+        legacy = partitions.legacy_rows(conn)
+        if legacy:
+            app.logger.warning('%d rows are still in the main database, outside the partitions; '
+                               'run `flask partition-data` to move them', legacy)
+    conn.close()
+    return applied
+
+# Seconds spent on each startup phase (import, schema, templates, warmup),
+# then from the start of the import until the worker was ready (startup) and
+# until its first response was sent (first_response). Logged and exported on
+# /admin/metrics.
+startup_timings = {}
+
+@contextmanager
+def startup_phase(name):
+    started = perf_counter()
+    yield
+    startup_timings[name] = perf_counter() - started
+
+def compile_templates():
+    # Jinja compiles a template on first use; do it for all of them now.
+    # Compiled templates stay in the environment's cache (auto-reload is off
+    # outside debug mode).
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def warm_up():
+    # Touch what the first requests would otherwise pay for: the database
+    # schema and hot tables, this week's dated timetable, the dashboard
+    # statistics, the snapshot, the password check processes and the URL map
+    with app.app_context():
+        conn = get_db()
+        for table in ('staff', 'timetable', 'leave_requests', 'reassignments'):
+            conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()
+        today = datetime.now().date()
+        materialize_dates(today, today + timedelta(days=6))
+        for name in DASHBOARD_STATS:
+            dashboard_stat(name)
+        if snapshot_enabled():
+            snapshot.refresh(force=True)
+    verifier.start()
+    with app.test_request_context('/'):
+        render_template('staff_login.html')
+
+def create_app():
+    # gunicorn entry point, run in each worker before it accepts
+    # connections; later calls just return the app. The schema check is a
+    # single PRAGMA once the first worker of a deployment has migrated.
+    if 'startup' in startup_timings:
+        return app
+    if app.logger.level == logging.NOTSET:
+        app.logger.setLevel(logging.INFO)
+    startup_timings['import'] = perf_counter() - IMPORT_STARTED
+    if app.config['STARTUP_MIGRATE']:
+        with startup_phase('schema'):
+            for version, name in init_db():
+                app.logger.info('Applied migration %d: %s', version, name)
+    if app.config['STARTUP_WARMUP']:
+        with startup_phase('templates'):
+            compile_templates()
+        with startup_phase('warmup'):
+            warm_up()
+    startup_timings['startup'] = perf_counter() - IMPORT_STARTED
+    app.logger.info('Startup: %s', ', '.join(f'{name} {seconds * 1000:.0f} ms'
+                                             for name, seconds in startup_timings.items()))
+    return app
+
+@app.teardown_request
+def record_first_response(exception):
+    # Warm-up's own request context is torn down before 'startup' is set
+    if 'startup' in startup_timings and 'first_response' not in startup_timings:
+        startup_timings['first_response'] = perf_counter() - IMPORT_STARTED
+        app.logger.info('First response %.0f ms after import started', startup_timings['first_response'] * 1000)
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Upgrade the database schema to the latest version."""
+    applied = init_db()
+    for version, name in applied:
+        click.echo(f'Applied migration {version}: {name}')
+    click.echo(f'Schema is at version {LATEST_VERSION}')
+
+@app.cli.command('partition-data')
+def partition_data_command():
+    """Move rows written before PARTITIONS was set into the partition files."""
+    if partitions is None:
+        raise click.UsageError('Set PARTITIONS in app.py first')
+    init_db()
+    with app.app_context():
+        moved = partitions.move_legacy(get_db())
+        # Attendance summaries are rebuilt from the moved rows, and weeks
+        # the partitions expanded before the move are expanded again
+        for name in moved:
+            conn = partition_db(name)
+            rebuild_summary(conn)
+            term_calendar.refresh(conn)
+        commit_db()
+    for name, count in moved.items():
+        click.echo(f'Moved the rows of {count} staff into the {name} partition')
+    click.echo(f'Rows of {sum(moved.values())} staff moved')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Report hot queries whose plan still scans a whole table."""
+    conn = connect_db()
+    findings = full_scans(conn)
+    conn.close()
+    for name, detail in findings:
+        click.echo(f'{name}: {detail}')
+    if findings:
+        raise SystemExit(1)
+    click.echo('No full table scans in hot queries')
+
+@app.cli.command('tune-password-hash')
+@click.option('--target-ms', type=float, help='Time one hash should take (default: PASSWORD_HASH_TARGET_MS)')
+def tune_password_hash_command(target_ms):
+    """Print the PASSWORD_HASH_METHOD that takes about --target-ms here."""
+    target_ms = target_ms or app.config['PASSWORD_HASH_TARGET_MS']
+    method = tune_pbkdf2(target_ms / 1000)
+    click.echo(f"PASSWORD_HASH_METHOD='{method}'")
+    if method != app.config['PASSWORD_HASH_METHOD']:
+        click.echo('Set it in app.py; stored hashes are updated as their users log in')
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -149,63 +636,484 @@ def staff_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def api_staff_required(f):
+    # JSON clients get a 401 instead of a redirect to the login page
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_type' not in session or session['user_type'] != 'staff':
+            return jsonify(error='staff login required'), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Per-staff schedule versions: bumped in the same transaction as any write
+# that changes a staff member's timetable, cover or leave status, so API
+# clients can revalidate with a single primary-key lookup
+def bump_staff_versions(conn, staff_ids):
+    conn.executemany('''
+        INSERT INTO staff_versions (staff_id, version) VALUES (?, 1)
+        ON CONFLICT(staff_id) DO UPDATE SET version = version + 1
+    ''', [(staff_id,) for staff_id in set(staff_ids)])
+
+def bump_covering_staff(timetable_ids):
+    # Staff covering any of these timetable entries today or later have them
+    # in their own schedule, so a change to the entries bumps them too
+    timetable_ids = list(timetable_ids)
+    if not timetable_ids:
+        return
+    placeholders = ', '.join('?' * len(timetable_ids))
+    rows = get_db().execute(f'''
+        SELECT DISTINCT new_staff_id FROM reassignments
+        WHERE timetable_id IN ({placeholders}) AND leave_date >= ?
+    ''', timetable_ids + [datetime.now().strftime('%Y-%m-%d')]).fetchall()
+    for conn, staff_ids in by_staff_db([row[0] for row in rows]):
+        bump_staff_versions(conn, staff_ids)
+
+def staff_version(conn, staff_id):
+    row = conn.execute('SELECT version FROM staff_versions WHERE staff_id = ?', (staff_id,)).fetchone()
+    return row['version'] if row else 0
+
 # Auto-rescheduling logic
-def find_and_reassign_staff(leave_date, original_staff_id):
-    conn = get_db()
-    cursor = conn.cursor()
+def weekly_cover_counts(cursor, leave_date):
+    # Periods each staff member has covered in the Monday-Sunday week of leave_date
+    try:
+        date = datetime.strptime(leave_date, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return {}
+    week_start = date - timedelta(days=date.weekday())
+    week_end = week_start + timedelta(days=6)
     
-    # Get original staff's schedule for that day
     cursor.execute('''
-        SELECT * FROM timetable 
-        WHERE staff_id = ? AND day = ?
-    ''', (original_staff_id, leave_date))
+        SELECT new_staff_id, COUNT(*) FROM reassignments
+        WHERE leave_date BETWEEN ? AND ?
+        GROUP BY new_staff_id
+    ''', (week_start.strftime('%Y-%m-%d'), week_end.strftime('%Y-%m-%d')))
+    return dict(cursor.fetchall())
+
+def reassign_for_date(cursor, leave_date, absent_staff_ids, mode=None):
+    mode = mode or app.config['REASSIGN_MODE']
     
-    schedules = cursor.fetchall()
+    # Expand the date's week of the timetable if nobody has yet; a date that
+    # doesn't parse has no classes to cover
+    try:
+        ensure_weeks(leave_date, leave_date)
+    except (TypeError, ValueError):
+        return []
     
-    for schedule in schedules:
-        start_time = schedule['start_time']
-        end_time = schedule['end_time']
-        
-        # Find available staff (not on leave, not already scheduled)
-        cursor.execute('''
-            SELECT s.id, s.name FROM staff s
-            WHERE s.id != ? AND s.is_active = 1
-            AND s.id NOT IN (
-                SELECT staff_id FROM leave_requests 
-                WHERE leave_date = ? AND status = 'approved'
-            )
-            AND s.id NOT IN (
-                SELECT staff_id FROM timetable 
-                WHERE day = ? 
-                AND ((start_time <= ? AND end_time > ?) 
-                     OR (start_time < ? AND end_time >= ?)
-                     OR (start_time >= ? AND end_time <= ?))
-            )
-            LIMIT 1
-        ''', (original_staff_id, leave_date, leave_date, start_time, start_time, 
-              end_time, end_time, start_time, end_time))
-        
-        alternative_staff = cursor.fetchone()
+    # One bulk read of the date's occurrences and leaves, then every lookup
+    # below is answered from memory
+    index = AvailabilityIndex.load(cursor, leave_date)
+    
+    # Everyone absent on this date is off the cover list, even if their
+    # leave was approved in the same (still uncommitted) batch
+    absent = set(absent_staff_ids)
+    for staff_id in absent:
+        index.mark_on_leave(staff_id)
+    
+    periods = [(timetable_id, original_staff_id, start_time, end_time)
+               for original_staff_id in sorted(absent)
+               for timetable_id, start_time, end_time in index.periods_for(original_staff_id)]
+    
+    reassignments = []
+    if mode == 'matching':
+        cursor.execute('SELECT id, department FROM staff WHERE is_active = 1')
+        departments = dict(cursor.fetchall())
         
-        if alternative_staff:
-            new_staff_id = alternative_staff['id']
+        for original_staff_id, new_staff_id, timetable_id in solve_cover(
+                index, periods, absent, departments,
+                weekly_cover_counts(cursor, leave_date),
+                department_weight=app.config['REASSIGN_DEPARTMENT_WEIGHT'],
+                load_weight=app.config['REASSIGN_LOAD_WEIGHT']):
+            reassignments.append((original_staff_id, new_staff_id, timetable_id, leave_date))
+    else:
+        for timetable_id, original_staff_id, start_time, end_time in periods:
+            # Find available staff (not on leave, not already scheduled)
+            new_staff_id = index.first_free(start_time, end_time, exclude=absent)
             
-            # Create reassignment record
-            cursor.execute('''
-                INSERT INTO reassignments 
-                (original_staff_id, new_staff_id, timetable_id, leave_date)
-                VALUES (?, ?, ?, ?)
-            ''', (original_staff_id, new_staff_id, schedule['id'], leave_date))
-            
-            # Update timetable with new staff
-            cursor.execute('''
-                UPDATE timetable 
-                SET staff_id = ? 
-                WHERE id = ?
-            ''', (new_staff_id, schedule['id']))
+            if new_staff_id is not None:
+                index.move(timetable_id, new_staff_id)
+                reassignments.append((original_staff_id, new_staff_id, timetable_id, leave_date))
     
-    conn.commit()
+    # Record the cover as per-date overrides; the weekly timetable is left
+    # as it is. A period already covered on this date (by someone now absent
+    # too) just gets a new cover. The override is kept with the timetable
+    # entry, in its owner's partition, which for a period already covered
+    # is not the absent staff member's.
+    for conn, rows in by_staff_db(reassignments, lambda row: index.owners[row[2]]):
+        conn.executemany('''
+            INSERT INTO reassignments 
+            (original_staff_id, new_staff_id, timetable_id, leave_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(timetable_id, leave_date) DO UPDATE SET new_staff_id = excluded.new_staff_id
+        ''', rows)
+    
+    for conn, staff_ids in by_staff_db([staff_id for original_staff_id, new_staff_id, _, _ in reassignments
+                                        for staff_id in (original_staff_id, new_staff_id)]):
+        bump_staff_versions(conn, staff_ids)
+    
+    return reassignments
+
+def approve_leaves(leave_ids=None, start_date=None, end_date=None):
+    # Approve every pending leave in the id list or date range. Cover is
+    # planned by one background job per date, enqueued in the same
+    # transaction so it still runs if this process dies right after.
+    # Returns the approved leaves and the job ids.
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    if leave_ids:
+        placeholders = ', '.join('?' * len(leave_ids))
+        cursor.execute(f'''
+            SELECT id, staff_id, leave_date, reason FROM leave_requests
+            WHERE status = 'pending' AND id IN ({placeholders})
+        ''', list(leave_ids))
+    elif start_date and end_date:
+        cursor.execute('''
+            SELECT id, staff_id, leave_date, reason FROM leave_requests
+            WHERE status = 'pending' AND leave_date BETWEEN ? AND ?
+        ''', (start_date, end_date))
+    else:
+        return [], []
+    
+    leaves = cursor.fetchall()
+    
+    for db, staff_leaves in by_staff_db(leaves, lambda leave: leave['staff_id']):
+        db.executemany('UPDATE leave_requests SET status = ? WHERE id = ?',
+                       [('approved', leave['id']) for leave in staff_leaves])
+        bump_staff_versions(db, [leave['staff_id'] for leave in staff_leaves])
+        record_leaves(db, [(leave['staff_id'], leave['leave_date'], leave['reason']) for leave in staff_leaves])
+    
+    leaves_by_date = {}
+    for leave in leaves:
+        leaves_by_date.setdefault(leave['leave_date'], []).append(leave)
+    
+    job_ids = []
+    for leave_date, date_leaves in sorted(leaves_by_date.items()):
+        job_ids.append(jobs.enqueue(conn, 'reassign', {
+            'leave_date': leave_date,
+            'staff_ids': sorted({leave['staff_id'] for leave in date_leaves}),
+        }, key='reassign:' + ','.join(str(leave_id) for leave_id in sorted(leave['id'] for leave in date_leaves))))
+    
+    commit_db()
+    jobs.wake()
+    invalidate_stats('pending_leaves')
+    if leaves:
+        publish_event('leave_approved', ids=[leave['id'] for leave in leaves])
+    
+    return leaves, job_ids
+
+@jobs.handler('reassign', after_commit=lambda result: publish_reassignments(result['reassignments']))
+def plan_cover(conn, payload):
+    # Job: plan cover for staff whose leave on one date was approved. Anyone
+    # whose leave was rejected in the meantime is skipped, and running the
+    # job twice only rewrites the same per-date overrides.
+    leave_date, staff_ids = payload['leave_date'], payload['staff_ids']
+    placeholders = ', '.join('?' * len(staff_ids))
+    still_on_leave = [row[0] for row in conn.execute(f'''
+        SELECT staff_id FROM leave_requests
+        WHERE leave_date = ? AND status = 'approved' AND staff_id IN ({placeholders})
+    ''', [leave_date] + staff_ids)]
+    reassignments = reassign_for_date(conn.cursor(), leave_date, still_on_leave) if still_on_leave else []
+    # With partitions the cover is committed before the job is marked done
+    # rather than with it; a retry writes the same overrides again
+    commit_partitions()
+    return {'leave_date': leave_date, 'reassignments': reassignments}
+
+def publish_reassignments(reassignments):
+    if reassignments:
+        publish_event('reassigned', reassignments=[
+            {'original_staff_id': original_staff_id, 'new_staff_id': new_staff_id,
+             'timetable_id': timetable_id, 'leave_date': leave_date}
+            for original_staff_id, new_staff_id, timetable_id, leave_date in reassignments])
+
+def ensure_weeks(start, end):
+    # term_calendar.ensure_weeks() on every database holding a timetable.
+    # Partitions commit their expansion at once so the views see it; the
+    # default partition, whose calendar the views read, goes last, so a week
+    # it has is expanded everywhere. Otherwise the caller commits.
+    if partitions is None:
+        return term_calendar.ensure_weeks(get_db(), start, end)
+    if not term_calendar.missing_weeks(get_db(), start, end):
+        return 0
+    written = 0
+    for conn in reversed(timetable_dbs()):
+        written = max(written, term_calendar.ensure_weeks(conn, start, end))
+        conn.commit()
+    return written
+
+def materialize_dates(start, end):
+    # Make sure the weeks covering start..end are expanded before reading
+    # timetable_occurrences; read paths commit the expansion straight away
+    if snapshot_enabled() and not term_calendar.missing_weeks(read_db(), start, end):
+        return
+    if ensure_weeks(start, end):
+        get_db().commit()
+        if snapshot_enabled():
+            g.pop('read_db', None)
+            snapshot.refresh(force=True)
+
+def list_filters(*names):
+    # Non-empty filter values from the query string, in a stable order
+    return {name: request.args[name] for name in names if request.args.get(name)}
+
+def keyset_page(sql, where, params, order_columns, key_fields, descending=False, conn=None):
+    # Run one page of a keyset-paginated listing; rows are read lazily as
+    # the (streamed) template iterates them
+    limit = page_size(request.args.get('limit'))
+    sql, params = keyset_query(sql, where, params, order_columns, descending,
+                               request.args.get('cursor'), limit)
+    return KeysetPage((conn or get_db()).execute(sql, params), key_fields, limit)
+
+# Dashboard statistics, cached in stats_cache and invalidated by the write
+# paths that change them
+def count_active_staff(conn):
+    return conn.execute('SELECT COUNT(*) as total FROM staff WHERE is_active = 1').fetchone()['total']
+
+def count_logged_in_staff(conn):
+    # Staff with a session still open that they started in the last day,
+    # from the daily login summary that logins and logouts keep current
+    return conn.execute('''
+        SELECT COUNT(DISTINCT user_id) AS logged_in FROM login_daily_summary
+        WHERE day >= date('now', '-1 day') AND session_type = 'staff' AND open_sessions > 0
+        AND last_login > datetime('now', '-24 hours')
+    ''').fetchone()['logged_in']
+
+def recent_staff_logins(conn):
+    rows = conn.execute('''
+        SELECT s.name, l.login_time FROM login_logs l
+        JOIN staff s ON l.staff_id = s.id
+        WHERE session_type = 'staff'
+        ORDER BY l.login_time DESC LIMIT 10
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+def pending_leave_requests(conn):
+    rows = conn.execute('''
+        SELECT l.*, s.name FROM leave_requests l
+        JOIN staff s ON l.staff_id = s.id
+        WHERE l.status = 'pending'
+        ORDER BY l.created_at DESC
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+DASHBOARD_STATS = {
+    'total_staff': count_active_staff,
+    'logged_in_staff': count_logged_in_staff,
+    'recent_logins': recent_staff_logins,
+    'pending_leaves': pending_leave_requests,
+}
+
+def dashboard_stat(name):
+    conn = get_db()
+    return stats_cache.get(name, lambda: DASHBOARD_STATS[name](conn))
+
+def invalidate_stats(*names):
+    stats_cache.invalidate(*names)
+
+def publish_event(kind, **data):
+    # Call after the write has committed
+    events.publish(kind, data, get_db())
+
+def queue_login_rollup(conn):
+    # Queue the login rollup for the start of the next hour. The hour is the
+    # job key, so every worker can queue it and it still runs once.
+    now = datetime.now()
+    run_at = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return jobs.enqueue(conn, 'rollup-logins', key=f"rollup-logins:{run_at.strftime('%Y-%m-%d %H')}",
+                        delay=(run_at - now).total_seconds())
+
+@jobs.handler('rollup-logins')
+def rollup_logins_job(conn, payload):
+    # Job: the hourly rollup and archive; both steps commit as they go. The
+    # next hour's run is queued along with this one's completion.
+    summarized = rollup_logins(conn)
+    archived = archive_logins(conn, app.config['LOGIN_RETENTION_DAYS'])
+    queue_login_rollup(conn)
+    return {'summarized': summarized, 'archived': archived}
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Exit once no jobs are due instead of waiting for more')
+def run_jobs_command(once):
+    """Run background jobs in this process (e.g. with JOBS_WORKERS = 0)."""
+    if once:
+        click.echo(f'Ran {jobs.run_pending(f"cli-{os.getpid()}")} jobs')
+    else:
+        jobs.work(f'cli-{os.getpid()}')
+
+@app.cli.command('rollup-logins')
+def rollup_logins_command():
+    """Roll login_logs into daily summaries and archive old raw rows."""
+    conn = connect_db()
+    summarized = rollup_logins(conn)
+    archived = archive_logins(conn, app.config['LOGIN_RETENTION_DAYS'])
+    conn.close()
+    click.echo(f'Updated {summarized} daily summary rows, archived {archived} login records')
+
+@app.cli.command('add-holiday')
+@click.argument('date')
+@click.argument('name', required=False)
+def add_holiday_command(date, name):
+    """Mark DATE as a holiday; later day orders move up by one."""
+    parse_date(date)
+    with app.app_context():
+        for conn in timetable_dbs():
+            conn.execute('INSERT OR REPLACE INTO holidays (date, name) VALUES (?, ?)', (date, name))
+        reset_calendar(date)
+    click.echo(f'{date} is now a holiday')
+
+@app.cli.command('reset-calendar')
+@click.option('--since', help='First date to rebuild (default: today)')
+def reset_calendar_command(since):
+    """Rebuild dated occurrences, e.g. after changing CALENDAR_TERM_START."""
+    since = since or datetime.now().strftime('%Y-%m-%d')
+    with app.app_context():
+        reset_calendar(since)
+    click.echo(f'Calendar will be rebuilt from the week of {since}')
+
+def reset_calendar(since):
+    for conn in timetable_dbs():
+        term_calendar.reset(conn, since)
+    # Every dated schedule may have moved, so API clients must refetch
+    staff_ids = [row[0] for row in get_db().execute('SELECT id FROM staff')]
+    for conn, group in by_staff_db(staff_ids):
+        bump_staff_versions(conn, group)
+    commit_db()
+
+def run_import(conn, kind, rows):
+    # Rows are checked against conn and timetable rows written to their
+    # staff member's partition, committing chunk by chunk
+    if kind == 'staff':
+        return import_staff(conn, rows, app.config['IMPORT_CHUNK_SIZE'],
+                            app.config['IMPORT_HASH_WORKERS'], app.config['PASSWORD_HASH_METHOD'])
+    result = import_timetable(conn, rows, app.config['IMPORT_CHUNK_SIZE'], route=lambda row: staff_db(row[0]))
+    for db, staff_ids in by_staff_db(result.staff_ids):
+        term_calendar.refresh(db)
+        bump_staff_versions(db, staff_ids)
+    commit_db()
+    return result
+
+def after_import(result):
+    if result['kind'] == 'staff':
+        invalidate_stats('total_staff')
+
+@jobs.handler('import', after_commit=after_import, keep_payload=False)
+def import_job(conn, payload):
+    # Job: a web upload. run_import commits chunk by chunk, so a failed
+    # import is not retried (it is enqueued with max_attempts=1). Staff rows
+    # carry plaintext passwords, so the rows are dropped from the jobs table
+    # as soon as the job ends.
+    result = run_import(conn, payload['kind'], payload['rows'])
+    return {'kind': payload['kind'], 'imported': result.imported, 'errors': result.errors}
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['staff', 'timetable']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_command(kind, path):
+    """Import staff or timetable rows from a CSV or JSON file."""
+    with open(path, encoding='utf-8-sig') as f:
+        rows = read_rows(f.read(), path)
+    
+    with app.app_context():
+        result = run_import(get_db(), kind, rows)
+    
+    for row_number, message in result.errors:
+        click.echo(f'row {row_number}: {message}', err=True)
+    click.echo(f'Imported {result.imported} {kind} rows, {len(result.errors)} errors')
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(exports.EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(exports.FORMATS)), default='csv')
+@click.option('--start-date', help='First date to include (YYYY-MM-DD)')
+@click.option('--end-date', help='Last date to include (YYYY-MM-DD)')
+@click.option('--department', help='Only staff of this department')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+              help='File to write (default: stdout for CSV, a generated name for XLSX)')
+def export_command(kind, fmt, start_date, end_date, department, output):
+    """Export attendance, leave or reassignment history as CSV or XLSX."""
+    if fmt == 'xlsx' and exports.openpyxl is None:
+        raise click.UsageError('XLSX export needs openpyxl (pip install openpyxl)')
+    if output is None and fmt == 'xlsx':
+        output = exports.export_filename(kind, fmt, start_date, end_date, department)
+    
+    conn = connect_db()
+    chunks = exports.export_chunks(conn, kind, fmt, start_date, end_date, department)
+    if output is None:
+        stdout = click.get_binary_stream('stdout')
+        for chunk in chunks:
+            stdout.write(chunk)
+    else:
+        with open(output, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        click.echo(f'Wrote {output}', err=True)
+    conn.close()
+
+@app.cli.command('check-timetable')
+def check_timetable_command():
+    """Report every staff and room double booking in the timetable."""
+    conn = connect_db()
+    clashes = find_all_conflicts(conn)
     conn.close()
+    for clash in clashes:
+        first, second = clash['first'], clash['second']
+        click.echo(f"{clash['kind']} {clash['who']} day {clash['day']}: "
+                   f"#{first['id']} {first['start_time']}-{first['end_time']} overlaps "
+                   f"#{second['id']} {second['start_time']}-{second['end_time']}")
+    if clashes:
+        raise SystemExit(1)
+    click.echo('No timetable clashes')
+
+def run_simulation(conn, start, end, leaves, samples, department=None, seed=None):
+    # Shared by the CLI and the admin API; raises ValueError on bad input
+    try:
+        start, end = parse_date(start), parse_date(end)
+    except (TypeError, ValueError):
+        raise ValueError('start and end dates must be given as YYYY-MM-DD')
+    if end < start:
+        raise ValueError('end date is before start date')
+    if (end - start).days + 1 > app.config['SIMULATION_MAX_DAYS']:
+        raise ValueError(f"at most {app.config['SIMULATION_MAX_DAYS']} days can be simulated at once")
+    if not 1 <= samples <= app.config['SIMULATION_MAX_SAMPLES']:
+        raise ValueError(f"samples must be between 1 and {app.config['SIMULATION_MAX_SAMPLES']}")
+    return simulator.simulate(conn, term_calendar, start, end, leaves, samples, department, seed,
+                              batch_size=app.config['SIMULATION_BATCH_SIZE'])
+
+@app.cli.command('simulate-leaves')
+@click.argument('start_date')
+@click.argument('end_date')
+@click.option('--leaves', type=int, default=1, help='Staff on leave at the same time')
+@click.option('--samples', type=int, default=1000, help='Leave combinations to try per date')
+@click.option('--department', help='Only draw staff of this department')
+@click.option('--seed', type=int, help='Random seed, for repeatable samples')
+@click.option('--json', 'as_json', is_flag=True, help='Print the full report as JSON')
+def simulate_leaves_command(start_date, end_date, leaves, samples, department, seed, as_json):
+    """Check which days can absorb N simultaneous leaves, without changing anything."""
+    if simulator.np is None:
+        raise click.UsageError('The leave simulator needs numpy (pip install numpy)')
+    conn = connect_db()
+    try:
+        report = run_simulation(conn, start_date, end_date, leaves, samples, department, seed)
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+    finally:
+        conn.close()
+    
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    kind = 'every combination' if report['exhaustive'] else 'random combinations'
+    click.echo(f"{report['scenarios']} {kind} of {leaves} staff on leave")
+    click.echo(f"{'date':<12} {'day':>4} {'periods':>8} {'covered':>8} {'mean short':>11} {'max short':>10}")
+    for day in report['days']:
+        if day['day_order'] is None:
+            click.echo(f"{day['date']:<12} {'-':>4}   no classes")
+            continue
+        click.echo(f"{day['date']:<12} {day['day_order']:>4} {day['periods']:>8} "
+                   f"{day['fully_covered']:>8.1%} {day['mean_uncovered']:>11.2f} {day['max_uncovered']:>10}")
+    if report['cover_load']:
+        click.echo('\nExpected cover load (periods over the range):')
+        for entry in report['cover_load']:
+            click.echo(f"  {entry['name']} ({entry['department']}): {entry['mean_periods']:.2f}, "
+                       f"up to {entry['max_periods_in_a_day']:.2f} in a day")
 
 # ==================== ADMIN ROUTES ====================
 
@@ -218,32 +1126,65 @@ def index():
             return redirect(url_for('staff_dashboard'))
     return redirect(url_for('admin_login'))
 
+# Logins: the account comes from the credential cache and its password is
+# checked in the verifier's processes; a hash made at an old cost is
+# replaced in the same commit as the login record
+PASSWORD_TABLES = {'admin': 'admins', 'staff': 'staff'}
+
+def hash_password(password):
+    method = app.config['PASSWORD_HASH_METHOD']
+    return generate_password_hash(password, method) if method else generate_password_hash(password)
+
+def authenticate(user_type, login, password):
+    # (account, new hash or None) when the password matches, else None.
+    # Raises VerifierBusy when too many checks are already waiting.
+    account = credential_cache.lookup(get_db(), user_type, login)
+    if account is None:
+        return None
+    matches, rehashed = verifier.verify(account['password'], password)
+    return (account, rehashed) if matches else None
+
+def save_login(user_type, login, user_id, rehashed):
+    # The login_logs row's id
+    def write(db):
+        if rehashed is not None:
+            db.execute(f'UPDATE {PASSWORD_TABLES[user_type]} SET password = ? WHERE id = ?', (rehashed, user_id))
+        return record_login(db, user_type, **{f'{user_type}_id': user_id})
+    log_id = batched_write(write)
+    if rehashed is not None:
+        credential_cache.invalidate(user_type, login)
+    return log_id
+
+def login_busy(template, retry_after=None):
+    # Refuse at once rather than queue behind the login burst
+    return (render_template(template, error='Too many people are signing in right now. '
+                                            'Please try again in a moment.'),
+            503, {'Retry-After': str(retry_after or app.config['AUTH_RETRY_AFTER'])})
+
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM admins WHERE username = ?', (username,))
-        admin = cursor.fetchone()
-        conn.close()
+        try:
+            found = authenticate('admin', username, password)
+        except VerifierBusy:
+            return login_busy('admin_login.html')
         
-        if admin and check_password_hash(admin['password'], password):
-            session['user_id'] = admin['id']
-            session['user_type'] = 'admin'
-            session['username'] = admin['username']
+        if found:
+            admin, rehashed = found
+            try:
+                log_id = save_login('admin', username, admin['user_id'], rehashed)
+            except WriterBusy:
+                return login_busy('admin_login.html', app.config['GROUP_COMMIT_RETRY_AFTER'])
             
-            # Log admin login
-            conn = get_db()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO login_logs (admin_id, session_type)
-                VALUES (?, ?)
-            ''', (admin['id'], 'admin'))
-            conn.commit()
-            conn.close()
+            session['user_id'] = admin['user_id']
+            session['user_type'] = 'admin'
+            session['username'] = admin['name']
+            session['login_log_id'] = log_id
+            publish_event('login', log_id=session['login_log_id'], session_type='admin',
+                          name=None, login_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
             
             return redirect(url_for('admin_dashboard'))
         else:
@@ -254,47 +1195,36 @@ def admin_login():
 @app.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get statistics
-    cursor.execute('SELECT COUNT(*) as total FROM staff WHERE is_active = 1')
-    total_staff = cursor.fetchone()['total']
-    
-    # Get logged-in staff count (check recent login logs)
-    cursor.execute('''
-        SELECT COUNT(DISTINCT staff_id) as logged_in FROM login_logs 
-        WHERE session_type = 'staff' 
-        AND login_time > datetime('now', '-24 hours')
-        AND logout_time IS NULL
-    ''')
-    logged_in_staff = cursor.fetchone()['logged_in']
-    
-    # Get recent logins
-    cursor.execute('''
-        SELECT s.name, l.login_time FROM login_logs l
-        JOIN staff s ON l.staff_id = s.id
-        WHERE session_type = 'staff'
-        ORDER BY l.login_time DESC LIMIT 10
-    ''')
-    recent_logins = cursor.fetchall()
-    
-    # Get pending leave requests
-    cursor.execute('''
-        SELECT l.*, s.name FROM leave_requests l
-        JOIN staff s ON l.staff_id = s.id
-        WHERE l.status = 'pending'
-        ORDER BY l.created_at DESC
-    ''')
-    pending_leaves = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('admin_dashboard.html',
-                         total_staff=total_staff,
-                         logged_in_staff=logged_in_staff,
-                         recent_logins=recent_logins,
-                         pending_leaves=pending_leaves)
+    stats = {name: dashboard_stat(name) for name in DASHBOARD_STATS}
+    return render_template('admin_dashboard.html', **stats)
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    # Prometheus scrape target: an admin session or the metrics bearer token
+    token = app.config['METRICS_TOKEN']
+    supplied = request.headers.get('Authorization', '')
+    if session.get('user_type') != 'admin' and not (
+            token and hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())):
+        return Response('admin login or metrics token required\n', status=401, mimetype='text/plain')
+
+    gauges = {
+        'scheduler_event_streams': ('Open /admin/events connections.', events.subscriber_count()),
+        'scheduler_password_checks_pending': ('Login password checks queued or running.', verifier.pending()),
+    }
+    for phase, seconds in startup_timings.items():
+        gauges[f'scheduler_startup_{phase}_seconds'] = (f'Worker startup: {phase}.', round(seconds, 6))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/events')
+@admin_required
+def admin_events():
+    # Server-sent event stream of logins, logouts, leave requests, decisions
+    # and reassignments; the browser's EventSource resumes with Last-Event-ID
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    sub = events.subscribe(last_event_id)
+    return Response(events.stream(sub, app.config['EVENTS_HEARTBEAT_SECONDS']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/admin/staff/add', methods=['GET', 'POST'])
 @admin_required
@@ -309,15 +1239,15 @@ def add_staff():
         try:
             conn = get_db()
             cursor = conn.cursor()
-            hashed_password = generate_password_hash(password)
+            hashed_password = hash_password(password)
             
             cursor.execute('''
                 INSERT INTO staff (name, email, password, department, phone)
                 VALUES (?, ?, ?, ?, ?)
             ''', (name, email, hashed_password, department, phone))
             
-            conn.commit()
-            conn.close()
+            commit_db()
+            invalidate_stats('total_staff')
             
             return render_template('add_staff.html', success='Staff member added successfully!')
         except sqlite3.IntegrityError:
@@ -328,13 +1258,19 @@ def add_staff():
 @app.route('/admin/staff/view')
 @admin_required
 def view_staff():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM staff WHERE is_active = 1 ORDER BY name')
-    staff_list = cursor.fetchall()
-    conn.close()
+    filters = list_filters('staff', 'department')
+    where, params = ['is_active = 1'], []
+    if 'staff' in filters:
+        where.append("name LIKE ? || '%'")
+        params.append(filters['staff'])
+    if 'department' in filters:
+        where.append('department = ?')
+        params.append(filters['department'])
     
-    return render_template('view_staff.html', staff=staff_list)
+    staff_list = keyset_page('SELECT * FROM staff', where, params,
+                             ['name', 'id'], ['name', 'id'], conn=read_db())
+    
+    return stream_template('view_staff.html', staff=staff_list, filters=filters)
 
 @app.route('/admin/staff/delete/<int:staff_id>', methods=['POST'])
 @admin_required
@@ -347,18 +1283,59 @@ def delete_staff(staff_id):
     cursor.execute('UPDATE staff SET is_active = 0 WHERE id = ?', (staff_id,))
     
     # Remove future timetable entries for this staff member
-    cursor.execute('DELETE FROM timetable WHERE staff_id = ?', (staff_id,))
+    db = staff_db(staff_id)
+    bump_covering_staff(row[0] for row in db.execute('SELECT id FROM timetable WHERE staff_id = ?', (staff_id,)))
+    db.execute('DELETE FROM timetable WHERE staff_id = ?', (staff_id,))
+    db.execute('DELETE FROM timetable_occurrences WHERE staff_id = ? AND date >= ?',
+               (staff_id, datetime.now().strftime('%Y-%m-%d')))
+    bump_staff_versions(db, [staff_id])
     
-    conn.commit()
-    conn.close()
+    commit_db()
+    invalidate_stats('total_staff')
     
     return redirect(url_for('view_staff'))
 
+@app.route('/admin/import', methods=['GET', 'POST'])
+@admin_required
+def bulk_import():
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        
+        if kind not in ('staff', 'timetable') or upload is None or not upload.filename:
+            return render_template('import_data.html', error='Choose what to import and a file')
+        
+        try:
+            rows = read_rows(upload.read(), upload.filename)
+        except (ValueError, UnicodeDecodeError) as exc:
+            return render_template('import_data.html', error=f'Could not read file: {exc}')
+        
+        # Imported in the background; the page polls the job for its result
+        conn = get_db()
+        job_id = jobs.enqueue(conn, 'import', {'kind': kind, 'rows': rows}, max_attempts=1)
+        conn.commit()
+        jobs.wake()
+        
+        return redirect(url_for('bulk_import', jobs=job_id))
+    
+    job = next(iter(requested_jobs()), None)
+    return render_template('import_data.html', job=job, result=job and job['result'],
+                           kind=job and job['result'] and job['result']['kind'])
+
+def valid_period(start_time, end_time):
+    # Periods are stored as HH:MM text, so both ends must parse and the
+    # period must end after it starts
+    try:
+        return (datetime.strptime(start_time or '', '%H:%M')
+                < datetime.strptime(end_time or '', '%H:%M'))
+    except ValueError:
+        return False
+
 @app.route('/admin/timetable/create', methods=['GET', 'POST'])
 @admin_required
 def create_timetable():
     if request.method == 'POST':
-        staff_id = request.form.get('staff_id')
+        staff_id = request.form.get('staff_id', type=int)
         day = request.form.get('day')
         start_time = request.form.get('start_time')
         end_time = request.form.get('end_time')
@@ -368,39 +1345,94 @@ def create_timetable():
         conn = get_db()
         cursor = conn.cursor()
         
+        if not valid_period(start_time, end_time):
+            cursor.execute('SELECT id, name, department FROM staff WHERE is_active = 1')
+            return render_template('create_timetable.html', staff=cursor.fetchall(),
+                                   error='End time must be after start time', form=request.form)
+        
+        # Reject double bookings of the staff member or room unless the
+        # admin has seen the clash and chosen to save anyway
+        conflicts = ConflictIndex.load(conn, staff_id, location, day).conflicts(
+            staff_id, day, start_time, end_time, location)
+        if conflicts and not request.form.get('allow_conflicts'):
+            cursor.execute('SELECT id, name, department FROM staff WHERE is_active = 1')
+            return render_template('create_timetable.html', staff=cursor.fetchall(),
+                                   conflicts=conflicts, form=request.form)
+        
+        db = staff_db(staff_id)
+        cursor = db.cursor()
         cursor.execute('''
             INSERT INTO timetable (staff_id, day, start_time, end_time, location, class_name)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (staff_id, day, start_time, end_time, location, class_name))
+        term_calendar.refresh(db, [cursor.lastrowid])
+        bump_staff_versions(db, [staff_id])
         
-        conn.commit()
-        conn.close()
+        commit_db()
         
         return redirect(url_for('view_timetable'))
     
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT id, name FROM staff WHERE is_active = 1')
+    cursor.execute('SELECT id, name, department FROM staff WHERE is_active = 1')
     staff_list = cursor.fetchall()
-    conn.close()
     
     return render_template('create_timetable.html', staff=staff_list)
 
 @app.route('/admin/timetable/view')
 @admin_required
 def view_timetable():
-    conn = get_db()
-    cursor = conn.cursor()
+    filters = list_filters('date', 'day', 'staff', 'department')
+    if 'date' in filters:
+        return view_timetable_for_date(filters)
     
-    cursor.execute('''
+    where, params = [], []
+    if 'day' in filters:
+        where.append('t.day = ?')
+        params.append(filters['day'])
+    if 'staff' in filters:
+        where.append("s.name LIKE ? || '%'")
+        params.append(filters['staff'])
+    if 'department' in filters:
+        where.append('s.department = ?')
+        params.append(filters['department'])
+    
+    timetable = keyset_page('''
         SELECT t.*, s.name FROM timetable t
         JOIN staff s ON t.staff_id = s.id
-        ORDER BY t.day, t.start_time
-    ''')
-    timetable = cursor.fetchall()
-    conn.close()
+    ''', where, params, ['t.day', 't.start_time', 't.id'], ['day', 'start_time', 'id'], conn=read_db())
     
-    return render_template('view_timetable.html', timetable=timetable)
+    return stream_template('view_timetable.html', timetable=timetable, filters=filters)
+
+def view_timetable_for_date(filters):
+    # The periods actually held on one date, with whoever is covering them
+    try:
+        date = parse_date(filters['date']).isoformat()
+    except ValueError:
+        return redirect(url_for('view_timetable'))
+    materialize_dates(date, date)
+    
+    where, params = ['o.date = ?'], [date]
+    if 'day' in filters:
+        where.append('o.day_order = ?')
+        params.append(filters['day'])
+    if 'staff' in filters:
+        where.append("s.name LIKE ? || '%'")
+        params.append(filters['staff'])
+    if 'department' in filters:
+        where.append('s.department = ?')
+        params.append(filters['department'])
+    
+    timetable = keyset_page('''
+        SELECT o.timetable_id AS id, o.date, o.day_order AS day, o.start_time, o.end_time,
+               o.location, o.class_name, s.name, s.id != o.staff_id AS covered
+        FROM timetable_occurrences o
+        JOIN staff s ON s.id = COALESCE((SELECT r.new_staff_id FROM reassignments r
+                                         WHERE r.timetable_id = o.timetable_id AND r.leave_date = o.date),
+                                        o.staff_id)
+    ''', where, params, ['o.start_time', 'o.timetable_id'], ['start_time', 'id'], conn=read_db())
+    
+    return stream_template('view_timetable.html', timetable=timetable, filters=filters)
 
 @app.route('/admin/timetable/edit/<int:id>', methods=['GET', 'POST'])
 @admin_required
@@ -415,88 +1447,279 @@ def edit_timetable(id):
         location = request.form.get('location')
         class_name = request.form.get('class_name')
         
-        cursor.execute('''
+        cursor.execute('SELECT * FROM timetable WHERE id = ?', (id,))
+        entry = cursor.fetchone()
+        if entry is None:
+            return redirect(url_for('view_timetable'))
+        
+        if not valid_period(start_time, end_time):
+            return render_template('edit_timetable.html', entry=entry,
+                                   error='End time must be after start time', form=request.form)
+        
+        conflicts = ConflictIndex.load(conn, entry['staff_id'], location, day).conflicts(
+            entry['staff_id'], day, start_time, end_time, location, ignore_id=id)
+        if conflicts and not request.form.get('allow_conflicts'):
+            return render_template('edit_timetable.html', entry=entry,
+                                   conflicts=conflicts, form=request.form)
+        
+        db = staff_db(entry['staff_id'])
+        db.execute('''
             UPDATE timetable 
             SET day = ?, start_time = ?, end_time = ?, location = ?, class_name = ?
             WHERE id = ?
         ''', (day, start_time, end_time, location, class_name, id))
+        term_calendar.refresh(db, [id])
+        bump_staff_versions(db, [entry['staff_id']])
+        bump_covering_staff([id])
         
-        conn.commit()
-        conn.close()
+        commit_db()
         
         return redirect(url_for('view_timetable'))
     
     cursor.execute('SELECT * FROM timetable WHERE id = ?', (id,))
     entry = cursor.fetchone()
-    conn.close()
     
     return render_template('edit_timetable.html', entry=entry)
 
+@app.route('/admin/timetable/conflicts')
+@admin_required
+def timetable_conflicts():
+    clashes = find_all_conflicts(get_db())
+    return render_template('timetable_conflicts.html', clashes=clashes)
+
+@app.route('/admin/attendance')
+@admin_required
+def view_today_attendance():
+    # Per-department counts for a date (default today) from the daily
+    # summary, and each staff member's status for one chosen department
+    try:
+        date = parse_date(request.args.get('date') or datetime.now().strftime('%Y-%m-%d')).isoformat()
+    except ValueError:
+        return redirect(url_for('view_today_attendance'))
+    conn = get_db()
+    
+    department = request.args.get('department')
+    staff = department_statuses(conn, date, department) if department is not None else None
+    
+    return render_template('view_today_attendance.html', date=date, overview=daily_overview(conn, date),
+                           department=department, staff=staff, error=request.args.get('error'))
+
+@app.route('/admin/attendance/department', methods=['POST'])
+@admin_required
+def mark_department_attendance():
+    # Mark every active member of a department in one transaction; staff on
+    # approved leave that day keep their leave status
+    date = request.form.get('date')
+    department = request.form.get('department', '')
+    status = request.form.get('status')
+    try:
+        date = parse_date(date).isoformat()
+    except (TypeError, ValueError):
+        return redirect(url_for('view_today_attendance', error='Choose a valid date'))
+    if status not in ('present', 'absent'):
+        return redirect(url_for('view_today_attendance', date=date, error='Choose present or absent'))
+    
+    conn = get_db()
+    staff_ids = [row['id'] for row in department_statuses(conn, date, department)]
+    for db, db_staff_ids in by_staff_db(staff_ids):
+        record_attendance(db, date, [(staff_id, status, None) for staff_id in db_staff_ids], keep_leave=True)
+    commit_db()
+    
+    return redirect(url_for('view_today_attendance', date=date, department=department))
+
+@app.route('/admin/export')
+@admin_required
+def export_history():
+    # Streamed download; the export reads its own connection so it can
+    # outlive the request's, and closes it once the last chunk is sent
+    kind = request.args.get('kind')
+    fmt = request.args.get('format', 'csv')
+    if kind not in exports.EXPORTS or fmt not in exports.FORMATS:
+        return Response('unknown export\n', status=404, mimetype='text/plain')
+    if fmt == 'xlsx' and exports.openpyxl is None:
+        return Response('XLSX export needs openpyxl on the server\n', status=501, mimetype='text/plain')
+    filters = list_filters('start_date', 'end_date', 'department')
+    
+    def generate():
+        conn = connect_db()
+        try:
+            yield from exports.export_chunks(conn, kind, fmt, **filters)
+        finally:
+            conn.close()
+    
+    filename = exports.export_filename(kind, fmt, **filters)
+    return Response(stream_with_context(generate()), mimetype=exports.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/admin/leaves/view')
 @admin_required
 def view_leaves():
-    conn = get_db()
-    cursor = conn.cursor()
+    filters = list_filters('status', 'staff', 'department', 'start_date', 'end_date')
+    where, params = [], []
+    if 'status' in filters:
+        where.append('l.status = ?')
+        params.append(filters['status'])
+    if 'staff' in filters:
+        where.append("s.name LIKE ? || '%'")
+        params.append(filters['staff'])
+    if 'department' in filters:
+        where.append('s.department = ?')
+        params.append(filters['department'])
+    if 'start_date' in filters:
+        where.append('l.leave_date >= ?')
+        params.append(filters['start_date'])
+    if 'end_date' in filters:
+        where.append('l.leave_date <= ?')
+        params.append(filters['end_date'])
     
-    cursor.execute('''
+    leaves = keyset_page('''
         SELECT l.*, s.name FROM leave_requests l
         JOIN staff s ON l.staff_id = s.id
-        ORDER BY l.created_at DESC
-    ''')
-    leaves = cursor.fetchall()
-    conn.close()
+    ''', where, params, ['l.created_at', 'l.id'], ['created_at', 'id'], descending=True)
     
-    return render_template('view_leaves.html', leaves=leaves)
+    return stream_template('view_leaves.html', leaves=leaves, filters=filters, jobs=requested_jobs())
 
 @app.route('/admin/leave/approve/<int:id>', methods=['POST'])
 @admin_required
 def approve_leave(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM leave_requests WHERE id = ?', (id,))
-    leave = cursor.fetchone()
-    
-    if leave:
-        cursor.execute('UPDATE leave_requests SET status = ? WHERE id = ?', ('approved', id))
-        conn.commit()
-        
-        # Auto-reassign staff
-        find_and_reassign_staff(leave['leave_date'], leave['staff_id'])
+    # The approval commits at once; the leaves page follows the cover job
+    leaves, job_ids = approve_leaves([id])
+    return redirect(url_for('view_leaves', jobs=job_list(job_ids)))
+
+@app.route('/admin/leaves/approve', methods=['POST'])
+@admin_required
+def approve_leaves_bulk():
+    leave_ids = [int(leave_id) for leave_id in request.form.getlist('leave_ids') if leave_id.isdigit()]
+    start_date = request.form.get('start_date')
+    end_date = request.form.get('end_date')
     
-    conn.close()
-    return redirect(url_for('view_leaves'))
+    leaves, job_ids = approve_leaves(leave_ids, start_date, end_date)
+    return redirect(url_for('view_leaves', jobs=job_list(job_ids)))
+
+def job_list(job_ids):
+    # Job ids for a ?jobs= query parameter (None drops the parameter)
+    return ','.join(str(job_id) for job_id in job_ids) or None
+
+def requested_jobs():
+    ids = [int(job_id) for job_id in request.args.get('jobs', '').split(',') if job_id.isdigit()]
+    return list(jobs.get(get_db(), ids[:50]).values())
+
+@app.route('/admin/jobs')
+@admin_required
+def job_status():
+    # Polled by pages waiting on background work: ?jobs=1,2,3
+    return jsonify(jobs=[{key: job[key] for key in ('id', 'kind', 'status', 'attempts', 'result')}
+                         for job in requested_jobs()])
+
+@app.route('/admin/simulate')
+@admin_required
+def simulate_leaves():
+    # ?start_date=&end_date=&leaves=3&samples=1000&department=&seed=
+    if simulator.np is None:
+        return jsonify(error='the leave simulator needs numpy on the server'), 501
+    try:
+        report = run_simulation(get_db(), request.args.get('start_date'), request.args.get('end_date'),
+                                request.args.get('leaves', 1, type=int),
+                                request.args.get('samples', 1000, type=int),
+                                request.args.get('department') or None,
+                                request.args.get('seed', type=int))
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    return jsonify(report)
 
 @app.route('/admin/leave/reject/<int:id>', methods=['POST'])
 @admin_required
 def reject_leave(id):
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('UPDATE leave_requests SET status = ? WHERE id = ?', ('rejected', id))
-    conn.commit()
-    conn.close()
+    cursor.execute('SELECT staff_id, leave_date, status FROM leave_requests WHERE id = ?', (id,))
+    leave = cursor.fetchone()
+    if leave is not None:
+        db = staff_db(leave['staff_id'])
+        db.execute('UPDATE leave_requests SET status = ? WHERE id = ?', ('rejected', id))
+        bump_staff_versions(db, [leave['staff_id']])
+        if leave['status'] == 'approved':
+            clear_leave(db, leave['staff_id'], leave['leave_date'])
+    commit_db()
+    invalidate_stats('pending_leaves')
+    publish_event('leave_rejected', ids=[id])
     
     return redirect(url_for('view_leaves'))
 
 @app.route('/admin/logins/view')
 @admin_required
 def view_logins():
-    conn = get_db()
-    cursor = conn.cursor()
+    filters = list_filters('view', 'session_type', 'staff', 'department', 'start_date', 'end_date')
+    if filters.get('view') == 'daily':
+        return view_login_summary(filters)
     
-    cursor.execute('''
+    where, params = [], []
+    if 'session_type' in filters:
+        where.append('l.session_type = ?')
+        params.append(filters['session_type'])
+    if 'staff' in filters:
+        where.append("s.name LIKE ? || '%'")
+        params.append(filters['staff'])
+    if 'department' in filters:
+        where.append('s.department = ?')
+        params.append(filters['department'])
+    if 'start_date' in filters:
+        where.append('l.login_time >= ?')
+        params.append(filters['start_date'])
+    if 'end_date' in filters:
+        where.append("l.login_time < date(?, '+1 day')")
+        params.append(filters['end_date'])
+    
+    logins = keyset_page('''
         SELECT l.*, s.name FROM login_logs l
         LEFT JOIN staff s ON l.staff_id = s.id
-        ORDER BY l.login_time DESC LIMIT 100
-    ''')
-    logins = cursor.fetchall()
-    conn.close()
+    ''', where, params, ['l.login_time', 'l.id'], ['login_time', 'id'], descending=True)
+    
+    return stream_template('view_logins.html', logins=logins, filters=filters)
+
+def view_login_summary(filters):
+    # Daily per-user login counts from the summary table
+    where, params = [], []
+    if 'session_type' in filters:
+        where.append('d.session_type = ?')
+        params.append(filters['session_type'])
+    if 'staff' in filters:
+        where.append("s.name LIKE ? || '%'")
+        params.append(filters['staff'])
+    if 'department' in filters:
+        where.append('s.department = ?')
+        params.append(filters['department'])
+    if 'start_date' in filters:
+        where.append('d.day >= ?')
+        params.append(filters['start_date'])
+    if 'end_date' in filters:
+        where.append('d.day <= ?')
+        params.append(filters['end_date'])
+    
+    summary = keyset_page('''
+        SELECT d.*, s.name FROM login_daily_summary d
+        LEFT JOIN staff s ON d.session_type = 'staff' AND d.user_id = s.id
+    ''', where, params, ['d.day', 'd.session_type', 'd.user_id'],
+        ['day', 'session_type', 'user_id'], descending=True)
     
-    return render_template('view_logins.html', logins=logins)
+    return stream_template('view_logins.html', summary=summary, filters=filters)
+
+def end_login_session():
+    # Close the session's login_logs row so it stops counting as logged in
+    log_id = session.get('login_log_id')
+    if log_id is not None:
+        conn = get_db()
+        record_logout(conn, log_id)
+        conn.commit()
+        invalidate_stats('logged_in_staff')
+        publish_event('logout', log_id=log_id, session_type=session.get('user_type'),
+                      logout_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                      logged_in=dashboard_stat('logged_in_staff'))
+    session.clear()
 
 @app.route('/admin/logout')
 def admin_logout():
-    session.clear()
+    end_login_session()
     return redirect(url_for('admin_login'))
 
 # ==================== STAFF ROUTES ====================
@@ -507,26 +1730,26 @@ def staff_login():
         email = request.form.get('email')
         password = request.form.get('password')
         
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM staff WHERE email = ?', (email,))
-        staff = cursor.fetchone()
-        conn.close()
+        try:
+            found = authenticate('staff', email, password)
+        except VerifierBusy:
+            return login_busy('staff_login.html')
         
-        if staff and check_password_hash(staff['password'], password):
-            session['user_id'] = staff['id']
+        if found:
+            staff, rehashed = found
+            try:
+                log_id = save_login('staff', email, staff['user_id'], rehashed)
+            except WriterBusy:
+                return login_busy('staff_login.html', app.config['GROUP_COMMIT_RETRY_AFTER'])
+            
+            session['user_id'] = staff['user_id']
             session['user_type'] = 'staff'
             session['username'] = staff['name']
-            
-            # Log staff login
-            conn = get_db()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO login_logs (staff_id, session_type)
-                VALUES (?, ?)
-            ''', (staff['id'], 'staff'))
-            conn.commit()
-            conn.close()
+            session['login_log_id'] = log_id
+            invalidate_stats('logged_in_staff', 'recent_logins')
+            publish_event('login', log_id=session['login_log_id'], session_type='staff',
+                          name=staff['name'], login_time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                          logged_in=dashboard_stat('logged_in_staff'))
             
             return redirect(url_for('staff_dashboard'))
         else:
@@ -537,24 +1760,16 @@ def staff_login():
 @app.route('/staff/dashboard')
 @staff_required
 def staff_dashboard():
-    conn = get_db()
-    cursor = conn.cursor()
-    
     staff_id = session['user_id']
     
-    # Get staff details
-    cursor.execute('SELECT * FROM staff WHERE id = ?', (staff_id,))
-    staff = cursor.fetchone()
-    
-    # Get today's schedule
-    cursor.execute('''
-        SELECT * FROM timetable 
-        WHERE staff_id = ? 
-        ORDER BY start_time
-    ''', (staff_id,))
-    schedule = cursor.fetchall()
+    # Get today's schedule, including any cover arranged for today
+    today = datetime.now().strftime('%Y-%m-%d')
+    materialize_dates(today, today)
+    conn = read_db()
     
-    conn.close()
+    # Get staff details
+    staff = conn.execute('SELECT * FROM staff WHERE id = ?', (staff_id,)).fetchone()
+    schedule = term_calendar.staff_occurrences(conn, staff_id, today, today)
     
     return render_template('staff_dashboard.html', staff=staff, schedule=schedule)
 
@@ -567,61 +1782,129 @@ def mark_attendance():
         reason = request.form.get('reason')
         
         if status == 'leave':
-            conn = get_db()
+            conn = staff_db(session['user_id'])
             cursor = conn.cursor()
             
             cursor.execute('''
                 INSERT INTO leave_requests (staff_id, leave_date, reason, status)
                 VALUES (?, ?, ?, ?)
             ''', (session['user_id'], date, reason, 'pending'))
+            leave_id = cursor.lastrowid
+            bump_staff_versions(conn, [session['user_id']])
             
-            conn.commit()
-            conn.close()
+            commit_db()
+            invalidate_stats('pending_leaves')
+            publish_event('leave_requested', id=leave_id, name=session['username'],
+                          leave_date=date, reason=reason)
             
             return render_template('mark_attendance.html', success='Leave request submitted!')
-        else:
-            conn = get_db()
-            cursor = conn.cursor()
+        elif status in ('present', 'absent'):
+            staff_id = session['user_id']
             
-            cursor.execute('''
-                INSERT INTO attendance (staff_id, date, status, reason)
-                VALUES (?, ?, ?, ?)
-            ''', (session['user_id'], date, status, reason))
-            
-            conn.commit()
-            conn.close()
+            # Marking the same date again replaces the earlier status, so
+            # asking for a retry when the writer is backed up is safe
+            try:
+                batched_write(lambda db: record_attendance(db, date, [(staff_id, status, reason)]),
+                              staff_partitions([staff_id])[staff_id])
+            except WriterBusy:
+                return (render_template('mark_attendance.html',
+                                        error='The server is busy. Please try again in a moment.'),
+                        503, {'Retry-After': str(app.config['GROUP_COMMIT_RETRY_AFTER'])})
             
             return render_template('mark_attendance.html', success='Attendance marked!')
+        
+        # Anything else would otherwise be dropped without a word
+        return render_template('mark_attendance.html',
+                               error='Choose present, absent or leave'), 400
     
     return render_template('mark_attendance.html')
 
 @app.route('/staff/schedule')
 @staff_required
 def view_schedule():
-    conn = get_db()
-    cursor = conn.cursor()
-    
     staff_id = session['user_id']
     
-    cursor.execute('''
-        SELECT t.*, 
-            CASE WHEN r.id IS NOT NULL THEN 'Reassigned' ELSE 'Original' END as assignment_type
-        FROM timetable t
-        LEFT JOIN reassignments r ON t.id = r.timetable_id
-        WHERE t.staff_id = ?
-        ORDER BY t.day, t.start_time
-    ''', (staff_id,))
-    
-    schedule = cursor.fetchall()
-    conn.close()
+    # One week of dated periods from ?start= (default today)
+    try:
+        start = parse_date(request.args.get('start') or datetime.now().strftime('%Y-%m-%d'))
+    except ValueError:
+        return redirect(url_for('view_schedule'))
+    end = start + timedelta(days=6)
     
-    return render_template('view_schedule.html', schedule=schedule)
+    materialize_dates(start, end)
+    schedule = term_calendar.staff_occurrences(read_db(), staff_id, start, end)
+    
+    return render_template('view_schedule.html', schedule=schedule, start=start, end=end,
+                           previous_week=start - timedelta(days=7), next_week=start + timedelta(days=7))
 
 @app.route('/staff/logout')
 def staff_logout():
-    session.clear()
+    end_login_session()
     return redirect(url_for('staff_login'))
 
+# ==================== API ROUTES ====================
+
+def versioned_json(build, scope=None):
+    # JSON for the logged-in staff member tagged with their schedule version.
+    # A conditional GET for an unchanged version is answered with 304 after
+    # one lookup in staff_versions, without touching the schedule tables.
+    # Responses that depend on the date pass it as scope so they expire daily.
+    # The ETag is weak: it names the data, which may be sent compressed or not.
+    conn = get_db()
+    staff_id = session['user_id']
+    version = staff_version(conn, staff_id)
+    etag = f'{staff_id}-{version}' if scope is None else f'{staff_id}-{version}-{scope}'
+    
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(version=version, **build(conn, staff_id))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/staff/schedule')
+@api_staff_required
+def api_staff_schedule():
+    # The coming seven days, dated, with cover included
+    today = datetime.now().date()
+    
+    def build(conn, staff_id):
+        end = today + timedelta(days=6)
+        materialize_dates(today, end)
+        rows = term_calendar.staff_occurrences(conn, staff_id, today, end)
+        return {'start': today.isoformat(), 'end': end.isoformat(),
+                'schedule': [dict(row) for row in rows]}
+    return versioned_json(build, today.isoformat())
+
+@app.route('/api/staff/reassignments/today')
+@api_staff_required
+def api_staff_reassignments_today():
+    today = datetime.now().strftime('%Y-%m-%d')
+    
+    def build(conn, staff_id):
+        rows = conn.execute('''
+            SELECT r.timetable_id, r.original_staff_id, r.new_staff_id, r.leave_date,
+                   t.day, t.start_time, t.end_time, t.location, t.class_name
+            FROM reassignments r
+            JOIN timetable t ON t.id = r.timetable_id
+            WHERE r.leave_date = ? AND (r.new_staff_id = ? OR r.original_staff_id = ?)
+            ORDER BY t.start_time
+        ''', (today, staff_id, staff_id)).fetchall()
+        return {'date': today, 'reassignments': [dict(row) for row in rows]}
+    return versioned_json(build, today)
+
+@app.route('/api/staff/leaves')
+@api_staff_required
+def api_staff_leaves():
+    def build(conn, staff_id):
+        rows = conn.execute('''
+            SELECT id, leave_date, reason, status, created_at FROM leave_requests
+            WHERE staff_id = ?
+            ORDER BY leave_date DESC
+        ''', (staff_id,)).fetchall()
+        return {'leaves': [dict(row) for row in rows]}
+    return versioned_json(build)
+
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True)
+    create_app().run(debug=True)
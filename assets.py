@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:     # brotli is optional; gzip is always available
+    brotli = None
+
+# Static assets and response compression. At startup every file under the
+# static folder is read once, named after a hash of its content
+# (css/app.css -> css/app.3f2a9c1b7d4e.css) and compressed with gzip and,
+# if installed, brotli. Templates link to the hashed name via asset_url(),
+# so a changed file gets a new URL and the old one can be cached forever.
+# HTML and JSON responses are compressed on the fly, chunk by chunk for
+# streamed pages so rows still reach the browser as they are rendered.
+
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+# Encodings available for compressing responses on the fly
+DYNAMIC_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class Asset:
+
+    def __init__(self, path, data):
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.variants = {'identity': data}
+        if self.mimetype.startswith(COMPRESSIBLE):
+            # Static files are compressed once, so use the best ratio
+            self.variants['gzip'] = gzip.compress(data, 9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(data, quality=11)
+
+
+class AssetBundle:
+
+    def __init__(self, folder, hash_length=12):
+        self.folder = folder
+        self.hash_length = hash_length
+        self._urls = {}     # logical path -> hashed path
+        self._assets = {}   # hashed path -> Asset
+
+    def build(self):
+        # (Re)read every file under the folder; returns how many were found
+        urls, assets = {}, {}
+        if self.folder and os.path.isdir(self.folder):
+            for root, _, files in os.walk(self.folder):
+                for name in files:
+                    full = os.path.join(root, name)
+                    path = os.path.relpath(full, self.folder).replace(os.sep, '/')
+                    with open(full, 'rb') as f:
+                        asset = Asset(path, f.read())
+                    stem, ext = os.path.splitext(path)
+                    hashed = f'{stem}.{asset.digest[:self.hash_length]}{ext}'
+                    urls[path] = hashed
+                    assets[hashed] = asset
+        self._urls, self._assets = urls, assets
+        return len(assets)
+
+    def hashed(self, path):
+        # Content-hashed name for a logical path; unknown paths are returned
+        # unchanged so a missing build shows up as a 404, not an error
+        return self._urls.get(path, path)
+
+    def get(self, hashed):
+        return self._assets.get(hashed)
+
+
+def choose_encoding(accept_encodings, available):
+    # The client's preferred encoding among those available (br over gzip
+    # when both are equally acceptable), or 'identity'
+    best, best_quality = 'identity', 0
+    for encoding in ('br', 'gzip'):
+        quality = accept_encodings[encoding]
+        if encoding in available and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_body(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, level, mtime=0)
+
+
+def compress_stream(chunks, encoding, level, flush_bytes=8192):
+    # Compress a streamed body, flushing whenever flush_bytes of input have
+    # gone in so the browser can render what has arrived. The original
+    # iterable is closed afterwards, as the server would have done.
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+    try:
+        pending = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_bytes:
+                data += flush()
+                pending = 0
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,141 @@
+from collections import defaultdict
+
+# Attendance: the attendance table holds one row per staff member and date
+# with their current status (present, absent, or leave once a leave request
+# is approved). attendance_daily_summary keeps running present/absent/on-leave
+# counts per date and department, adjusted on every write, so the daily
+# overview reads one row per department instead of aggregating history.
+
+STATUS_COLUMNS = {'present': 'present', 'absent': 'absent', 'leave': 'on_leave'}
+
+
+def _previous(conn, date, staff_ids):
+    # {staff_id: (department, status or None)} for the staff being written
+    previous = {}
+    staff_ids = list(staff_ids)
+    for offset in range(0, len(staff_ids), 500):
+        chunk = staff_ids[offset:offset + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(f'''
+            SELECT s.id, COALESCE(s.department, ''), a.status FROM staff s
+            LEFT JOIN attendance a ON a.staff_id = s.id AND a.date = ?
+            WHERE s.id IN ({placeholders})
+        ''', [date] + chunk):
+            previous[row[0]] = (row[1], row[2])
+    return previous
+
+
+def _apply_deltas(conn, date, deltas):
+    # deltas: {(department, status): +n/-n}
+    by_department = defaultdict(lambda: dict.fromkeys(STATUS_COLUMNS.values(), 0))
+    for (department, status), delta in deltas.items():
+        if status in STATUS_COLUMNS and delta:
+            by_department[department][STATUS_COLUMNS[status]] += delta
+    conn.executemany('''
+        INSERT INTO attendance_daily_summary (date, department, present, absent, on_leave)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(date, department) DO UPDATE SET
+            present = present + excluded.present,
+            absent = absent + excluded.absent,
+            on_leave = on_leave + excluded.on_leave
+    ''', [(date, department, counts['present'], counts['absent'], counts['on_leave'])
+          for department, counts in by_department.items()])
+
+
+def record_attendance(conn, date, entries, keep_leave=False):
+    # Set the status of each (staff_id, status, reason) for `date` and adjust
+    # the summary. With keep_leave, staff already on leave that day are left
+    # alone (used when marking a whole department). Returns the staff ids
+    # written; the caller commits.
+    entries = {staff_id: (status, reason) for staff_id, status, reason in entries}
+    previous = _previous(conn, date, entries)
+
+    deltas = defaultdict(int)
+    rows = []
+    for staff_id, (status, reason) in entries.items():
+        if staff_id not in previous:
+            continue
+        department, old_status = previous[staff_id]
+        if keep_leave and old_status == 'leave':
+            continue
+        deltas[(department, old_status)] -= 1
+        deltas[(department, status)] += 1
+        rows.append((staff_id, date, status, reason))
+
+    conn.executemany('''
+        INSERT INTO attendance (staff_id, date, status, reason)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(staff_id, date) DO UPDATE SET
+            status = excluded.status,
+            reason = excluded.reason,
+            created_at = CURRENT_TIMESTAMP
+    ''', rows)
+    _apply_deltas(conn, date, deltas)
+    return [row[0] for row in rows]
+
+
+def record_leaves(conn, leaves):
+    # Approved leaves as (staff_id, leave_date, reason): the staff member is
+    # on leave for that date whatever they marked before
+    by_date = defaultdict(list)
+    for staff_id, leave_date, reason in leaves:
+        by_date[leave_date].append((staff_id, 'leave', reason))
+    for leave_date, entries in by_date.items():
+        record_attendance(conn, leave_date, entries)
+
+
+def clear_leave(conn, staff_id, date):
+    # Undo record_leaves for one staff member and date, e.g. when an approved
+    # leave is rejected afterwards; other statuses are kept
+    previous = _previous(conn, date, [staff_id]).get(staff_id)
+    if previous is None or previous[1] != 'leave':
+        return
+    conn.execute('DELETE FROM attendance WHERE staff_id = ? AND date = ?', (staff_id, date))
+    _apply_deltas(conn, date, {(previous[0], 'leave'): -1})
+
+
+def rebuild_summary(conn, since=''):
+    # Recompute the summary from attendance for dates from `since`, grouping
+    # by each staff member's current department. The caller commits.
+    conn.execute('DELETE FROM attendance_daily_summary WHERE date >= ?', (since,))
+    conn.execute('''
+        INSERT INTO attendance_daily_summary (date, department, present, absent, on_leave)
+        SELECT a.date, COALESCE(s.department, ''),
+               SUM(a.status = 'present'), SUM(a.status = 'absent'), SUM(a.status = 'leave')
+        FROM attendance a
+        JOIN staff s ON s.id = a.staff_id
+        WHERE a.date >= ?
+        GROUP BY a.date, COALESCE(s.department, '')
+    ''', (since,))
+
+
+def daily_overview(conn, date):
+    # One row per department with active staff: the summary counts plus how
+    # many staff haven't been marked yet. The summary is read on its own and
+    # merged here.
+    summary = {row['department']: row for row in conn.execute('''
+        SELECT department, present, absent, on_leave FROM attendance_daily_summary WHERE date = ?
+    ''', (date,))}
+    overview = []
+    for department, staff in conn.execute('''
+        SELECT COALESCE(department, '') AS department, COUNT(*) AS staff FROM staff
+        WHERE is_active = 1 GROUP BY 1 ORDER BY 1
+    '''):
+        counts = summary.get(department)
+        present, absent, on_leave = (counts['present'], counts['absent'], counts['on_leave']) if counts else (0, 0, 0)
+        overview.append({'department': department, 'staff': staff, 'present': present, 'absent': absent,
+                         'on_leave': on_leave, 'unmarked': max(0, staff - present - absent - on_leave)})
+    return overview
+
+
+def department_statuses(conn, date, department):
+    # Each active staff member of a department with their status for `date`;
+    # the '' department is staff without one
+    return conn.execute('''
+        SELECT s.id, s.name, s.email,
+               (SELECT a.status FROM attendance a WHERE a.staff_id = s.id AND a.date = ?1) AS status,
+               (SELECT a.reason FROM attendance a WHERE a.staff_id = s.id AND a.date = ?1) AS reason
+        FROM staff s
+        WHERE COALESCE(s.department, '') = ?2 AND s.is_active = 1
+        ORDER BY s.name
+    ''', (date, department or '')).fetchall()
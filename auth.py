@@ -0,0 +1,197 @@
+import hashlib
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password checks off the request threads. A login burst (the 8:50 rush)
+# would otherwise hold every gunicorn worker on PBKDF2 while other pages
+# wait. Verification runs in a small process pool instead; at most
+# max_pending checks may be queued or running per worker, and beyond that a
+# login fails fast with VerifierBusy (a 503) rather than queueing. A check
+# that matches a hash made at another cost also returns the password hashed
+# at the current cost, so accounts move to a new cost as their users log in.
+#
+# Lookups read the credentials table, a narrow copy of each account's login
+# and hash kept in step with staff and admins by triggers, through a short
+# per-process cache.
+
+
+class VerifierBusy(Exception):
+    pass
+
+
+def needs_rehash(hashed, method):
+    # werkzeug hashes start with the method and its cost, e.g.
+    # pbkdf2:sha256:600000$salt$hash
+    return method is not None and hashed.split('$', 1)[0] != method
+
+
+def verify_password(hashed, password, method=None):
+    # (matches, the password hashed with method if the stored hash used
+    # another method or cost, else None)
+    if not check_password_hash(hashed, password):
+        return False, None
+    if needs_rehash(hashed, method):
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+def tune_pbkdf2(target_seconds, hash_name='sha256', probe=20000, min_iterations=100000):
+    # The pbkdf2 method whose hash takes about target_seconds on this
+    # machine, rounded to two significant figures so that repeated runs
+    # usually agree
+    elapsed = min(_time_pbkdf2(hash_name, probe) for _ in range(3))
+    iterations = int(probe * target_seconds / elapsed)
+    digits = len(str(iterations)) - 2
+    iterations = max(min_iterations, round(iterations, -digits) if digits > 0 else iterations)
+    return f'pbkdf2:{hash_name}:{iterations}'
+
+
+def _time_pbkdf2(hash_name, iterations):
+    started = time.perf_counter()
+    hashlib.pbkdf2_hmac(hash_name, b'password', b'saltsaltsaltsalt', iterations)
+    return time.perf_counter() - started
+
+
+class PasswordVerifier:
+
+    def __init__(self, workers=2, max_pending=32, timeout=5.0, method=None):
+        # workers=0 verifies on the calling thread, without a pool or limit.
+        # method is the hash method and cost new hashes should use; None
+        # keeps werkzeug's default and never rehashes.
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.method = method
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Start the pool's processes now rather than on the first login. The
+        # worker has threads running, so they are spawned, not forked.
+        if self.workers and self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'))
+            for future in [self._pool.submit(int) for _ in range(self.workers)]:
+                future.result()
+
+    def pending(self):
+        return self._pending
+
+    def verify(self, hashed, password):
+        # verify_password() in the pool; raises VerifierBusy when
+        # max_pending checks are already waiting or this one times out
+        if not self.workers:
+            return verify_password(hashed, password, self.method)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise VerifierBusy()
+            self._pending += 1
+        try:
+            self.start()
+            future = self._pool.submit(verify_password, hashed, password, self.method)
+        except BrokenProcessPool:
+            # A pool process died; the next check starts a new pool
+            self._release()
+            self._pool = None
+            raise VerifierBusy()
+        except BaseException:
+            self._release()
+            raise
+        # Still counted after a timeout, until the pool gets through it
+        future.add_done_callback(lambda future: self._release())
+        try:
+            return future.result(self.timeout)
+        except (TimeoutError, BrokenProcessPool):
+            raise VerifierBusy()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class CredentialCache:
+    """Per-process TTL cache of credentials rows by (user_type, login).
+
+    Only accounts found are cached, so a new account can log in at once.
+    A password change made by another worker is picked up within ttl
+    seconds; until then the old hash still verifies the same password.
+    """
+
+    def __init__(self, ttl=60, max_entries=4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (user_type, login) -> (expires_at, row)
+        self._lock = threading.Lock()
+
+    def lookup(self, conn, user_type, login):
+        key = (user_type, login)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        row = conn.execute('''
+            SELECT user_id, name, password FROM credentials WHERE user_type = ? AND login = ?
+        ''', key).fetchone()
+        if row is not None:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, row)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return row
+
+    def invalidate(self, user_type, login):
+        with self._lock:
+            self._entries.pop((user_type, login), None)
+
+
+def create_credential_triggers(cursor):
+    # Migration step: fill credentials from staff and admins and keep it in
+    # step with them
+    sources = [('staff', 'staff', 'email', 'name'), ('admin', 'admins', 'username', 'username')]
+    for user_type, table, login, name in sources:
+        columns = ', '.join(dict.fromkeys((login, name, 'password')))
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO credentials (user_type, login, user_id, name, password)
+            SELECT '{user_type}', {login}, id, {name}, password FROM {table}
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_credentials_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO credentials (user_type, login, user_id, name, password)
+                VALUES ('{user_type}', NEW.{login}, NEW.id, NEW.{name}, NEW.password);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_credentials_update
+            AFTER UPDATE OF {columns} ON {table}
+            BEGIN
+                DELETE FROM credentials WHERE user_type = '{user_type}' AND login = OLD.{login};
+                INSERT OR REPLACE INTO credentials (user_type, login, user_id, name, password)
+                VALUES ('{user_type}', NEW.{login}, NEW.id, NEW.{name}, NEW.password);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_credentials_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM credentials WHERE user_type = '{user_type}' AND login = OLD.{login};
+            END
+        ''')
@@ -0,0 +1,171 @@
+import bisect
+from collections import defaultdict
+
+
+def overlaps(start_a, end_a, start_b, end_b):
+    # Times are 'HH:MM' strings, so plain string comparison orders them
+    return start_a < end_b and end_a > start_b
+
+
+class IntervalSet:
+    # Sorted intervals for one staff member (or room) on one day
+
+    def __init__(self):
+        self.starts = []
+        self.entries = []      # (start_time, end_time, timetable_id), sorted by start
+        self.max_ends = []     # running max of end_time, so overlapping rows are handled
+
+    def _rebuild_max_ends(self, offset):
+        running = self.max_ends[offset - 1] if offset else ''
+        del self.max_ends[offset:]
+        for _, end_time, _ in self.entries[offset:]:
+            running = max(running, end_time)
+            self.max_ends.append(running)
+
+    def add(self, start_time, end_time, timetable_id):
+        pos = bisect.bisect_right(self.starts, start_time)
+        self.starts.insert(pos, start_time)
+        self.entries.insert(pos, (start_time, end_time, timetable_id))
+        self._rebuild_max_ends(pos)
+
+    def remove(self, timetable_id):
+        for pos, entry in enumerate(self.entries):
+            if entry[2] == timetable_id:
+                del self.starts[pos]
+                del self.entries[pos]
+                self._rebuild_max_ends(pos)
+                return entry
+        return None
+
+    def is_free(self, start_time, end_time):
+        # Only entries starting before end_time can overlap; of those, the
+        # latest end decides whether any of them reaches past start_time
+        pos = bisect.bisect_left(self.starts, end_time)
+        return pos == 0 or self.max_ends[pos - 1] <= start_time
+
+    def overlapping(self, start_time, end_time):
+        # Entries overlapping the interval. The free check is O(log n); only
+        # when there is a clash do we walk back to collect the clashing rows.
+        pos = bisect.bisect_left(self.starts, end_time)
+        found = []
+        while pos > 0 and self.max_ends[pos - 1] > start_time:
+            pos -= 1
+            if self.entries[pos][1] > start_time:
+                found.append(self.entries[pos])
+        found.reverse()
+        return found
+
+
+class AvailabilityIndex:
+    """Who is free when, for a single date, held in memory.
+
+    Built from one bulk read of the date's timetable occurrences (with any
+    cover already arranged for it) and the approved leaves for the date, then
+    kept current through move() as reassignments are made, so the caller only
+    has to write the results back in bulk.
+    """
+
+    def __init__(self, leave_date, active_staff, on_leave):
+        self.leave_date = leave_date
+        self.active_staff = sorted(active_staff)
+        self._active_set = set(self.active_staff)
+        self.on_leave = set(on_leave)
+        self._intervals = defaultdict(IntervalSet)
+        self._periods = {}          # timetable_id -> (staff_id, start_time, end_time)
+        self.owners = {}            # timetable_id -> staff_id of the timetable entry
+        self._free_cache = {}       # (start_time, end_time) -> sorted free staff ids
+
+    @classmethod
+    def load(cls, cursor, leave_date):
+        # The date's week must already be materialized (TermCalendar.ensure_weeks)
+        cursor.execute('SELECT id FROM staff WHERE is_active = 1')
+        active_staff = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute('''
+            SELECT staff_id FROM leave_requests
+            WHERE leave_date = ? AND status = 'approved'
+        ''', (leave_date,))
+        on_leave = [row[0] for row in cursor.fetchall()]
+
+        index = cls(leave_date, active_staff, on_leave)
+
+        cursor.execute('''
+            SELECT o.timetable_id,
+                   COALESCE((SELECT r.new_staff_id FROM reassignments r
+                             WHERE r.timetable_id = o.timetable_id AND r.leave_date = o.date), o.staff_id),
+                   o.start_time, o.end_time, o.staff_id
+            FROM timetable_occurrences o
+            WHERE o.date = ?
+        ''', (leave_date,))
+        for timetable_id, staff_id, start_time, end_time, owner in cursor.fetchall():
+            index._add_period(timetable_id, staff_id, start_time, end_time)
+            index.owners[timetable_id] = owner
+
+        return index
+
+    def _add_period(self, timetable_id, staff_id, start_time, end_time):
+        self._periods[timetable_id] = (staff_id, start_time, end_time)
+        self._intervals[staff_id].add(start_time, end_time, timetable_id)
+
+    def periods_for(self, staff_id):
+        # (timetable_id, start_time, end_time) for the staff member, by start time
+        intervals = self._intervals.get(staff_id)
+        if intervals is None:
+            return []
+        return [(timetable_id, start_time, end_time)
+                for start_time, end_time, timetable_id in intervals.entries]
+
+    def is_free(self, staff_id, start_time, end_time):
+        if staff_id in self.on_leave:
+            return False
+        intervals = self._intervals.get(staff_id)
+        return intervals is None or intervals.is_free(start_time, end_time)
+
+    def free_staff(self, start_time, end_time):
+        # Each distinct slot is computed once and then maintained by move(),
+        # so repeated lookups for the same period times are a dict hit
+        key = (start_time, end_time)
+        free = self._free_cache.get(key)
+        if free is None:
+            free = [staff_id for staff_id in self.active_staff
+                    if self.is_free(staff_id, start_time, end_time)]
+            self._free_cache[key] = free
+        return free
+
+    def first_free(self, start_time, end_time, exclude=()):
+        for staff_id in self.free_staff(start_time, end_time):
+            if staff_id not in exclude:
+                return staff_id
+        return None
+
+    def mark_on_leave(self, staff_id):
+        if staff_id in self.on_leave:
+            return
+        self.on_leave.add(staff_id)
+        for free in self._free_cache.values():
+            self._discard(free, staff_id)
+
+    def move(self, timetable_id, new_staff_id):
+        # Record that a period now belongs to new_staff_id and update the
+        # cached free lists for every slot the move affects
+        old_staff_id, start_time, end_time = self._periods[timetable_id]
+        self._intervals[old_staff_id].remove(timetable_id)
+        self._add_period(timetable_id, new_staff_id, start_time, end_time)
+
+        for (slot_start, slot_end), free in self._free_cache.items():
+            if not overlaps(start_time, end_time, slot_start, slot_end):
+                continue
+            self._discard(free, new_staff_id)
+            if old_staff_id in self.on_leave or old_staff_id not in self._active_set:
+                continue
+            pos = bisect.bisect_left(free, old_staff_id)
+            if pos < len(free) and free[pos] == old_staff_id:
+                continue
+            if self.is_free(old_staff_id, slot_start, slot_end):
+                free.insert(pos, old_staff_id)
+
+    @staticmethod
+    def _discard(free, staff_id):
+        pos = bisect.bisect_left(free, staff_id)
+        if pos < len(free) and free[pos] == staff_id:
+            del free[pos]
@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+from migrations import migrate
+from attendance import rebuild_summary
+
+# Seeded synthetic data for benchmarking: staff spread over departments, a
+# clash-free weekly timetable, leave requests over a term and a login
+# history. The same arguments always produce the same database.
+#
+#   python bench/generate.py bench/bench.db --staff 2000 --leaves 5000
+
+DEPARTMENTS = ('Computer Science', 'Physics', 'Chemistry', 'Mathematics', 'English', 'History')
+DAY_ORDERS = ('I', 'II', 'III', 'IV', 'V', 'VI')
+SLOTS = (('09:00', '09:50'), ('09:50', '10:40'), ('11:00', '11:50'), ('11:50', '12:40'),
+         ('13:30', '14:20'), ('14:20', '15:10'), ('15:10', '16:00'))
+REASONS = ('Medical', 'Conference', 'Personal', 'Family function', 'Exam duty')
+
+# Every generated staff member can log in with this password
+PASSWORD = 'password'
+
+
+def department_names(count):
+    names = list(DEPARTMENTS[:count])
+    names += [f'Department {n}' for n in range(len(names) + 1, count + 1)]
+    return names
+
+
+def generate(path, staff=500, departments=6, periods_per_staff=12, leaves=1000,
+             logins=20000, term_start='2025-06-02', term_weeks=16, seed=1):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    migrate(conn)
+
+    # One hash shared by every row; hashing per row would dominate generation
+    hashed = generate_password_hash(PASSWORD)
+    departments = department_names(departments)
+    conn.executemany('''
+        INSERT INTO staff (name, email, password, department, phone)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(f'Staff {n:05d}', f'staff{n}@example.edu', hashed, departments[n % len(departments)],
+           f'9{rng.randrange(10 ** 9):09d}') for n in range(1, staff + 1)])
+
+    # Each staff member gets distinct (day, slot) pairs; rooms are handed out
+    # so no room is double-booked either
+    slots_per_week = len(DAY_ORDERS) * len(SLOTS)
+    periods_per_staff = min(periods_per_staff, slots_per_week)
+    rooms = max(10, staff * periods_per_staff // slots_per_week + 1)
+    free_rooms = {(day, slot): list(range(1, rooms + 1)) for day in DAY_ORDERS for slot in SLOTS}
+    for free in free_rooms.values():
+        rng.shuffle(free)
+    timetable = []
+    for staff_id in range(1, staff + 1):
+        for day, slot in rng.sample(sorted(free_rooms), periods_per_staff):
+            room = free_rooms[(day, slot)].pop() if free_rooms[(day, slot)] else None
+            timetable.append((staff_id, day, slot[0], slot[1],
+                              f'Room {room}' if room else None, f'Class {rng.randrange(1, 200)}'))
+    conn.executemany('''
+        INSERT INTO timetable (staff_id, day, start_time, end_time, location, class_name)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', timetable)
+
+    start = datetime.strptime(term_start, '%Y-%m-%d').date()
+    term_days = term_weeks * 7
+    leave_rows = set()
+    while len(leave_rows) < min(leaves, staff * term_days):
+        leave_date = start + timedelta(days=rng.randrange(term_days))
+        if leave_date.weekday() < 6:
+            leave_rows.add((rng.randrange(1, staff + 1), leave_date.isoformat()))
+    conn.executemany('''
+        INSERT INTO leave_requests (staff_id, leave_date, reason, status, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(staff_id, leave_date, rng.choice(REASONS),
+           rng.choices(('pending', 'approved', 'rejected'), (6, 3, 1))[0],
+           f'{leave_date} 08:{rng.randrange(60):02d}:00')
+          for staff_id, leave_date in sorted(leave_rows, key=lambda row: row[1])])
+    conn.execute('''
+        INSERT INTO attendance (staff_id, date, status, reason)
+        SELECT staff_id, leave_date, 'leave', reason FROM leave_requests WHERE status = 'approved'
+    ''')
+    rebuild_summary(conn)
+
+    # Logins over the term; nearly all sessions end with a logout
+    login_rows = []
+    for _ in range(logins):
+        login_time = datetime.combine(start, datetime.min.time()) + timedelta(
+            seconds=rng.randrange(term_days * 86400))
+        logout_time = login_time + timedelta(minutes=rng.randrange(5, 480))
+        admin = rng.random() < 0.02
+        login_rows.append((None if admin else rng.randrange(1, staff + 1), 1 if admin else None,
+                           login_time.strftime('%Y-%m-%d %H:%M:%S'),
+                           None if rng.random() < 0.01 else logout_time.strftime('%Y-%m-%d %H:%M:%S'),
+                           'admin' if admin else 'staff'))
+    login_rows.sort(key=lambda row: row[2])
+    conn.executemany('''
+        INSERT INTO login_logs (staff_id, admin_id, login_time, logout_time, session_type)
+        VALUES (?, ?, ?, ?, ?)
+    ''', login_rows)
+
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    return {'staff': staff, 'timetable': len(timetable), 'leaves': len(leave_rows),
+            'logins': len(login_rows), 'rooms': rooms}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fill a database with synthetic scheduler data.')
+    parser.add_argument('path', help='database file to (re)create')
+    parser.add_argument('--staff', type=int, default=500)
+    parser.add_argument('--departments', type=int, default=6)
+    parser.add_argument('--periods-per-staff', type=int, default=12)
+    parser.add_argument('--leaves', type=int, default=1000)
+    parser.add_argument('--logins', type=int, default=20000)
+    parser.add_argument('--term-start', default='2025-06-02')
+    parser.add_argument('--term-weeks', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    counts = generate(args.path, args.staff, args.departments, args.periods_per_staff, args.leaves,
+                      args.logins, args.term_start, args.term_weeks, args.seed)
+    print(', '.join(f'{value} {name}' for name, value in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate
+
+# Benchmarks for the scheduler at scale. A synthetic database is generated
+# (or an existing one reused), then each scenario drives a route through
+# Flask's test client or calls the reassignment code directly. For every
+# scenario we report latency percentiles, SQL statements per call and peak
+# Python memory, and compare against a saved baseline.
+#
+#   python bench/run.py --staff 2000 --save          # record bench/baseline.json
+#   python bench/run.py --staff 2000                 # compare against it
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of an already sorted list
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+class Bench:
+
+    def __init__(self, app_module, iterations, seed):
+        self.app = app_module
+        self.iterations = iterations
+        self.rng = random.Random(seed)
+        self.statements = 0
+        self.results = {}
+
+        # Count every SQL statement the app runs on its connections
+        connect_db = app_module.connect_db
+
+        def counting_connect(*args, **kwargs):
+            conn = connect_db(*args, **kwargs)
+            conn.set_trace_callback(self._count)
+            return conn
+
+        app_module.connect_db = counting_connect
+
+    def _count(self, statement):
+        if not statement.lstrip().upper().startswith('PRAGMA'):
+            self.statements += 1
+
+    def run(self, name, call, iterations=None):
+        iterations = iterations or self.iterations
+        call()  # warm-up: template compilation, lazily built state
+
+        latencies, statements = [], []
+        for _ in range(iterations):
+            before = self.statements
+            started = time.perf_counter()
+            call()
+            latencies.append((time.perf_counter() - started) * 1000)
+            statements.append(self.statements - before)
+
+        # Memory is measured on a separate call so tracing doesn't skew timings
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        latencies.sort()
+        statements.sort()
+        self.results[name] = {
+            'iterations': iterations,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+            'queries': statements[len(statements) // 2],
+            'peak_kib': round(peak / 1024, 1),
+        }
+        print(format_row(name, self.results[name]), flush=True)
+
+
+def format_row(name, result):
+    return (f"{name:<28} {result['iterations']:>5} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+            f"{result['p99_ms']:>9.2f} {result['max_ms']:>9.2f} {result['queries']:>7} "
+            f"{result['peak_kib']:>10.1f}")
+
+
+def get(client, url, expect=200, **kwargs):
+    response = client.get(url, **kwargs)
+    response.get_data()     # streamed pages render while the body is read
+    assert response.status_code == expect, (url, response.status_code)
+    return response
+
+
+def run_scenarios(bench, A, counts):
+    app = A.app
+    rng = bench.rng
+    staff_ids = range(1, counts['staff'] + 1)
+
+    admin = app.test_client()
+    admin.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+    staff = app.test_client()
+    staff.post('/staff/login', data={'email': 'staff1@example.edu', 'password': generate.PASSWORD})
+
+    conn = A.connect_db()
+    leave_dates = [row[0] for row in conn.execute(
+        "SELECT DISTINCT leave_date FROM leave_requests WHERE status = 'pending' ORDER BY leave_date")]
+    department = conn.execute('SELECT department FROM staff LIMIT 1').fetchone()[0]
+    A.rollup_logins(conn)
+    with app.app_context():
+        A.materialize_dates(leave_dates[0], leave_dates[-1])
+    conn.close()
+
+    # Reassignment, called directly and rolled back so every run plans the
+    # same day from the same state
+    def reassign(mode, absent_count):
+        def call():
+            leave_date = rng.choice(leave_dates)
+            with app.app_context():
+                db = A.get_db()
+                absent = rng.sample(staff_ids, absent_count)
+                A.reassign_for_date(db.cursor(), leave_date, absent, mode)
+                db.rollback()
+        return call
+
+    bench.run('reassign matching x1', reassign('matching', 1))
+    bench.run('reassign matching x10', reassign('matching', 10))
+    bench.run('reassign greedy x10', reassign('greedy', 10))
+
+    pending = [row[0] for row in A.connect_db().execute(
+        "SELECT id FROM leave_requests WHERE status = 'pending' ORDER BY id")]
+    rng.shuffle(pending)
+
+    def approve():
+        response = admin.post(f'/admin/leave/approve/{pending.pop()}')
+        assert response.status_code == 302
+
+    approvals = min(bench.iterations, len(pending) - 2)
+    bench.run('approve leave (route)', approve, approvals)
+    # Each approval queued one cover job; run them here (warm-up and the
+    # memory pass included) rather than on background threads
+    bench.run('cover job', lambda: A.jobs.run_one('bench'), approvals)
+
+    def dashboard_cold():
+        A.stats_cache.invalidate(*A.DASHBOARD_STATS)
+        get(admin, '/admin/dashboard')
+
+    bench.run('admin dashboard (cached)', lambda: get(admin, '/admin/dashboard'))
+    bench.run('admin dashboard (cold)', dashboard_cold)
+    bench.run('view staff', lambda: get(admin, '/admin/staff/view'))
+    bench.run('view timetable', lambda: get(admin, '/admin/timetable/view'))
+    bench.run('view timetable by dept', lambda: get(admin, '/admin/timetable/view',
+                                                   query_string={'department': department}))
+    bench.run('view timetable by date', lambda: get(admin, '/admin/timetable/view',
+                                                   query_string={'date': rng.choice(leave_dates)}))
+    bench.run('view leaves', lambda: get(admin, '/admin/leaves/view'))
+    bench.run('view logins', lambda: get(admin, '/admin/logins/view'))
+    bench.run('attendance overview', lambda: get(admin, '/admin/attendance',
+                                                query_string={'date': rng.choice(leave_dates)}))
+
+    def mark_department():
+        response = admin.post('/admin/attendance/department', data={
+            'date': rng.choice(leave_dates), 'department': department,
+            'status': rng.choice(('present', 'absent'))})
+        assert response.status_code == 302
+
+    bench.run('mark department', mark_department)
+    bench.run('view logins daily', lambda: get(admin, '/admin/logins/view', query_string={'view': 'daily'}))
+
+    bench.run('staff dashboard', lambda: get(staff, '/staff/dashboard'))
+    bench.run('staff schedule', lambda: get(staff, '/staff/schedule'))
+
+    def mark_attendance():
+        response = staff.post('/staff/attendance/mark', data={
+            'date': rng.choice(leave_dates), 'status': rng.choice(('present', 'absent'))})
+        assert response.status_code == 200
+
+    bench.run('mark attendance', mark_attendance)
+    etag = get(staff, '/api/staff/schedule').headers['ETag']
+    bench.run('api schedule (304)', lambda: get(staff, '/api/staff/schedule', expect=304,
+                                               headers={'If-None-Match': etag}))
+
+    # Password hashing makes logins slow by design; fewer rounds are enough
+    def login_logout():
+        client = app.test_client()
+        staff_id = rng.choice(staff_ids)
+        response = client.post('/staff/login', data={'email': f'staff{staff_id}@example.edu',
+                                                     'password': generate.PASSWORD})
+        assert response.status_code == 302
+        client.get('/staff/logout')
+
+    bench.run('staff login + logout', login_logout, min(bench.iterations, 10))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=HERE).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    # Scenarios whose median latency grew beyond the tolerance (and by more
+    # than min_delta_ms, so timer noise on fast routes is ignored) or that
+    # now run more SQL statements than the baseline
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p50_ms'] > max(before['p50_ms'] * (1 + tolerance), before['p50_ms'] + min_delta_ms):
+            regressions.append(f"{name}: p50 {before['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms")
+        if result['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {result['queries']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the scheduler on synthetic data.')
+    parser.add_argument('--db', help='use this database instead of generating a temporary one '
+                                     '(it is modified: leaves get approved)')
+    parser.add_argument('--staff', type=int, default=500)
+    parser.add_argument('--periods-per-staff', type=int, default=12)
+    parser.add_argument('--leaves', type=int, default=1000)
+    parser.add_argument('--logins', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--snapshot', action='store_true',
+                        help='serve read-only pages from the in-memory snapshot')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file to compare with')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p50 slowdown before a scenario counts as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                        help='ignore p50 slowdowns smaller than this')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='scheduler-bench-')
+    path = args.db or os.path.join(workdir, 'bench.db')
+    if args.db is None:
+        started = time.perf_counter()
+        counts = generate.generate(path, args.staff, periods_per_staff=args.periods_per_staff,
+                                   leaves=args.leaves, logins=args.logins, seed=args.seed)
+        print(f"Generated {', '.join(f'{value} {name}' for name, value in counts.items())} "
+              f'in {time.perf_counter() - started:.1f}s')
+    else:
+        conn = sqlite3.connect(path)
+        counts = {'staff': conn.execute('SELECT COUNT(*) FROM staff').fetchone()[0]}
+        conn.close()
+
+    import app as A
+    A.DATABASE = path
+    # Before init_db(), which installs the snapshot's triggers if enabled
+    A.app.config['SNAPSHOT_ENABLED'] = args.snapshot
+    A.init_db()
+    # Background jobs run inside scenarios, not on worker threads
+    A.jobs.workers = 0
+
+    bench = Bench(A, args.iterations, args.seed)
+    print(f"{'scenario':<28} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'queries':>7} {'peak KiB':>10}")
+    run_scenarios(bench, A, counts)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': {'staff': counts['staff'], 'periods_per_staff': args.periods_per_staff,
+                   'leaves': args.leaves, 'logins': args.logins, 'seed': args.seed,
+                   'iterations': args.iterations, 'snapshot': args.snapshot},
+        'results': bench.results,
+    }
+
+    status = 0
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != report['params']:
+            print(f'\nBaseline {args.baseline} was recorded with different parameters; not comparing')
+        else:
+            regressions = compare(bench.results, baseline['results'], args.tolerance, args.min_delta_ms)
+            print(f"\nCompared with baseline from commit {baseline.get('commit')}:")
+            for line in regressions:
+                print(f'  REGRESSION {line}')
+            if not regressions:
+                print('  no regressions')
+            status = 1 if regressions else 0
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'\nSaved baseline to {args.baseline}')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
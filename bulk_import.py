@@ -0,0 +1,193 @@
+import csv
+import io
+import json
+import multiprocessing
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from werkzeug.security import generate_password_hash
+
+from conflicts import ConflictIndex
+
+# Bulk import of staff and timetable rows from CSV or JSON. Every row is
+# validated before anything is written; valid rows are inserted with
+# executemany in chunked transactions and invalid ones are reported by row
+# number without stopping the rest of the batch.
+
+DAY_ORDERS = ('I', 'II', 'III', 'IV', 'V', 'VI')
+
+STAFF_FIELDS = ('name', 'email', 'password', 'department', 'phone')
+TIMETABLE_FIELDS = ('staff_email', 'day', 'start_time', 'end_time', 'location', 'class_name')
+
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+$')
+TIME_RE = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+
+# Below this many passwords a process pool costs more than it saves
+PARALLEL_HASH_THRESHOLD = 16
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []    # (row number, message); row 1 is the first data row
+        self.staff_ids = set()  # staff whose timetable the import touched
+
+    def error(self, row_number, message):
+        self.errors.append((row_number, message))
+
+
+def read_rows(data, filename=''):
+    # Rows as dicts from CSV text or a JSON list of objects
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json') or data.lstrip().startswith('['):
+        rows = json.loads(data)
+        if not isinstance(rows, list):
+            raise ValueError('JSON import must be a list of objects')
+        return [row if isinstance(row, dict) else {} for row in rows]
+    return list(csv.DictReader(io.StringIO(data)))
+
+
+def _clean(row, fields):
+    return {field: str(row.get(field) or '').strip() for field in fields}
+
+
+def hash_passwords(passwords, workers=None, method=None):
+    # method: werkzeug hash method and cost, None for werkzeug's default
+    generate = partial(generate_password_hash, method=method) if method else generate_password_hash
+    if len(passwords) < PARALLEL_HASH_THRESHOLD or workers == 1:
+        return [generate(password) for password in passwords]
+    # Spawned, not forked: imports run on a job thread of a worker that has
+    # other threads (and their locks) running
+    with ProcessPoolExecutor(workers, multiprocessing.get_context('spawn')) as pool:
+        chunksize = max(1, len(passwords) // ((workers or 4) * 4))
+        return list(pool.map(generate, passwords, chunksize=chunksize))
+
+
+def _insert_chunked(conn, sql, rows, row_numbers, chunk_size, result):
+    # executemany per chunk; a chunk that hits a constraint is retried row by
+    # row so only the offending rows are reported
+    for offset in range(0, len(rows), chunk_size):
+        chunk = rows[offset:offset + chunk_size]
+        try:
+            conn.executemany(sql, chunk)
+            conn.commit()
+            result.imported += len(chunk)
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            for row, row_number in zip(chunk, row_numbers[offset:offset + chunk_size]):
+                try:
+                    conn.execute(sql, row)
+                    result.imported += 1
+                except sqlite3.IntegrityError as exc:
+                    result.error(row_number, str(exc))
+            conn.commit()
+
+
+def _insert_routed(conn, route, sql, rows, row_numbers, chunk_size, result):
+    # With a route, each row is written through route(row) (e.g. the
+    # connection of its partition) instead of conn
+    if route is None:
+        _insert_chunked(conn, sql, rows, row_numbers, chunk_size, result)
+        return
+    groups = {}
+    for row, row_number in zip(rows, row_numbers):
+        group_rows, group_numbers = groups.setdefault(route(row), ([], []))
+        group_rows.append(row)
+        group_numbers.append(row_number)
+    for target, (group_rows, group_numbers) in groups.items():
+        _insert_chunked(target, sql, group_rows, group_numbers, chunk_size, result)
+
+
+def import_staff(conn, raw_rows, chunk_size=500, hash_workers=None, hash_method=None):
+    result = ImportResult()
+
+    existing = {row[0].lower() for row in conn.execute('SELECT email FROM staff')}
+    seen = set()
+    valid = []
+    for row_number, raw in enumerate(raw_rows, start=1):
+        row = _clean(raw, STAFF_FIELDS)
+        email = row['email'].lower()
+        if not row['name']:
+            result.error(row_number, 'name is required')
+        elif not EMAIL_RE.match(row['email']):
+            result.error(row_number, f"invalid email '{row['email']}'")
+        elif not row['password']:
+            result.error(row_number, 'password is required')
+        elif email in existing:
+            result.error(row_number, f"email '{row['email']}' already exists")
+        elif email in seen:
+            result.error(row_number, f"email '{row['email']}' appears more than once in the file")
+        else:
+            seen.add(email)
+            valid.append((row_number, row))
+
+    hashes = hash_passwords([row['password'] for _, row in valid], hash_workers, hash_method)
+
+    _insert_chunked(conn, '''
+        INSERT INTO staff (name, email, password, department, phone)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(row['name'], row['email'], hashed, row['department'] or None, row['phone'] or None)
+          for (_, row), hashed in zip(valid, hashes)],
+        [row_number for row_number, _ in valid], chunk_size, result)
+
+    result.errors.sort()
+    return result
+
+
+def import_timetable(conn, raw_rows, chunk_size=500, route=None):
+    # Staff are referenced by email (staff_email) or by id (staff_id)
+    result = ImportResult()
+
+    staff_by_email = {email.lower(): staff_id for staff_id, email in
+                      conn.execute('SELECT id, email FROM staff WHERE is_active = 1')}
+    active_ids = set(staff_by_email.values())
+
+    # Rows are checked against the existing timetable and against each other
+    clashes = ConflictIndex.load(conn)
+
+    valid = []
+    for row_number, raw in enumerate(raw_rows, start=1):
+        row = _clean(raw, TIMETABLE_FIELDS + ('staff_id',))
+        if row['staff_email']:
+            staff_id = staff_by_email.get(row['staff_email'].lower())
+        elif row['staff_id'].isdigit():
+            staff_id = int(row['staff_id'])
+            staff_id = staff_id if staff_id in active_ids else None
+        else:
+            staff_id = None
+
+        if staff_id is None:
+            result.error(row_number, 'unknown or inactive staff member')
+        elif row['day'] not in DAY_ORDERS:
+            result.error(row_number, f"day must be one of {', '.join(DAY_ORDERS)}")
+        elif not TIME_RE.match(row['start_time']) or not TIME_RE.match(row['end_time']):
+            result.error(row_number, 'times must be HH:MM')
+        elif row['start_time'] >= row['end_time']:
+            result.error(row_number, 'start_time must be before end_time')
+        else:
+            found = clashes.conflicts(staff_id, row['day'], row['start_time'], row['end_time'],
+                                      row['location'])
+            if found:
+                kind, (start, end, _, _) = found[0]
+                who = 'staff member' if kind == 'staff' else 'room'
+                result.error(row_number, f"{who} is already booked {start}-{end} on day {row['day']}")
+                continue
+            clashes.add(('import', row_number), staff_id, row['day'], row['start_time'],
+                        row['end_time'], row['location'])
+            valid.append((row_number, (staff_id, row['day'], row['start_time'], row['end_time'],
+                                       row['location'] or None, row['class_name'] or None)))
+
+    result.staff_ids.update(values[0] for _, values in valid)
+
+    _insert_routed(conn, route, '''
+        INSERT INTO timetable (staff_id, day, start_time, end_time, location, class_name)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [values for _, values in valid], [row_number for row_number, _ in valid],
+        chunk_size, result)
+
+    result.errors.sort()
+    return result
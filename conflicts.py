@@ -0,0 +1,94 @@
+from collections import defaultdict
+
+from availability import IntervalSet, overlaps
+
+# Timetable clash detection. A ConflictIndex keeps one sorted IntervalSet per
+# (staff, day) and per (location, day); checking a new or edited entry against
+# it is a binary search. find_all_conflicts() reports every clash in the whole
+# timetable with one sorted sweep.
+
+
+class ConflictIndex:
+
+    def __init__(self):
+        self._by_staff = defaultdict(IntervalSet)
+        self._by_room = defaultdict(IntervalSet)
+        self._class_names = {}
+
+    @classmethod
+    def load(cls, conn, staff_id=None, location=None, day=None):
+        # With staff_id/location/day only the rows that could clash with one
+        # entry are read (through the timetable indexes); without them the
+        # whole timetable is loaded, e.g. for validating a bulk import
+        index = cls()
+        columns = 'id, staff_id, day, start_time, end_time, location, class_name'
+        if day is None:
+            rows = conn.execute(f'SELECT {columns} FROM timetable').fetchall()
+        else:
+            rows = conn.execute(f'SELECT {columns} FROM timetable WHERE staff_id = ? AND day = ?',
+                                (staff_id, day)).fetchall()
+            if location:
+                rows += conn.execute(f'SELECT {columns} FROM timetable WHERE location = ? AND day = ?',
+                                     (location, day)).fetchall()
+        seen = set()
+        for row in rows:
+            if row[0] not in seen:
+                seen.add(row[0])
+                index.add(*row)
+        return index
+
+    def add(self, entry_id, staff_id, day, start_time, end_time, location=None, class_name=None):
+        self._class_names[entry_id] = class_name
+        self._by_staff[(staff_id, day)].add(start_time, end_time, entry_id)
+        if location:
+            self._by_room[(location, day)].add(start_time, end_time, entry_id)
+
+    def conflicts(self, staff_id, day, start_time, end_time, location=None, ignore_id=None):
+        # [(kind, (start_time, end_time, entry_id, class_name))] for every
+        # entry the proposed one would clash with; kind is 'staff' or 'room'
+        found = []
+        keyed = [('staff', self._by_staff.get((staff_id, day)))]
+        if location:
+            keyed.append(('room', self._by_room.get((location, day))))
+        for kind, intervals in keyed:
+            if intervals is None:
+                continue
+            for start, end, entry_id in intervals.overlapping(start_time, end_time):
+                if entry_id != ignore_id:
+                    found.append((kind, (start, end, entry_id, self._class_names.get(entry_id))))
+        return found
+
+
+def find_all_conflicts(conn):
+    # Every staff and room clash in the timetable, as dicts ready for display.
+    # Rows come back sorted per (key, day, start_time); a sweep that tracks
+    # the entry reaching furthest so far finds each clashing entry in
+    # O(n log n) overall.
+    clashes = []
+    for kind, key_column in (('staff', 't.staff_id'), ('room', 't.location')):
+        where = 'WHERE t.location IS NOT NULL AND t.location != \'\'' if kind == 'room' else ''
+        rows = conn.execute(f'''
+            SELECT t.id, {key_column} AS clash_key, t.day, t.start_time, t.end_time,
+                   t.location, t.class_name, s.name
+            FROM timetable t JOIN staff s ON t.staff_id = s.id
+            {where}
+            ORDER BY {key_column}, t.day, t.start_time, t.id
+        ''')
+        group = None
+        reach = None
+        for row in rows:
+            if (row['clash_key'], row['day']) != group:
+                group = (row['clash_key'], row['day'])
+                reach = row
+                continue
+            if overlaps(row['start_time'], row['end_time'], reach['start_time'], reach['end_time']):
+                clashes.append({
+                    'kind': kind,
+                    'day': row['day'],
+                    'who': row['name'] if kind == 'staff' else row['location'],
+                    'first': dict(reach),
+                    'second': dict(row),
+                })
+            if row['end_time'] > reach['end_time']:
+                reach = row
+    return clashes
@@ -0,0 +1,157 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Live events for the admin pages. Write paths publish() a small JSON event
+# after they commit; each open /admin/events stream holds a bounded queue
+# that the hub fans events out to. With shared=True every event is also
+# written to the events table and a background thread in each worker tails
+# it, so a login handled by one gunicorn worker reaches dashboards connected
+# to any other.
+
+
+class Subscription:
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.lagged = False     # set when events were dropped for this client
+
+
+def format_event(event_id, kind, data):
+    lines = [] if event_id is None else [f'id: {event_id}']
+    lines.append(f'event: {kind}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class EventHub:
+
+    def __init__(self, connect=None, shared=False, poll_interval=1.0, backlog=256,
+                 queue_size=100, retention=1000):
+        self.connect = connect
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.retention = retention
+        self._recent = deque(maxlen=backlog)    # (id, kind, data) kept for Last-Event-ID resume
+        self._subscribers = set()
+        self._own = set()       # ids this worker already delivered, skipped by the tail
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._tail = None
+
+    def publish(self, kind, data, conn=None):
+        if self.shared and conn is not None:
+            event_id = conn.execute('INSERT INTO events (kind, data) VALUES (?, ?)',
+                                    (kind, json.dumps(data))).lastrowid
+            if event_id % 100 == 0:
+                conn.execute('DELETE FROM events WHERE id <= ?', (event_id - self.retention,))
+            # Recorded before the commit, which the tail could otherwise
+            # see first and deliver the event a second time
+            with self._lock:
+                if self._tail is not None:
+                    self._own.add(event_id)
+            try:
+                conn.commit()
+            except BaseException:
+                with self._lock:
+                    self._own.discard(event_id)
+                raise
+        else:
+            with self._lock:
+                self._last_id += 1
+                event_id = self._last_id
+        self._dispatch((event_id, kind, data))
+        return event_id
+
+    def _dispatch(self, event):
+        with self._lock:
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # A stalled client never holds up the publisher; it is told
+                # to reload once it catches up instead
+                sub.lagged = True
+
+    def subscribe(self, last_event_id=None):
+        if self.shared:
+            self._start_tail()
+        sub = Subscription(self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                missed = [event for event in self._recent if event[0] > last_event_id]
+                if self._recent and len(self._recent) == self._recent.maxlen \
+                        and self._recent[0][0] > last_event_id + 1:
+                    sub.lagged = True
+                for event in missed[-self.queue_size:]:
+                    sub.queue.put_nowait(event)
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, sub, heartbeat=15):
+        # Server-sent event text for one subscriber; comments keep idle
+        # connections open through proxies
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                if sub.lagged:
+                    yield format_event(None, 'reset', {})
+                    return
+                try:
+                    event = sub.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_event(*event)
+        finally:
+            self.unsubscribe(sub)
+
+    def _start_tail(self):
+        with self._lock:
+            if self._tail is not None:
+                return
+            self._tail = threading.Thread(target=self._tail_events, name='event-tail', daemon=True)
+        self._tail.start()
+
+    def _tail_events(self):
+        try:
+            conn = self.connect()
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    rows = conn.execute('SELECT id, kind, data FROM events WHERE id > ? ORDER BY id',
+                                        (last_id,)).fetchall()
+                except sqlite3.Error:
+                    continue
+                for event_id, kind, data in rows:
+                    last_id = event_id
+                    with self._lock:
+                        own = event_id in self._own
+                        self._own.discard(event_id)
+                    if not own:
+                        self._dispatch((event_id, kind, json.loads(data)))
+                # Ids at or below last_id will never be read again (one
+                # published while the tail started, or whose commit came
+                # after a later id's), so the set can't grow without bound
+                with self._lock:
+                    self._own = {event_id for event_id in self._own if event_id > last_id}
+        finally:
+            # The next subscribe() starts a new tail from the newest event
+            with self._lock:
+                self._tail = None
+                self._own.clear()
@@ -0,0 +1,172 @@
+import csv
+import io
+import os
+import tempfile
+
+try:
+    import openpyxl
+except ImportError:     # XLSX export is optional
+    openpyxl = None
+
+# Term-long exports of attendance, leave and reassignment history for
+# accreditation and payroll. Rows are read from one cursor in fixed-size
+# fetchmany() batches and written out batch by batch, so memory stays flat
+# however many rows the export covers. Each query walks an index in its
+# ORDER BY, so SQLite never has to sort the whole result first; CROSS JOIN
+# keeps the planner from starting at staff for a department filter, which
+# would need exactly that sort.
+
+BATCH_SIZE = 1000
+
+
+def _period(column):
+    # A covered period's column as taught on the date, falling back to the
+    # weekly timetable
+    return (f'COALESCE((SELECT o.{column} FROM timetable_occurrences o '
+            f'WHERE o.date = r.leave_date AND o.timetable_id = r.timetable_id), '
+            f'(SELECT t.{column} FROM timetable t WHERE t.id = r.timetable_id))')
+
+
+EXPORTS = {
+    'attendance': {
+        'sql': '''
+            SELECT a.date, s.name, s.email, s.department, a.status, a.reason, a.created_at
+            FROM attendance a
+            CROSS JOIN staff s ON s.id = a.staff_id
+        ''',
+        'date_column': 'a.date',
+        'department_column': 's.department',
+        'order_by': 'a.date, a.staff_id',
+        'headers': ('Date', 'Staff', 'Email', 'Department', 'Status', 'Reason', 'Recorded At'),
+    },
+    'leaves': {
+        'sql': '''
+            SELECT l.leave_date, s.name, s.email, s.department, l.reason, l.status, l.created_at
+            FROM leave_requests l
+            CROSS JOIN staff s ON s.id = l.staff_id
+        ''',
+        'date_column': 'l.leave_date',
+        'department_column': 's.department',
+        'order_by': 'l.leave_date',
+        'headers': ('Leave Date', 'Staff', 'Email', 'Department', 'Reason', 'Status', 'Requested At'),
+    },
+    'reassignments': {
+        # Past occurrences keep the period as it was taught; older cover
+        # predating the term calendar falls back to the weekly timetable
+        'sql': f'''
+            SELECT r.leave_date, original.name, original.department, cover.name,
+                   {_period('start_time')}, {_period('end_time')},
+                   {_period('class_name')}, {_period('location')},
+                   r.created_at
+            FROM reassignments r
+            JOIN staff original ON original.id = r.original_staff_id
+            JOIN staff cover ON cover.id = r.new_staff_id
+        ''',
+        'date_column': 'r.leave_date',
+        'department_column': 'original.department',
+        'order_by': 'r.leave_date',
+        'headers': ('Date', 'Absent Staff', 'Department', 'Covered By', 'Start', 'End',
+                    'Class', 'Location', 'Arranged At'),
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def export_query(kind, start_date=None, end_date=None, department=None):
+    # (sql, params) for one export with optional inclusive date range and
+    # department filters
+    export = EXPORTS[kind]
+    where, params = [], []
+    if start_date:
+        where.append(f"{export['date_column']} >= ?")
+        params.append(start_date)
+    if end_date:
+        where.append(f"{export['date_column']} <= ?")
+        params.append(end_date)
+    if department:
+        where.append(f"{export['department_column']} = ?")
+        params.append(department)
+    sql = export['sql']
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return sql + f" ORDER BY {export['order_by']}", params
+
+
+def export_batches(conn, kind, start_date=None, end_date=None, department=None, batch_size=BATCH_SIZE):
+    # Lists of at most batch_size rows, read lazily from a single cursor
+    sql, params = export_query(kind, start_date, end_date, department)
+    cursor = conn.cursor()
+    cursor.arraysize = batch_size
+    cursor.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+def csv_chunks(headers, batches):
+    # One encoded chunk per batch; the buffer is reused so only the current
+    # batch is ever held as text
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def xlsx_chunks(headers, batches, chunk_size=64 * 1024):
+    # An XLSX file is a zip that can only be finished once every row is in,
+    # so rows go through openpyxl's write-only workbook (which spools them to
+    # disk) and the saved file is then sent in chunks
+    if openpyxl is None:
+        raise RuntimeError('XLSX export needs openpyxl (pip install openpyxl)')
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(headers)
+    for rows in batches:
+        for row in rows:
+            sheet.append(tuple(row))
+
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def export_chunks(conn, kind, fmt='csv', start_date=None, end_date=None, department=None,
+                  batch_size=BATCH_SIZE):
+    batches = export_batches(conn, kind, start_date, end_date, department, batch_size)
+    headers = EXPORTS[kind]['headers']
+    if fmt == 'xlsx':
+        return xlsx_chunks(headers, batches)
+    return csv_chunks(headers, batches)
+
+
+def export_filename(kind, fmt, start_date=None, end_date=None, department=None):
+    parts = [kind]
+    if department:
+        parts.append(''.join(ch if ch.isalnum() else '-' for ch in department))
+    if start_date or end_date:
+        parts.append(f"{start_date or 'start'}_{end_date or 'end'}")
+    return '_'.join(parts) + f'.{fmt}'
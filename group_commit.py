@@ -0,0 +1,129 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+# Group commit for small, frequent writes (login records, attendance marks).
+# Request threads submit a write as a function of a connection and wait on
+# the returned Future. One writer thread per process collects submissions
+# for up to max_delay_ms or max_rows, runs them in a single transaction
+# (each inside its own savepoint, so one failing write doesn't sink the
+# others) and commits once. Futures resolve only after that commit, so a
+# caller's acknowledgement means its row is as durable as any other commit;
+# a failed commit fails every write in the batch. A caller that stops
+# waiting withdraws its write if the writer hasn't picked it up yet.
+
+log = logging.getLogger('group_commit')
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class GroupCommitWriter:
+
+    def __init__(self, connect, max_rows=100, max_delay_ms=5):
+        self.connect = connect
+        self.max_rows = max_rows
+        self.max_delay_ms = max_delay_ms
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, write):
+        # write(conn) runs on the writer's connection and must not commit;
+        # the Future gets its return value once the batch has committed
+        future = Future()
+        self._start()
+        self._queue.put((write, future))
+        return future
+
+    def write(self, write, timeout=None):
+        # write's result once committed; raises WriterBusy if that takes
+        # longer than timeout seconds
+        future = self.submit(write)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # Only succeeds if the writer hasn't reached it; otherwise the
+            # row may still be committed after we give up on it
+            future.cancel()
+            raise WriterBusy()
+
+    def _start(self):
+        # One writer thread per process, started on first use (and again in
+        # a forked child, which doesn't inherit the parent's thread)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._work, args=(self._queue,),
+                                                name='group-commit', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _collect(self, pending):
+        # Block for the first write, then gather more until the batch is full
+        # or max_delay_ms has passed since the first one arrived
+        batch = [pending.get()]
+        deadline = time.monotonic() + self.max_delay_ms / 1000
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self, pending):
+        conn = None
+        while True:
+            # Writes whose caller already gave up are dropped here
+            batch = [(write, future) for write, future in self._collect(pending)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                if conn is None:
+                    conn = self.connect()
+                results = self._write(conn, batch)
+            except Exception as exc:
+                log.exception('group commit of %d writes failed', len(batch))
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            for (_, future), (ok, value) in zip(batch, results):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _write(self, conn, batch):
+        # Take the write lock up front so writes that read first (attendance
+        # adjusts the summary from the previous status) can't hit a busy
+        # snapshot halfway through the batch
+        conn.execute('BEGIN IMMEDIATE')
+        results = []
+        for write, _ in batch:
+            conn.execute('SAVEPOINT group_write')
+            try:
+                value = write(conn)
+            except Exception as exc:
+                conn.execute('ROLLBACK TO group_write')
+                results.append((False, exc))
+            else:
+                results.append((True, value))
+            conn.execute('RELEASE group_write')
+        conn.commit()
+        return results
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+
+# Durable background jobs in the jobs table. A job is enqueued inside the
+# transaction of the write that needs it, so it exists exactly when that
+# write committed. Worker threads claim one job at a time with a lease;
+# the handler's writes and the job's completion commit together, and a
+# failure rolls the handler back and schedules a retry with backoff. Jobs
+# left running by a worker that died are claimed again once their lease
+# expires, so handlers must be safe to run twice. Optional keys make
+# enqueueing idempotent: a second job with the same key is not created.
+
+log = logging.getLogger('jobs')
+
+
+class JobQueue:
+
+    def __init__(self, session, workers=2, poll_interval=2.0, lease_seconds=300,
+                 max_attempts=5, retry_seconds=10, retention_days=30):
+        # session() is a context manager yielding the connection one job
+        # runs on, and closing it afterwards
+        self.session = session
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.retention_days = retention_days
+        self._handlers = {}     # kind -> (handler, after_commit, keep_payload)
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._last_prune = 0.0
+        self._known_keys = {}   # key -> id of a job already found in the table
+
+    def handler(self, kind, after_commit=None, keep_payload=True):
+        # Register handler(conn, payload) -> JSON-able result for a job kind.
+        # It must not commit; after_commit(result) runs once the job is done.
+        # keep_payload=False clears the payload once the job is done or has
+        # failed for good, for payloads that shouldn't stay in the table.
+        def register(fn):
+            self._handlers[kind] = (fn, after_commit, keep_payload)
+            return fn
+        return register
+
+    def enqueue(self, conn, kind, payload=None, key=None, max_attempts=None, delay=0):
+        # Returns the job id, or the existing job's id when `key` was used
+        # before. The caller commits, then calls wake(). Once a key has been
+        # found taken it is remembered, so repeats don't touch the database.
+        if key is not None and key in self._known_keys:
+            return self._known_keys[key]
+        cursor = conn.execute('''
+            INSERT INTO jobs (kind, key, payload, max_attempts, run_after)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO NOTHING
+        ''', (kind, key, json.dumps(payload), max_attempts or self.max_attempts, time.time() + delay))
+        if cursor.rowcount:
+            # Not remembered yet: the caller may still roll this insert back
+            return cursor.lastrowid
+        job_id = conn.execute('SELECT id FROM jobs WHERE key = ?', (key,)).fetchone()[0]
+        if len(self._known_keys) >= 1024:
+            self._known_keys.clear()
+        self._known_keys[key] = job_id
+        return job_id
+
+    def wake(self):
+        self._wakeup.set()
+
+    def get(self, conn, job_ids):
+        # {id: status dict} for the given jobs
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        placeholders = ', '.join('?' * len(job_ids))
+        rows = conn.execute(f'''
+            SELECT id, kind, status, attempts, max_attempts, result, error, created_at, finished_at
+            FROM jobs WHERE id IN ({placeholders})
+        ''', job_ids).fetchall()
+        return {row[0]: {'id': row[0], 'kind': row[1], 'status': row[2], 'attempts': row[3],
+                         'max_attempts': row[4], 'result': json.loads(row[5]) if row[5] else None,
+                         'error': row[6], 'created_at': row[7], 'finished_at': row[8]}
+                for row in rows}
+
+    def start(self):
+        # Start the worker threads once per process; cheap to call per request
+        if self._threads or self.workers <= 0:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self.work, args=(f'{os.getpid()}-{number}',),
+                                          name=f'job-worker-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _claim(self, conn, worker):
+        # Atomically take the oldest due job, or one whose lease ran out
+        now = time.time()
+        row = conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                locked_by = ?, locked_until = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE (status = 'queued' AND run_after <= ?)
+                   OR (status = 'running' AND locked_until < ?)
+                ORDER BY run_after, id LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts, max_attempts
+        ''', (worker, now + self.lease_seconds, now, now)).fetchone()
+        conn.commit()
+        return row
+
+    def run_one(self, worker='inline'):
+        # Claim and run a single job; returns its id, or None if none was due
+        with self.session() as conn:
+            return self._run(conn, worker)
+
+    def _run(self, conn, worker):
+        job = self._claim(conn, worker)
+        if job is None:
+            return None
+        job_id, kind, payload, attempts, max_attempts = job
+        handler, after_commit, keep_payload = self._handlers.get(kind, (None, None, True))
+        try:
+            if handler is None:
+                raise LookupError(f'no handler for job kind {kind!r}')
+            result = handler(conn, json.loads(payload))
+            conn.execute('''
+                UPDATE jobs SET status = 'done', result = ?, error = NULL,
+                    payload = CASE WHEN ? THEN payload END,
+                    locked_by = NULL, locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (json.dumps(result), keep_payload, job_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            error = traceback.format_exc(limit=5)
+            if attempts >= max_attempts:
+                conn.execute('''
+                    UPDATE jobs SET status = 'failed', error = ?, locked_by = NULL,
+                        payload = CASE WHEN ? THEN payload END,
+                        locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (error, keep_payload, job_id))
+            else:
+                conn.execute('''
+                    UPDATE jobs SET status = 'queued', error = ?, locked_by = NULL,
+                        locked_until = NULL, run_after = ?
+                    WHERE id = ?
+                ''', (error, time.time() + self.retry_seconds * 2 ** (attempts - 1), job_id))
+            conn.commit()
+            return job_id
+
+        if after_commit is not None:
+            try:
+                after_commit(result)
+            except Exception:
+                log.exception('after_commit for job %s failed', job_id)
+        return job_id
+
+    def run_pending(self, worker='inline'):
+        # Run due jobs in the calling thread until none are left
+        count = 0
+        while self.run_one(worker) is not None:
+            count += 1
+        return count
+
+    def prune(self, conn):
+        # Forget finished jobs older than the retention window
+        conn.execute('''
+            DELETE FROM jobs WHERE status IN ('done', 'failed')
+            AND finished_at < datetime('now', ?)
+        ''', (f'-{int(self.retention_days)} days',))
+        conn.commit()
+
+    def work(self, worker):
+        # Worker loop; runs forever in a worker thread or `flask run-jobs`
+        while True:
+            try:
+                while self.run_one(worker) is not None:
+                    pass
+                if time.time() - self._last_prune > 3600:
+                    self._last_prune = time.time()
+                    with self.session() as conn:
+                        self.prune(conn)
+            except Exception:
+                # Most likely a busy database; the job's lease brings it
+                # back, so just try again on the next round
+                log.exception('job worker %s', worker)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+# Login activity: raw sessions live in login_logs only for the retention
+# window. login_daily_summary (one row per day, session type and user) is
+# kept current by each login and logout, and it is what the dashboard and the
+# daily view read. rollup_logins() recomputes it from the raw rows, and
+# archive_logins() moves older raw rows to login_logs_archive, so the hot
+# table stays small.
+
+
+def record_login(conn, session_type, staff_id=None, admin_id=None):
+    cursor = conn.execute('''
+        INSERT INTO login_logs (staff_id, admin_id, session_type)
+        VALUES (?, ?, ?)
+    ''', (staff_id, admin_id, session_type))
+    conn.execute('''
+        INSERT INTO login_daily_summary
+            (day, session_type, user_id, login_count, first_login, last_login, open_sessions)
+        SELECT date(login_time), session_type, COALESCE(staff_id, admin_id), 1, login_time, login_time, 1
+        FROM login_logs WHERE id = ?
+        ON CONFLICT(day, session_type, user_id) DO UPDATE SET
+            login_count = login_count + 1,
+            last_login = excluded.last_login,
+            open_sessions = open_sessions + 1
+    ''', (cursor.lastrowid,))
+    return cursor.lastrowid
+
+
+def record_logout(conn, log_id):
+    closed = conn.execute('''
+        UPDATE login_logs SET logout_time = CURRENT_TIMESTAMP
+        WHERE id = ? AND logout_time IS NULL
+    ''', (log_id,)).rowcount
+    if closed:
+        conn.execute('''
+            UPDATE login_daily_summary SET
+                open_sessions = MAX(open_sessions - 1, 0),
+                session_seconds = session_seconds + CAST(
+                    (julianday(l.logout_time) - julianday(l.login_time)) * 86400 AS INTEGER)
+            FROM login_logs l
+            WHERE l.id = ? AND login_daily_summary.day = date(l.login_time)
+              AND login_daily_summary.session_type = l.session_type
+              AND login_daily_summary.user_id = COALESCE(l.staff_id, l.admin_id)
+        ''', (log_id,))
+
+
+def summarize_logins(conn, since):
+    # Replace the daily summaries of days from `since` with ones computed from
+    # login_logs; returns the rows written. The caller commits.
+    return conn.execute('''
+        INSERT OR REPLACE INTO login_daily_summary
+            (day, session_type, user_id, login_count, first_login, last_login, session_seconds,
+             open_sessions)
+        SELECT date(login_time), session_type, COALESCE(staff_id, admin_id),
+               COUNT(*), MIN(login_time), MAX(login_time),
+               CAST(COALESCE(SUM((julianday(logout_time) - julianday(login_time)) * 86400), 0) AS INTEGER),
+               SUM(logout_time IS NULL)
+        FROM login_logs
+        WHERE login_time >= ?
+        GROUP BY date(login_time), session_type, COALESCE(staff_id, admin_id)
+    ''', (since,)).rowcount
+
+
+def rollup_logins(conn, since=None):
+    # Recompute daily summaries from the last summarized day onwards (or from
+    # `since`), correcting any drift in the counts kept by logins and
+    # logouts. Re-running is safe: each day's rows are replaced, not added to.
+    if since is None:
+        since = conn.execute('SELECT MAX(day) FROM login_daily_summary').fetchone()[0] or ''
+
+    rows = summarize_logins(conn, since)
+    conn.commit()
+    return rows
+
+
+def archive_logins(conn, retention_days):
+    # Move raw rows older than the retention window into login_logs_archive.
+    # The days being archived are rolled up first so no history is lost.
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+
+    oldest = conn.execute('SELECT MIN(login_time) FROM login_logs WHERE login_time < ?',
+                          (cutoff,)).fetchone()[0]
+    if oldest is None:
+        return 0
+    rollup_logins(conn, since=oldest[:10])
+
+    conn.execute('''
+        INSERT INTO login_logs_archive
+            (id, staff_id, admin_id, login_time, logout_time, session_type)
+        SELECT id, staff_id, admin_id, login_time, logout_time, session_type
+        FROM login_logs WHERE login_time < ?
+    ''', (cutoff,))
+    moved = conn.execute('DELETE FROM login_logs WHERE login_time < ?', (cutoff,)).rowcount
+    conn.commit()
+    return moved
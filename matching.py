@@ -0,0 +1,116 @@
+import heapq
+
+
+def overlap_groups(periods):
+    # Split (timetable_id, original_staff_id, start_time, end_time) periods,
+    # in time order, into groups that all overlap one another (they share
+    # the moment just after the group's latest start). Within a group a
+    # teacher can cover one period only; across groups only the periods that
+    # really overlap exclude each other, which the availability index
+    # enforces as cover is assigned.
+    groups = []
+    group_end = None
+    for period in sorted(periods, key=lambda period: (period[2], period[3])):
+        if group_end is not None and period[2] < group_end:
+            groups[-1].append(period)
+            group_end = min(group_end, period[3])
+        else:
+            groups.append([period])
+            group_end = period[3]
+    return groups
+
+
+def max_matching(lefts, candidates):
+    # Maximum bipartite matching (Kuhn's augmenting paths). Candidate lists
+    # are tried in order, so cheaper cover is kept wherever the maximum
+    # allows it.
+    match_left = {}
+    match_right = {}
+
+    for left in lefts:
+        for right in candidates[left]:
+            if right not in match_right:
+                match_left[left] = right
+                match_right[right] = left
+                break
+
+    for left in lefts:
+        if left in match_left:
+            continue
+
+        visited = set()
+        stack = [(left, iter(candidates[left]))]
+        via = []
+        while stack:
+            node, options = stack[-1]
+            for right in options:
+                if right in visited:
+                    continue
+                visited.add(right)
+                via.append(right)
+                owner = match_right.get(right)
+                if owner is None:
+                    for (path_left, _), path_right in zip(stack, via):
+                        match_left[path_left] = path_right
+                        match_right[path_right] = path_left
+                    stack = []
+                else:
+                    stack.append((owner, iter(candidates[owner])))
+                break
+            else:
+                stack.pop()
+                if via:
+                    via.pop()
+
+    return match_left
+
+
+def solve_cover(index, periods, absent, departments, weekly_load,
+                department_weight=1.0, load_weight=1.0):
+    """Assign cover for a day's periods, one overlap group at a time.
+
+    periods holds (timetable_id, original_staff_id, start_time, end_time).
+    Each group of mutually overlapping periods is matched in turn, in time
+    order, against the staff still free for them; candidates are ranked by
+    their cover load this week and day and by whether they share the absent
+    teacher's department. Each group gets a maximum matching, but the day as
+    a whole is a greedy heuristic: a group's choices are fixed before later
+    groups are seen, so where groups share a period's time a different
+    earlier choice could sometimes cover more. When periods keep to common
+    slots the groups are disjoint and nothing is lost. Moves are applied to
+    the AvailabilityIndex as they are decided, so later groups see them, and
+    returned as (original_staff_id, new_staff_id, timetable_id) tuples.
+    """
+    day_load = {}
+    assignments = []
+
+    def cost(staff_id, department):
+        load = weekly_load.get(staff_id, 0) + day_load.get(staff_id, 0)
+        mismatch = departments.get(staff_id) != department
+        return (load_weight * load + department_weight * mismatch, staff_id)
+
+    for group in overlap_groups(periods):
+        # Keeping only the len(group) cheapest candidates per period cannot
+        # shrink the maximum matching, and keeps the graph small
+        width = len(group)
+        candidates = {}
+        for timetable_id, original_staff_id, start_time, end_time in group:
+            department = departments.get(original_staff_id)
+            free = [staff_id for staff_id in index.free_staff(start_time, end_time)
+                    if staff_id not in absent]
+            candidates[timetable_id] = heapq.nsmallest(
+                width, free, key=lambda staff_id: cost(staff_id, department))
+
+        # Most constrained periods go first in the greedy seeding pass
+        lefts = sorted(candidates, key=lambda timetable_id: len(candidates[timetable_id]))
+        matched = max_matching(lefts, candidates)
+
+        for timetable_id, original_staff_id, _, _ in group:
+            new_staff_id = matched.get(timetable_id)
+            if new_staff_id is None:
+                continue
+            index.move(timetable_id, new_staff_id)
+            day_load[new_staff_id] = day_load.get(new_staff_id, 0) + 1
+            assignments.append((original_staff_id, new_staff_id, timetable_id))
+
+    return assignments
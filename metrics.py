@@ -0,0 +1,221 @@
+import bisect
+import logging
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from time import perf_counter
+
+# Request, template and SQL instrumentation, exported in Prometheus text
+# format. Connections made with InstrumentedConnection time every statement
+# they execute (and the fetch calls that follow it) and report it to a
+# Metrics registry under the statement's normalized text and the route that
+# ran it. Counters live in the process, so each gunicorn worker reports its
+# own figures; Prometheus sums them across scrape targets.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('slow_queries')
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def normalize_sql(sql):
+    # Collapse whitespace and placeholder lists so the same statement built
+    # for a different number of ids is counted once
+    return _IN_LIST.sub('(?, ...)', ' '.join(sql.split()))
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+class Metrics:
+
+    def __init__(self, slow_query_ms=None, max_statements=500, buckets=DEFAULT_BUCKETS):
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)           # (endpoint, method, status) -> count
+        self._request_seconds = {}                  # endpoint -> Histogram
+        self._render_seconds = {}                   # endpoint -> Histogram
+        self._route_sql = defaultdict(lambda: [0, 0.0])        # endpoint -> [statements, seconds]
+        self._statement_sql = defaultdict(lambda: [0, 0.0])    # normalized sql -> [statements, seconds]
+        self._normalized = {}                       # raw sql -> normalized, bounded
+        self._slow_queries = 0
+
+    def _statement_key(self, sql):
+        key = self._normalized.get(sql)
+        if key is None:
+            key = normalize_sql(sql)
+            if key not in self._statement_sql and len(self._statement_sql) >= self.max_statements:
+                key = 'other'
+            if len(self._normalized) < self.max_statements * 4:
+                self._normalized[sql] = key
+        return key
+
+    def record_sql(self, route, sql, seconds, statements=1):
+        route = route or 'background'
+        with self._lock:
+            key = self._statement_key(sql)
+            by_route = self._route_sql[route]
+            by_route[0] += statements
+            by_route[1] += seconds
+            by_statement = self._statement_sql[key]
+            by_statement[0] += statements
+            by_statement[1] += seconds
+        if self.slow_query_ms is not None and seconds * 1000 >= self.slow_query_ms:
+            with self._lock:
+                self._slow_queries += 1
+            slow_query_log.warning('%.1f ms %s in %s: %s', seconds * 1000,
+                                   'executing' if statements else 'fetching', route, normalize_sql(sql))
+
+    def observe_request(self, endpoint, method, status, seconds=None):
+        endpoint = endpoint or 'unmatched'
+        with self._lock:
+            self._requests[(endpoint, method, status)] += 1
+            if seconds is not None:
+                self._histogram(self._request_seconds, endpoint).observe(seconds)
+
+    def observe_render(self, endpoint, seconds):
+        with self._lock:
+            self._histogram(self._render_seconds, endpoint or 'unmatched').observe(seconds)
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def render(self, gauges=None):
+        # Prometheus text exposition format
+        lines = []
+        with self._lock:
+            lines.append('# HELP scheduler_http_requests_total Requests handled, by route and status.')
+            lines.append('# TYPE scheduler_http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'scheduler_http_requests_total{{endpoint="{_label(endpoint)}",'
+                             f'method="{method}",status="{status}"}} {count}')
+
+            for name, help_text, histograms in (
+                    ('scheduler_http_request_duration_seconds',
+                     'Time from request start to the end of the response body.', self._request_seconds),
+                    ('scheduler_template_render_seconds',
+                     'Template rendering time, including rows read while streaming.', self._render_seconds)):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.lines(name, f'endpoint="{_label(endpoint)}"'))
+
+            for name, label, help_text, totals in (
+                    ('scheduler_route_sql', 'endpoint', 'SQL statements run per route', self._route_sql),
+                    ('scheduler_sql', 'statement', 'SQL statements by normalized text', self._statement_sql)):
+                lines.append(f'# HELP {name}_statements_total {help_text}.')
+                lines.append(f'# TYPE {name}_statements_total counter')
+                for key, (count, _) in sorted(totals.items()):
+                    lines.append(f'{name}_statements_total{{{label}="{_label(key)}"}} {count}')
+                lines.append(f'# HELP {name}_seconds_total Time spent executing and fetching them.')
+                lines.append(f'# TYPE {name}_seconds_total counter')
+                for key, (_, seconds) in sorted(totals.items()):
+                    lines.append(f'{name}_seconds_total{{{label}="{_label(key)}"}} {seconds:.6f}')
+
+            lines.append('# HELP scheduler_slow_queries_total Executes or fetches slower than SLOW_QUERY_MS.')
+            lines.append('# TYPE scheduler_slow_queries_total counter')
+            lines.append(f'scheduler_slow_queries_total {self._slow_queries}')
+
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Execute and fetch calls are timed; rows read by iterating the cursor
+    # directly are not, to keep per-row overhead at zero
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        started = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.record(sql, perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        started = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.record(sql, perf_counter() - started)
+
+    def _timed_fetch(self, fetch, *args):
+        started = perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._sql is not None:
+                self.connection.record(self._sql, perf_counter() - started, statements=0)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Pass as sqlite3.connect(..., factory=InstrumentedConnection), then set
+    # .metrics (and .route for connections serving a request)
+
+    metrics = None
+    route = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = perf_counter()
+        try:
+            return super().commit()
+        finally:
+            self.record('COMMIT', perf_counter() - started)
+
+    def record(self, sql, seconds, statements=1):
+        if self.metrics is not None:
+            self.metrics.record_sql(self.route, sql, seconds, statements)
@@ -0,0 +1,514 @@
+import re
+
+from werkzeug.security import generate_password_hash
+
+from attendance import rebuild_summary
+from auth import create_credential_triggers
+from login_activity import summarize_logins
+from snapshot import create_version_triggers, drop_version_triggers
+
+# Schema history. Each entry upgrades the database from the previous version;
+# steps are SQL strings or callables taking a cursor. The applied version is
+# kept in PRAGMA user_version, so existing databases are upgraded in place.
+# Never edit a released migration - append a new one.
+
+
+def _create_default_admin(cursor):
+    cursor.execute('SELECT 1 FROM admins LIMIT 1')
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            INSERT INTO admins (username, password, email)
+            VALUES (?, ?, ?)
+        ''', ('admin', generate_password_hash('admin123'), 'admin@college.edu'))
+
+
+def _summarize_logins(cursor):
+    summarize_logins(cursor, '')
+
+
+MIGRATIONS = [
+    (1, 'base schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS staff (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            department TEXT,
+            phone TEXT,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS timetable (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            staff_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            location TEXT,
+            class_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(staff_id) REFERENCES staff(id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            staff_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT,
+            reason TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(staff_id) REFERENCES staff(id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS login_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            staff_id INTEGER,
+            admin_id INTEGER,
+            login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            logout_time TIMESTAMP,
+            session_type TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS leave_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            staff_id INTEGER NOT NULL,
+            leave_date TEXT NOT NULL,
+            reason TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(staff_id) REFERENCES staff(id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reassignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            original_staff_id INTEGER NOT NULL,
+            new_staff_id INTEGER NOT NULL,
+            timetable_id INTEGER NOT NULL,
+            leave_date TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(original_staff_id) REFERENCES staff(id),
+            FOREIGN KEY(new_staff_id) REFERENCES staff(id),
+            FOREIGN KEY(timetable_id) REFERENCES timetable(id)
+        )
+        ''',
+        _create_default_admin,
+    ]),
+    (2, 'hot path indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_staff_active_name ON staff(is_active, name)',
+        'CREATE INDEX IF NOT EXISTS idx_timetable_staff_day ON timetable(staff_id, day, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_timetable_day_time ON timetable(day, start_time, end_time)',
+        'CREATE INDEX IF NOT EXISTS idx_leave_date_status ON leave_requests(leave_date, status)',
+        'CREATE INDEX IF NOT EXISTS idx_leave_status_created ON leave_requests(status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_login_type_time ON login_logs(session_type, login_time)',
+        'CREATE INDEX IF NOT EXISTS idx_reassign_timetable ON reassignments(timetable_id)',
+        'CREATE INDEX IF NOT EXISTS idx_reassign_date_staff ON reassignments(leave_date, new_staff_id)',
+    ]),
+    (3, 'keyset pagination indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_timetable_day_start ON timetable(day, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_leave_created ON leave_requests(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_login_time ON login_logs(login_time)',
+    ]),
+    (4, 'shared statistics cache', [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (5, 'login rollup and archive', [
+        '''
+        CREATE TABLE IF NOT EXISTS login_daily_summary (
+            day TEXT NOT NULL,
+            session_type TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            login_count INTEGER NOT NULL,
+            first_login TIMESTAMP,
+            last_login TIMESTAMP,
+            session_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, session_type, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS login_logs_archive (
+            id INTEGER PRIMARY KEY,
+            staff_id INTEGER,
+            admin_id INTEGER,
+            login_time TIMESTAMP,
+            logout_time TIMESTAMP,
+            session_type TEXT
+        )
+        ''',
+        # Open sessions only, for the dashboard's logged-in count
+        '''
+        CREATE INDEX IF NOT EXISTS idx_login_open ON login_logs(session_type, login_time)
+        WHERE logout_time IS NULL
+        ''',
+    ]),
+    (6, 'room clash index', [
+        'CREATE INDEX IF NOT EXISTS idx_timetable_location_day ON timetable(location, day, start_time)',
+    ]),
+    (7, 'staff schedule versions', [
+        '''
+        CREATE TABLE IF NOT EXISTS staff_versions (
+            staff_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_leave_staff_date ON leave_requests(staff_id, leave_date)',
+        'CREATE INDEX IF NOT EXISTS idx_reassign_date_original ON reassignments(leave_date, original_staff_id)',
+    ]),
+    (8, 'live event log', [
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (9, 'term calendar and dated occurrences', [
+        # Older edit forms saved weekday names; the timetable uses day orders
+        '''
+        UPDATE timetable SET day = CASE day
+            WHEN 'Monday' THEN 'I' WHEN 'Tuesday' THEN 'II' WHEN 'Wednesday' THEN 'III'
+            WHEN 'Thursday' THEN 'IV' WHEN 'Friday' THEN 'V' WHEN 'Saturday' THEN 'VI'
+        END
+        WHERE day IN ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday')
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS holidays (
+            date TEXT PRIMARY KEY,
+            name TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS calendar_days (
+            date TEXT PRIMARY KEY,
+            day_order TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_calendar_day_order ON calendar_days(day_order, date)',
+        '''
+        CREATE TABLE IF NOT EXISTS timetable_occurrences (
+            date TEXT NOT NULL,
+            timetable_id INTEGER NOT NULL,
+            staff_id INTEGER NOT NULL,
+            day_order TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            location TEXT,
+            class_name TEXT,
+            PRIMARY KEY (date, timetable_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_occurrence_staff_date ON timetable_occurrences(staff_id, date, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_occurrence_timetable ON timetable_occurrences(timetable_id, date)',
+        # Reassignments become per-date overrides: one cover per period and date
+        '''
+        DELETE FROM reassignments WHERE id NOT IN (
+            SELECT MAX(id) FROM reassignments GROUP BY timetable_id, leave_date
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_reassign_timetable_date ON reassignments(timetable_id, leave_date)',
+        'DROP INDEX IF EXISTS idx_reassign_timetable',
+    ]),
+    (10, 'one attendance row per staff and date, daily summary', [
+        # Repeated submissions used to add rows; the latest one wins
+        '''
+        DELETE FROM attendance WHERE id NOT IN (
+            SELECT MAX(id) FROM attendance GROUP BY staff_id, date
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_staff_date ON attendance(staff_id, date)',
+        'CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(date, staff_id)',
+        'CREATE INDEX IF NOT EXISTS idx_staff_department ON staff(department, is_active, name)',
+        # Approved leaves count as the staff member's status for the day
+        '''
+        INSERT INTO attendance (staff_id, date, status, reason)
+        SELECT staff_id, leave_date, 'leave', reason FROM leave_requests
+        WHERE status = 'approved'
+        ON CONFLICT(staff_id, date) DO UPDATE SET status = 'leave', reason = excluded.reason
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS attendance_daily_summary (
+            date TEXT NOT NULL,
+            department TEXT NOT NULL,
+            present INTEGER NOT NULL DEFAULT 0,
+            absent INTEGER NOT NULL DEFAULT 0,
+            on_leave INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, department)
+        )
+        ''',
+        rebuild_summary,
+    ]),
+    (11, 'background job queue', [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT UNIQUE,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after REAL NOT NULL,
+            locked_by TEXT,
+            locked_until REAL,
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status_due ON jobs(status, run_after)',
+    ]),
+    (12, 'change counters for read snapshots', [
+        '''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        create_version_triggers,
+    ]),
+    (13, 'department partition registry', [
+        # Used in the main database only: each partition's id base
+        '''
+        CREATE TABLE IF NOT EXISTS partitions (
+            name TEXT PRIMARY KEY,
+            id_base INTEGER NOT NULL UNIQUE
+        )
+        ''',
+    ]),
+    (14, 'credential lookup table', [
+        # Login, hash and display name of every staff member and admin,
+        # maintained by triggers; logins read nothing else
+        '''
+        CREATE TABLE IF NOT EXISTS credentials (
+            user_type TEXT NOT NULL,
+            login TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT,
+            password TEXT NOT NULL,
+            PRIMARY KEY (user_type, login)
+        ) WITHOUT ROWID
+        ''',
+        create_credential_triggers,
+    ]),
+    (15, 'snapshot change counters only while snapshots are enabled', [
+        # Startup installs them again where SNAPSHOT_ENABLED is set
+        drop_version_triggers,
+    ]),
+    (16, 'department index matching staff without a department', [
+        # Attendance pages select a department as COALESCE(department, ''),
+        # so that '' is staff without one; the index has to use the same
+        # expression to be used
+        '''CREATE INDEX IF NOT EXISTS idx_staff_department_name
+           ON staff(COALESCE(department, ''), is_active, name)''',
+    ]),
+    (17, 'open sessions in the daily login summary', [
+        # Kept current by logins and logouts, so the dashboard's logged-in
+        # count reads the summary instead of login_logs
+        'ALTER TABLE login_daily_summary ADD COLUMN open_sessions INTEGER NOT NULL DEFAULT 0',
+        _summarize_logins,
+    ]),
+    (18, 'drop the rows of finished imports', [
+        # They include the plaintext passwords of imported staff
+        "UPDATE jobs SET payload = NULL WHERE kind = 'import' AND status IN ('done', 'failed')",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    # Apply every pending migration, each in its own transaction together
+    # with the version bump. Returns the list of (version, name) applied.
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        if version <= schema_version(conn) or version > target:
+            continue
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Another worker may have got here first while we waited for the lock
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((version, name))
+    return applied
+
+
+# The app's hot queries, with representative parameters, for the plan check
+HOT_QUERIES = [
+    ('active staff count',
+     'SELECT COUNT(*) as total FROM staff WHERE is_active = 1', ()),
+    ('staff list',
+     'SELECT * FROM staff WHERE is_active = 1 ORDER BY name', ()),
+    ('staff periods for a day',
+     'SELECT id, start_time, end_time FROM timetable WHERE staff_id = ? AND day = ?', (1, 'I')),
+    ('timetable for a day',
+     'SELECT id, staff_id, start_time, end_time FROM timetable WHERE day = ?', ('I',)),
+    ('timetable slot lookup',
+     'SELECT staff_id FROM timetable WHERE day = ? AND start_time < ? AND end_time > ?',
+     ('I', '10:00', '09:00')),
+    ('approved leaves for a date',
+     "SELECT staff_id FROM leave_requests WHERE leave_date = ? AND status = 'approved'",
+     ('2025-01-01',)),
+    ('pending leaves',
+     "SELECT l.*, s.name FROM leave_requests l JOIN staff s ON l.staff_id = s.id "
+     "WHERE l.status = 'pending' ORDER BY l.created_at DESC", ()),
+    ('logged-in staff count',
+     "SELECT COUNT(DISTINCT user_id) AS logged_in FROM login_daily_summary "
+     "WHERE day >= date('now', '-1 day') AND session_type = 'staff' AND open_sessions > 0 "
+     "AND last_login > datetime('now', '-24 hours')", ()),
+    ('recent staff logins',
+     "SELECT s.name, l.login_time FROM login_logs l JOIN staff s ON l.staff_id = s.id "
+     "WHERE session_type = 'staff' ORDER BY l.login_time DESC LIMIT 10", ()),
+    ('staff occurrences for a week',
+     'SELECT o.* FROM timetable_occurrences o WHERE o.staff_id = ? AND o.date BETWEEN ? AND ? '
+     'AND NOT EXISTS (SELECT 1 FROM reassignments r '
+     'WHERE r.timetable_id = o.timetable_id AND r.leave_date = o.date)',
+     (1, '2025-01-06', '2025-01-12')),
+    ('cover occurrences for a week',
+     'SELECT o.* FROM reassignments r JOIN timetable_occurrences o '
+     'ON o.date = r.leave_date AND o.timetable_id = r.timetable_id '
+     'WHERE r.new_staff_id = ? AND r.leave_date BETWEEN ? AND ?', (1, '2025-01-06', '2025-01-12')),
+    ('occurrences for a date with cover',
+     'SELECT o.timetable_id, COALESCE((SELECT r.new_staff_id FROM reassignments r '
+     'WHERE r.timetable_id = o.timetable_id AND r.leave_date = o.date), o.staff_id), o.start_time '
+     'FROM timetable_occurrences o WHERE o.date = ?', ('2025-01-06',)),
+    ('expand timetable for a week',
+     'SELECT c.date, t.id FROM calendar_days c JOIN timetable t ON t.day = c.day_order '
+     'WHERE c.date BETWEEN ? AND ?', ('2025-01-06', '2025-01-12')),
+    ('re-expand one timetable entry',
+     'SELECT c.date, t.id FROM calendar_days c JOIN timetable t ON t.day = c.day_order '
+     'WHERE t.id IN (?) AND c.date >= ?', (1, '2025-01-06')),
+    ('timetable page',
+     'SELECT t.*, s.name FROM timetable t JOIN staff s ON t.staff_id = s.id '
+     'WHERE (t.day, t.start_time, t.id) > (?, ?, ?) ORDER BY t.day, t.start_time, t.id LIMIT 51',
+     ('I', '09:00', 1)),
+    ('timetable page for a date',
+     'SELECT o.timetable_id, s.name FROM timetable_occurrences o '
+     'JOIN staff s ON s.id = COALESCE((SELECT r.new_staff_id FROM reassignments r '
+     'WHERE r.timetable_id = o.timetable_id AND r.leave_date = o.date), o.staff_id) '
+     'WHERE o.date = ? AND (o.start_time, o.timetable_id) > (?, ?) '
+     'ORDER BY o.start_time, o.timetable_id LIMIT 51', ('2025-01-06', '09:00', 1)),
+    ('leave requests page',
+     'SELECT l.*, s.name FROM leave_requests l JOIN staff s ON l.staff_id = s.id '
+     'WHERE (l.created_at, l.id) < (?, ?) ORDER BY l.created_at DESC, l.id DESC LIMIT 51',
+     ('2025-01-01 00:00:00', 100)),
+    ('login history page',
+     'SELECT l.*, s.name FROM login_logs l LEFT JOIN staff s ON l.staff_id = s.id '
+     'WHERE (l.login_time, l.id) < (?, ?) ORDER BY l.login_time DESC, l.id DESC LIMIT 51',
+     ('2025-01-01 00:00:00', 100)),
+    ('daily login summary page',
+     'SELECT d.*, s.name FROM login_daily_summary d '
+     "LEFT JOIN staff s ON d.session_type = 'staff' AND d.user_id = s.id "
+     'WHERE (d.day, d.session_type, d.user_id) < (?, ?, ?) '
+     'ORDER BY d.day DESC, d.session_type DESC, d.user_id DESC LIMIT 51',
+     ('2025-01-01', 'staff', 100)),
+    ('room bookings for a day',
+     'SELECT id, staff_id, day, start_time, end_time, location, class_name FROM timetable '
+     'WHERE location = ? AND day = ?', ('Room 101', 'I')),
+    ('weekly cover counts',
+     'SELECT new_staff_id, COUNT(*) FROM reassignments WHERE leave_date BETWEEN ? AND ? '
+     'GROUP BY new_staff_id', ('2025-01-06', '2025-01-12')),
+    ('credential lookup',
+     'SELECT user_id, name, password FROM credentials WHERE user_type = ? AND login = ?',
+     ('staff', 'staff@college.edu')),
+    ('staff version lookup',
+     'SELECT version FROM staff_versions WHERE staff_id = ?', (1,)),
+    ('staff reassignments for a date',
+     'SELECT r.timetable_id, t.start_time FROM reassignments r JOIN timetable t ON t.id = r.timetable_id '
+     'WHERE r.leave_date = ? AND (r.new_staff_id = ? OR r.original_staff_id = ?)',
+     ('2025-01-01', 1, 1)),
+    ('attendance overview',
+     'SELECT department, present, absent, on_leave FROM attendance_daily_summary WHERE date = ?',
+     ('2025-01-06',)),
+    ('department attendance for a date',
+     '''SELECT s.id, s.name,
+               (SELECT a.status FROM attendance a WHERE a.staff_id = s.id AND a.date = ?1)
+        FROM staff s WHERE COALESCE(s.department, '') = ?2 AND s.is_active = 1 ORDER BY s.name''',
+     ('2025-01-06', 'Physics')),
+    ('attendance export',
+     '''SELECT a.date, s.name FROM attendance a CROSS JOIN staff s ON s.id = a.staff_id
+        WHERE a.date >= ? AND a.date <= ? AND s.department = ? ORDER BY a.date, a.staff_id''',
+     ('2025-06-01', '2025-10-31', 'Physics')),
+    ('leave export',
+     '''SELECT l.leave_date, s.name FROM leave_requests l CROSS JOIN staff s ON s.id = l.staff_id
+        WHERE l.leave_date >= ? AND l.leave_date <= ? AND s.department = ? ORDER BY l.leave_date''',
+     ('2025-06-01', '2025-10-31', 'Physics')),
+    ('reassignment export',
+     '''SELECT r.leave_date, original.name, cover.name,
+               COALESCE((SELECT o.start_time FROM timetable_occurrences o
+                         WHERE o.date = r.leave_date AND o.timetable_id = r.timetable_id),
+                        (SELECT t.start_time FROM timetable t WHERE t.id = r.timetable_id))
+        FROM reassignments r
+        JOIN staff original ON original.id = r.original_staff_id
+        JOIN staff cover ON cover.id = r.new_staff_id
+        WHERE r.leave_date >= ? AND r.leave_date <= ? ORDER BY r.leave_date''',
+     ('2025-06-01', '2025-10-31')),
+    ('next due job',
+     '''SELECT id FROM jobs
+        WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND locked_until < ?)
+        ORDER BY run_after, id LIMIT 1''', (0, 0)),
+    ('staff leave history',
+     'SELECT id, leave_date, status FROM leave_requests WHERE staff_id = ? ORDER BY leave_date DESC', (1,)),
+]
+
+
+def full_scans(conn, queries=None):
+    # Run EXPLAIN QUERY PLAN over the hot queries and return
+    # (name, plan detail) for every step that reads a whole table
+    findings = []
+    views = {row[0] for row in conn.execute("SELECT name FROM sqlite_temp_master WHERE type = 'view'")}
+    for name, sql, params in (HOT_QUERIES if queries is None else queries):
+        # Scans of a subquery's own (already reduced) result are fine; a
+        # view (such as the partitions' UNION ALL views) is scanned under
+        # the alias the query gives it
+        subqueries = set()
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detail = row[-1]
+            if detail.startswith(('CO-ROUTINE ', 'MATERIALIZE ')):
+                subquery = detail.split()[1]
+                subqueries.add(subquery)
+                if subquery in views:
+                    subqueries.update(re.findall(rf'\b(?:FROM|JOIN)\s+{subquery}\s+(?:AS\s+)?(\w+)', sql))
+            elif detail.startswith('SCAN') and 'INDEX' not in detail and detail.split()[1] not in subqueries:
+                findings.append((name, detail))
+    return findings
@@ -0,0 +1,91 @@
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, width):
+    # Returns the key values from a cursor token, or None if it is missing
+    # or malformed (a bad cursor just means "first page")
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != width:
+        return None
+    # Only values SQLite can bind; a tampered token may hold lists or objects
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
+
+
+def page_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_query(sql, where, params, order_columns, descending, cursor_token, limit):
+    """Build the SQL for one keyset page.
+
+    sql is the SELECT ... FROM ... part, where is a list of filter conditions
+    with their params. Rows are ordered by order_columns (the last one must be
+    unique, e.g. the id) and the page starts strictly after the cursor row.
+    One extra row is fetched so the page knows whether there is a next page.
+    """
+    where = list(where)
+    params = list(params)
+    after = decode_cursor(cursor_token, len(order_columns))
+    if after is not None:
+        op = '<' if descending else '>'
+        where.append(f"({', '.join(order_columns)}) {op} ({', '.join('?' * len(order_columns))})")
+        params.extend(after)
+
+    direction = ' DESC' if descending else ''
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY ' + ', '.join(column + direction for column in order_columns)
+    sql += ' LIMIT ?'
+    params.append(limit + 1)
+    return sql, params
+
+
+class KeysetPage:
+    # Rows of one page, read from the cursor as the template iterates, so a
+    # streamed response never holds the whole page in memory. After the rows
+    # have been iterated next_cursor is set if another page follows.
+
+    def __init__(self, cursor, key_fields, limit):
+        self._cursor = cursor
+        self._key_fields = key_fields
+        self.limit = limit
+        self.next_cursor = None
+        self._first = cursor.fetchone()
+
+    def __bool__(self):
+        return self._first is not None
+
+    def __iter__(self):
+        row = self._first
+        count = 0
+        last = None
+        while row is not None:
+            if count == self.limit:
+                self.next_cursor = encode_cursor(last[field] for field in self._key_fields)
+                break
+            yield row
+            last = row
+            count += 1
+            row = self._cursor.fetchone()
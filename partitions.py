@@ -0,0 +1,186 @@
+import os
+
+from migrations import migrate, schema_version
+
+# Department partitioning. Each partition is a SQLite file of its own next to
+# the main database (college_staff.db -> college_staff.science.db) holding
+# the rows keyed by the staff of the departments mapped to it: the weekly
+# timetable and its dated occurrences, cover, attendance and leave. Every
+# partition also keeps a copy of the calendar (holidays and calendar_days)
+# so it can expand its own timetable. The main database keeps what is
+# shared: the staff directory, admins, login records, jobs, events and
+# caches. A staff member's department decides which partition their rows
+# are in.
+#
+# Request connections open the main database with every partition attached
+# and TEMP views named after the partitioned tables that UNION ALL the
+# partitions' copies, so read queries run unchanged across departments and
+# SQLite pushes their filters and joins down to each file's indexes. That
+# holds for joins, correlated subqueries and NOT EXISTS but not for the
+# right-hand side of a LEFT JOIN, which SQLite materializes whole, so
+# queries look a partitioned table up with a correlated subquery instead (or
+# read it on its own and merge the rows in Python).
+# Writes go through a connection to the owning partition's file, which
+# reads the staff directory from the main database: each file has its own
+# writer lock, so departments in different partitions write at the same
+# time.
+#
+# Ids stay unique across partitions: each partition's AUTOINCREMENT counters
+# start at its own base, ID_STRIDE apart, recorded in the main database's
+# partitions table the first time the partition is set up.
+
+PARTITIONED_TABLES = ('timetable', 'timetable_occurrences', 'reassignments', 'attendance',
+                      'attendance_daily_summary', 'leave_requests', 'staff_versions')
+CALENDAR_TABLES = ('holidays', 'calendar_days')
+SEQUENCED_TABLES = ('timetable', 'attendance', 'leave_requests', 'reassignments')
+
+ID_STRIDE = 10 ** 9
+
+# Rows moved out of the main database by move_legacy(), per table; the
+# staff whose rows are being moved are in temp.moving. Reassignments go
+# first, while the timetable rows they are found by are still there.
+LEGACY_ROWS = [
+    ('reassignments', 'timetable_id IN (SELECT id FROM main.timetable WHERE staff_id IN moving)'),
+    ('timetable_occurrences', 'staff_id IN moving'),
+    ('timetable', 'staff_id IN moving'),
+    ('attendance', 'staff_id IN moving'),
+    ('leave_requests', 'staff_id IN moving'),
+    ('staff_versions', 'staff_id IN moving'),
+]
+
+
+class Partitions:
+
+    def __init__(self, departments, default='default'):
+        # departments: {department: partition name}; staff of any other
+        # department, or of none, go to the default partition
+        self.departments = dict(departments)
+        self.default = default
+        # The default partition answers the calendar reads, so calendar
+        # writes reach it first when rows are removed and last when added
+        self.names = [default] + sorted(set(self.departments.values()) - {default})
+        for name in self.names:
+            if not name.isidentifier():
+                raise ValueError(f'partition name {name!r} must be a valid identifier')
+
+    def for_department(self, department):
+        return self.departments.get(department, self.default)
+
+    def path(self, database, name):
+        stem, ext = os.path.splitext(database)
+        return f'{stem}.{name}{ext}'
+
+    def schema(self, name):
+        return f'part_{name}'
+
+    def attach(self, conn, database):
+        # SQLite attaches at most 10 databases to a connection by default
+        for name in self.names:
+            conn.execute(f'ATTACH DATABASE ? AS {self.schema(name)}', (self.path(database, name),))
+        for table in PARTITIONED_TABLES:
+            conn.execute(f'CREATE TEMP VIEW {table} AS ' + ' UNION ALL '.join(
+                f'SELECT * FROM {self.schema(name)}.{table}' for name in self.names))
+        for table in CALENDAR_TABLES:
+            conn.execute(f'CREATE TEMP VIEW {table} AS SELECT * FROM {self.schema(self.default)}.{table}')
+
+    def attach_shared(self, conn, database):
+        # A partition's own connection reads the staff directory from the
+        # main database; the partition's copy of the staff table stays empty
+        conn.execute('ATTACH DATABASE ? AS shared', (database,))
+        conn.execute('CREATE TEMP VIEW staff AS SELECT * FROM shared.staff')
+
+    def locate(self, conn, staff_ids):
+        # {staff_id: partition name} for the staff found in the main database
+        staff_ids = list(set(staff_ids))
+        found = {}
+        for offset in range(0, len(staff_ids), 500):
+            chunk = staff_ids[offset:offset + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            found.update((staff_id, self.for_department(department)) for staff_id, department in conn.execute(
+                f'SELECT id, department FROM main.staff WHERE id IN ({placeholders})', chunk))
+        return found
+
+    def _id_base(self, main, name):
+        main.execute('''
+            INSERT OR IGNORE INTO partitions (name, id_base)
+            SELECT ?, COALESCE(MAX(id_base), 0) + ? FROM partitions
+        ''', (name, ID_STRIDE))
+        main.commit()
+        return main.execute('SELECT id_base FROM partitions WHERE name = ?', (name,)).fetchone()[0]
+
+    def prepare(self, main, connect):
+        # Create or upgrade every partition file. main is a connection to the
+        # main database alone; connect(name) opens a partition's file. A new
+        # partition gets its id base and a copy of the calendar, from the
+        # default partition or, for the default itself, the main database.
+        # Returns {name: migrations applied}.
+        applied = {}
+        for name in self.names:
+            base = self._id_base(main, name)
+            conn = connect(name)
+            created = schema_version(conn) == 0
+            applied[name] = migrate(conn)
+            for table in SEQUENCED_TABLES:
+                conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (base, table))
+                conn.execute('''
+                    INSERT INTO sqlite_sequence (name, seq)
+                    SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                ''', (table, base, table))
+            if created:
+                source = main if name == self.default else connect(self.default)
+                conn.executemany('INSERT OR IGNORE INTO holidays (date, name) VALUES (?, ?)',
+                                 source.execute('SELECT date, name FROM holidays').fetchall())
+                conn.executemany('INSERT OR IGNORE INTO calendar_days (date, day_order) VALUES (?, ?)',
+                                 source.execute('SELECT date, day_order FROM calendar_days').fetchall())
+                if source is not main:
+                    source.close()
+            conn.commit()
+            conn.close()
+        return applied
+
+    def legacy_rows(self, main):
+        # Rows move_legacy() would move; main is a connection to the main
+        # database alone
+        return sum(main.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                   for table, _ in LEGACY_ROWS)
+
+    def move_legacy(self, conn):
+        # Move rows written before partitioning was switched on from the main
+        # database into the partition of their staff member's department.
+        # Rows keep their ids (below every partition's base). Each
+        # partition's share is copied and then deleted, so an interrupted
+        # run can simply be repeated. conn has the partitions attached.
+        # Returns {name: staff whose rows moved}; the partitions' attendance
+        # summaries need rebuilding afterwards.
+        placeholders = ', '.join('?' * len(SEQUENCED_TABLES))
+        top = conn.execute(f'SELECT MAX(seq) FROM main.sqlite_sequence WHERE name IN ({placeholders})',
+                           SEQUENCED_TABLES).fetchone()[0]
+        if top is not None and top >= ID_STRIDE:
+            raise ValueError(f'ids in the main database must be below {ID_STRIDE}')
+        by_partition = {}
+        for staff_id, department in conn.execute('SELECT id, department FROM main.staff').fetchall():
+            by_partition.setdefault(self.for_department(department), []).append(staff_id)
+
+        moved = {}
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS moving (id INTEGER PRIMARY KEY)')
+        for name, staff_ids in by_partition.items():
+            schema = self.schema(name)
+            conn.execute('DELETE FROM temp.moving')
+            conn.executemany('INSERT INTO temp.moving (id) VALUES (?)', [(staff_id,) for staff_id in staff_ids])
+            count = conn.execute('''
+                SELECT COUNT(*) FROM moving
+                WHERE id IN (SELECT staff_id FROM main.timetable)
+                   OR id IN (SELECT staff_id FROM main.attendance)
+                   OR id IN (SELECT staff_id FROM main.leave_requests)
+            ''').fetchone()[0]
+            for table, where in LEGACY_ROWS:
+                conn.execute(f'INSERT OR REPLACE INTO {schema}.{table} SELECT * FROM main.{table} WHERE {where}')
+            for table, where in LEGACY_ROWS:
+                conn.execute(f'DELETE FROM main.{table} WHERE {where}')
+            conn.commit()
+            if count:
+                moved[name] = count
+        conn.execute('DELETE FROM main.attendance_daily_summary')
+        conn.execute('DROP TABLE temp.moving')
+        conn.commit()
+        return moved
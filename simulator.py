@@ -0,0 +1,195 @@
+import itertools
+import math
+
+try:
+    import numpy as np
+except ImportError:     # the simulator is optional
+    np = None
+
+from term_calendar import parse_date
+
+# What-if simulation of leave: given N staff off on the same day, would every
+# period still find cover? Each date's timetable (with cover already arranged
+# for it) is loaded into a staff-by-slot matrix, where a slot is a distinct
+# (start_time, end_time) pair. Thousands of leave combinations are then
+# scored at once with matrix products:
+#
+#   demand = absent @ periods          periods needing cover, per slot
+#   free   = (1 - absent) @ available  staff free to cover, per slot
+#   uncovered = max(demand - free, 0)
+#
+# Within one slot this is exactly what the cover matching achieves. Where
+# differently timed periods overlap, a free teacher is counted in each slot,
+# so the result is a lower bound on what would go uncovered. Cover load
+# assumes the periods of a slot are spread evenly over the free staff, as
+# the load-balanced matching tends to do. Nothing is written to the database.
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError('The leave simulator needs numpy (pip install numpy)')
+
+
+def to_minutes(value):
+    hours, minutes = value.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+class DayModel:
+    """One date's timetable as arrays over (staff, slot).
+
+    counts[s, t] is how many periods staff s teaches in slot t; available[s, t]
+    is true when s is active, not on leave and has nothing overlapping slot t.
+    """
+
+    def __init__(self, staff_ids, periods, on_leave=()):
+        # staff_ids: active staff, sorted; periods: (staff_id, start_time,
+        # end_time) with cover already applied; on_leave: approved leaves
+        self.staff_ids = staff_ids
+        column = {staff_id: n for n, staff_id in enumerate(staff_ids)}
+        periods = [period for period in periods if period[0] in column]
+        self.slots = sorted({(start_time, end_time) for _, start_time, end_time in periods})
+        slot_index = {slot: n for n, slot in enumerate(self.slots)}
+
+        self.counts = np.zeros((len(staff_ids), len(self.slots)), dtype=np.float32)
+        if periods:
+            np.add.at(self.counts,
+                      ([column[staff_id] for staff_id, _, _ in periods],
+                       [slot_index[(start_time, end_time)] for _, start_time, end_time in periods]), 1)
+
+        starts = np.array([to_minutes(start) for start, _ in self.slots], dtype=np.int32)
+        ends = np.array([to_minutes(end) for _, end in self.slots], dtype=np.int32)
+        overlap = (starts[:, None] < ends[None, :]) & (ends[:, None] > starts[None, :])
+        busy = self.counts @ overlap.astype(np.float32) > 0
+
+        self.on_leave = np.zeros(len(staff_ids), dtype=bool)
+        self.on_leave[[column[staff_id] for staff_id in on_leave if staff_id in column]] = True
+        self.available = (~busy & ~self.on_leave[:, None]).astype(np.float32)
+
+    @property
+    def period_count(self):
+        return int(self.counts.sum())
+
+    def evaluate(self, absent):
+        # absent: (scenarios, staff) booleans. Returns uncovered periods per
+        # (scenario, slot) and expected cover load per (scenario, staff).
+        absent = absent | self.on_leave
+        weights = absent.astype(np.float32)
+        demand = weights @ self.counts
+        free = self.available.sum(axis=0) - weights @ self.available
+        covered = np.minimum(demand, free)
+        share = np.divide(covered, free, out=np.zeros_like(covered), where=free > 0)
+        load = (share @ self.available.T) * ~absent
+        return demand - covered, load
+
+
+def leave_combinations(candidates, leaves, samples, seed=None, batch_size=500):
+    # (scenarios, leaves) array of indexes into candidates: every combination
+    # when there are no more than samples of them, otherwise samples random
+    # ones drawn without replacement within each row
+    if math.comb(candidates, leaves) <= samples:
+        combos = np.array(list(itertools.combinations(range(candidates), leaves)), dtype=np.int32)
+        return combos.reshape(-1, leaves), True
+    rng = np.random.default_rng(seed)
+    batches = []
+    for offset in range(0, samples, batch_size):
+        rows = min(batch_size, samples - offset)
+        keys = rng.random((rows, candidates))
+        batches.append(np.argpartition(keys, leaves - 1, axis=1)[:, :leaves].astype(np.int32))
+    return np.concatenate(batches), False
+
+
+def load_day(conn, leave_date, day_order, staff_ids):
+    periods = conn.execute('''
+        SELECT COALESCE((SELECT r.new_staff_id FROM reassignments r
+                         WHERE r.timetable_id = t.id AND r.leave_date = ?), t.staff_id),
+               t.start_time, t.end_time
+        FROM timetable t
+        WHERE t.day = ?
+    ''', (leave_date, day_order)).fetchall()
+    on_leave = [row[0] for row in conn.execute('''
+        SELECT staff_id FROM leave_requests WHERE leave_date = ? AND status = 'approved'
+    ''', (leave_date,))]
+    return DayModel(staff_ids, [tuple(period) for period in periods], on_leave)
+
+
+def simulate(conn, calendar, start, end, leaves, samples=1000, department=None, seed=None,
+             batch_size=500, top=10):
+    """Score leave combinations on every date from start to end.
+
+    leaves staff at a time are drawn from the active staff (of one department
+    if given); the same combinations are tried on each date. Returns a dict
+    ready for JSON.
+    """
+    require_numpy()
+    staff = conn.execute('SELECT id, name, department FROM staff WHERE is_active = 1 ORDER BY id').fetchall()
+    staff_ids = [row[0] for row in staff]
+    candidates = np.array([n for n, row in enumerate(staff) if department is None or row[2] == department],
+                          dtype=np.int32)
+    if leaves < 1 or leaves > len(candidates):
+        raise ValueError(f'leaves must be between 1 and {len(candidates)}, the number of staff to draw from')
+
+    combos, exhaustive = leave_combinations(len(candidates), leaves, samples, seed, batch_size)
+    scenarios = len(combos)
+    load_sum = np.zeros(len(staff_ids))
+    load_max = np.zeros(len(staff_ids))
+
+    days = []
+    for day, day_order in sorted(calendar.known_day_orders(conn, start, end).items()):
+        report = {'date': day.isoformat(), 'day_order': day_order, 'periods': 0,
+                  'absorbable': True, 'fully_covered': 1.0, 'mean_uncovered': 0.0, 'max_uncovered': 0,
+                  'worst_staff_ids': [], 'short_slots': []}
+        days.append(report)
+        if day_order is None:
+            continue
+        model = load_day(conn, day.isoformat(), day_order, staff_ids)
+        report['periods'] = model.period_count
+        if not model.slots:
+            continue
+
+        totals = np.empty(scenarios, dtype=np.float32)
+        slot_uncovered = np.zeros(len(model.slots))
+        slot_short = np.zeros(len(model.slots), dtype=np.int64)
+        for offset in range(0, scenarios, batch_size):
+            batch = combos[offset:offset + batch_size]
+            absent = np.zeros((len(batch), len(staff_ids)), dtype=bool)
+            absent[np.arange(len(batch))[:, None], candidates[batch]] = True
+            uncovered, load = model.evaluate(absent)
+            totals[offset:offset + len(batch)] = uncovered.sum(axis=1)
+            slot_uncovered += uncovered.sum(axis=0)
+            slot_short += (uncovered > 0).sum(axis=0)
+            load_sum += load.sum(axis=0)
+            np.maximum(load_max, load.max(axis=0), out=load_max)
+
+        worst = int(totals.argmax())
+        report.update({
+            'absorbable': bool(totals.max() == 0),
+            'fully_covered': round(float((totals == 0).mean()), 4),
+            'mean_uncovered': round(float(totals.mean()), 3),
+            'max_uncovered': int(totals.max()),
+            'worst_staff_ids': [staff_ids[n] for n in candidates[combos[worst]]] if totals[worst] else [],
+            'short_slots': [
+                {'start_time': start_time, 'end_time': end_time,
+                 'mean_uncovered': round(float(slot_uncovered[n] / scenarios), 3),
+                 'short_in': round(float(slot_short[n] / scenarios), 4)}
+                for n, (start_time, end_time) in enumerate(model.slots) if slot_short[n]
+            ],
+        })
+
+    # Expected periods each staff member would cover over the whole range
+    busiest = np.argsort(-load_sum, kind='stable')[:top]
+    return {
+        'start': parse_date(start).isoformat(),
+        'end': parse_date(end).isoformat(),
+        'leaves': leaves,
+        'department': department,
+        'scenarios': scenarios,
+        'exhaustive': exhaustive,
+        'days': days,
+        'cover_load': [
+            {'staff_id': staff_ids[n], 'name': staff[n][1], 'department': staff[n][2],
+             'mean_periods': round(float(load_sum[n] / scenarios), 3),
+             'max_periods_in_a_day': round(float(load_max[n]), 3)}
+            for n in busiest if load_sum[n] > 0
+        ],
+    }
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+# Read-only pages can be served from an in-memory copy of the scheduling
+# tables instead of the database file, so they neither wait on nor slow
+# down writers. Each worker process builds the copy once with the sqlite3
+# backup API and keeps it current: at most every max_staleness seconds a
+# reader checks PRAGMA data_version on the primary, and if anything was
+# committed since, the per-table counters in table_versions (bumped by
+# triggers) say which scheduling tables changed. Only those are reloaded,
+# into a new copy of the snapshot that then replaces the old one, so a
+# request already reading the old copy keeps a consistent view.
+
+SNAPSHOT_TABLES = ('staff', 'timetable', 'timetable_occurrences', 'reassignments',
+                   'calendar_days', 'holidays')
+
+
+def create_version_triggers(cursor):
+    # Count every insert, update and delete on the snapshot tables in
+    # table_versions. Only installed while snapshots are enabled (see
+    # sync_version_triggers): each trigger is an extra write per row.
+    for table in SNAPSHOT_TABLES:
+        cursor.execute('INSERT OR IGNORE INTO table_versions (name) VALUES (?)', (table,))
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_version
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+
+def drop_version_triggers(cursor):
+    for table in SNAPSHOT_TABLES:
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_{operation.lower()}_version')
+
+
+def sync_version_triggers(conn, enabled):
+    # Install the counting triggers when snapshots are enabled and remove
+    # them otherwise; run at startup, after the migrations
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        (create_version_triggers if enabled else drop_version_triggers)(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+class Snapshot:
+
+    def __init__(self, connect, max_staleness=1.0, tables=SNAPSHOT_TABLES):
+        # connect() opens a connection to the primary database that may be
+        # used from any thread (check_same_thread=False)
+        self.connect = connect
+        self.max_staleness = max_staleness
+        self.tables = tables
+        self._lock = threading.Lock()
+        self._source = None
+        self._conn = None
+        self._data_version = None
+        self._versions = {}
+        self._checked = 0.0
+        self._pid = None
+        self.checked_at = 0.0   # wall-clock time the copy was last known current
+
+    def connection(self):
+        # The current in-memory copy, at most max_staleness seconds behind
+        # the primary. Keep using the returned connection for the rest of
+        # the request; later calls may return a newer copy.
+        if self._conn is None or self._pid != os.getpid() or \
+                time.monotonic() - self._checked >= self.max_staleness:
+            self.refresh()
+        return self._conn
+
+    def refresh(self, force=False):
+        # Bring the copy up to date now. Without force, a refresh that
+        # another thread finished while we waited for the lock is enough.
+        with self._lock:
+            if not force and self._conn is not None and \
+                    time.monotonic() - self._checked < self.max_staleness:
+                return
+            if self._pid != os.getpid():
+                # A forked worker builds its own copy
+                self._source = self._conn = None
+                self._pid = os.getpid()
+            if self._source is None:
+                self._source = self.connect()
+            checked, checked_at = time.monotonic(), time.time()
+            data_version = self._source.execute('PRAGMA data_version').fetchone()[0]
+            if self._conn is None:
+                self._conn = self._build()
+            elif data_version != self._data_version and self._changed_tables(self._source)[1]:
+                # Most commits (logins, attendance) touch none of our tables
+                self._reload()
+            self._data_version = data_version
+            self._checked, self.checked_at = checked, checked_at
+
+    def _changed_tables(self, conn, schema='main'):
+        versions = dict(conn.execute(f'SELECT name, version FROM {schema}.table_versions').fetchall())
+        return versions, [table for table in self.tables if versions.get(table) != self._versions.get(table)]
+
+    def _memory_connection(self):
+        # Shared between request threads; it is only ever read from
+        conn = sqlite3.connect('file::memory:', uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _build(self):
+        # Full copy with the backup API, then drop everything the read
+        # routes don't use so the copy (and every later one) stays small
+        conn = self._memory_connection()
+        self._source.backup(conn)
+        keep = set(self.tables) | {'table_versions', 'sqlite_sequence'}
+        for kind, name in conn.execute(
+                "SELECT type, name FROM sqlite_master WHERE type IN ('view', 'table')").fetchall():
+            if name not in keep:
+                conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+        # The triggers would only bump counters that are overwritten anyway
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+            conn.execute(f'DROP TRIGGER "{name}"')
+        conn.commit()
+        conn.execute('VACUUM')
+        self._versions = dict(conn.execute('SELECT name, version FROM table_versions').fetchall())
+        return conn
+
+    def _reload(self):
+        # Copy the current snapshot in memory, reload only the tables whose
+        # counters moved from the primary, then swap it in. The counters and
+        # tables are read in one transaction, so they match each other.
+        path = self._source.execute('PRAGMA database_list').fetchone()[2]
+        conn = self._memory_connection()
+        self._conn.backup(conn)
+        conn.execute('ATTACH DATABASE ? AS primary_db', (f'file:{quote(path)}?mode=ro',))
+        try:
+            conn.execute('BEGIN')
+            versions, changed = self._changed_tables(conn, 'primary_db')
+            for table in changed:
+                conn.execute(f'DELETE FROM main.{table}')
+                conn.execute(f'INSERT INTO main.{table} SELECT * FROM primary_db.{table}')
+            conn.executemany('UPDATE main.table_versions SET version = ? WHERE name = ?',
+                             [(version, name) for name, version in versions.items()])
+            conn.commit()
+        finally:
+            conn.execute('DETACH DATABASE primary_db')
+        self._conn = conn
+        self._versions = versions
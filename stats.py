@@ -0,0 +1,87 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class StatsCache:
+    """Bounded TTL cache for dashboard counters and top-N lists.
+
+    Entries live in this process by default. With shared=True they are kept
+    in the stats_cache table instead, so every gunicorn worker sees the same
+    values and an invalidation in one worker applies to all of them. The
+    table is read and written through the cache's own connection (one per
+    thread, opened with connect()), never the caller's, so it commits nothing
+    of the caller's transaction. Values must be JSON-serializable. Write
+    paths call invalidate() after they commit; the TTL only bounds staleness
+    for time-windowed figures.
+    """
+
+    def __init__(self, ttl=60, max_entries=256, shared=False, connect=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.connect = connect
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, key, compute):
+        if self.shared:
+            return self._get_shared(key, compute)
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = compute()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def _connection(self):
+        # A forked worker opens its own
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = self.connect()
+            local.pid = os.getpid()
+        return local.conn
+
+    def _get_shared(self, key, compute):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute('SELECT value, expires_at FROM stats_cache WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[1] > now:
+            return json.loads(row[0])
+
+        value = compute()
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO stats_cache (key, value, expires_at)
+                VALUES (?, ?, ?)
+            ''', (key, json.dumps(value), now + self.ttl))
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Database busy: the value is still good for this request, and
+            # the next one will compute it again
+            conn.rollback()
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+        if self.shared and keys:
+            conn = self._connection()
+            placeholders = ', '.join('?' * len(keys))
+            conn.execute(f'DELETE FROM stats_cache WHERE key IN ({placeholders})', keys)
+            conn.commit()
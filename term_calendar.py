@@ -0,0 +1,172 @@
+from datetime import date, datetime, timedelta
+
+# Calendar layer between the weekly timetable and real dates. Timetable rows
+# recur on a day order (I-VI); every working day of term takes the next day
+# order in rotation, skipping Sundays and holidays. Weeks are materialized on
+# demand: the first query that touches a week writes its calendar_days rows
+# and expands the timetable into timetable_occurrences for those dates.
+# Cover is stored as per-date overrides in reassignments, keyed by
+# (timetable_id, leave_date); the weekly timetable itself is never rewritten.
+
+DAY_ORDERS = ('I', 'II', 'III', 'IV', 'V', 'VI')
+
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def week_start(value):
+    value = parse_date(value)
+    return value - timedelta(days=value.weekday())
+
+
+class TermCalendar:
+
+    def __init__(self, term_start=None, working_weekdays=6):
+        # Without a term start, Monday is day I, Tuesday day II and so on.
+        # working_weekdays counts from Monday: 6 is Monday-Saturday.
+        self.term_start = parse_date(term_start) if term_start else None
+        self.working_weekdays = working_weekdays
+
+    def _holidays(self, conn, start, end):
+        return {parse_date(row[0]) for row in conn.execute(
+            'SELECT date FROM holidays WHERE date >= ? AND date <= ?',
+            (start.isoformat(), end.isoformat()))}
+
+    def _is_working(self, day, holidays):
+        return day.weekday() < self.working_weekdays and day not in holidays
+
+    def _working_days_before(self, conn, day):
+        # Working days from term start up to, not including, `day`
+        if day <= self.term_start:
+            return 0
+        weeks, rest = divmod((day - self.term_start).days, 7)
+        count = weeks * self.working_weekdays
+        count += sum(1 for offset in range(rest)
+                     if (self.term_start + timedelta(days=offset)).weekday() < self.working_weekdays)
+        holidays = self._holidays(conn, self.term_start, day - timedelta(days=1))
+        return count - sum(1 for holiday in holidays if holiday.weekday() < self.working_weekdays)
+
+    def day_orders(self, conn, start, end):
+        # {date: day order, or None for a day without classes}, start..end inclusive
+        start, end = parse_date(start), parse_date(end)
+        holidays = self._holidays(conn, start, end)
+        if self.term_start is not None:
+            position = self._working_days_before(conn, start)
+
+        orders = {}
+        day = start
+        while day <= end:
+            if not self._is_working(day, holidays) or (self.term_start and day < self.term_start):
+                orders[day] = None
+            elif self.term_start is None:
+                orders[day] = DAY_ORDERS[day.weekday() % len(DAY_ORDERS)]
+            else:
+                orders[day] = DAY_ORDERS[position % len(DAY_ORDERS)]
+                position += 1
+            day += timedelta(days=1)
+        return orders
+
+    def day_order(self, conn, day):
+        day = parse_date(day)
+        row = conn.execute('SELECT day_order FROM calendar_days WHERE date = ?',
+                           (day.isoformat(),)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.day_orders(conn, day, day)[day]
+
+    def known_day_orders(self, conn, start, end):
+        # day_orders() without writing anything: materialized dates keep the
+        # day order they were written with
+        orders = self.day_orders(conn, start, end)
+        for day, order in conn.execute('SELECT date, day_order FROM calendar_days WHERE date BETWEEN ? AND ?',
+                                       (parse_date(start).isoformat(), parse_date(end).isoformat())):
+            orders[parse_date(day)] = order
+        return orders
+
+    def missing_weeks(self, conn, start, end):
+        # Mondays of the weeks overlapping start..end not materialized yet. A
+        # week is written whole, so its Monday row marks it as done.
+        first, last = week_start(start), week_start(end)
+        mondays = [first + timedelta(weeks=n) for n in range((last - first).days // 7 + 1)]
+        placeholders = ', '.join('?' * len(mondays))
+        done = {row[0] for row in conn.execute(
+            f'SELECT date FROM calendar_days WHERE date IN ({placeholders})',
+            [monday.isoformat() for monday in mondays])}
+        return [monday for monday in mondays if monday.isoformat() not in done]
+
+    def ensure_weeks(self, conn, start, end):
+        # Materialize every Monday-Sunday week overlapping start..end that
+        # hasn't been yet. Returns the number of weeks written; the caller
+        # commits.
+        written = 0
+        for monday in self.missing_weeks(conn, start, end):
+            sunday = monday + timedelta(days=6)
+            conn.executemany('INSERT OR IGNORE INTO calendar_days (date, day_order) VALUES (?, ?)',
+                             [(day.isoformat(), order)
+                              for day, order in self.day_orders(conn, monday, sunday).items()])
+            self._expand(conn, 'c.date BETWEEN ? AND ?', (monday.isoformat(), sunday.isoformat()))
+            written += 1
+        return written
+
+    def _expand(self, conn, where, params):
+        conn.execute(f'''
+            INSERT OR IGNORE INTO timetable_occurrences
+                (date, timetable_id, staff_id, day_order, start_time, end_time, location, class_name)
+            SELECT c.date, t.id, t.staff_id, t.day, t.start_time, t.end_time, t.location, t.class_name
+            FROM calendar_days c
+            JOIN timetable t ON t.day = c.day_order
+            WHERE {where}
+        ''', params)
+
+    def refresh(self, conn, timetable_ids=None, since=None):
+        # Re-expand materialized dates from `since` (default today) after the
+        # weekly timetable changed, for the given entries or for all of them.
+        # Past occurrences are left alone as the record of what was taught.
+        since = parse_date(since or date.today()).isoformat()
+        if timetable_ids is None:
+            conn.execute('DELETE FROM timetable_occurrences WHERE date >= ?', (since,))
+            self._expand(conn, 'c.date >= ?', (since,))
+            return
+
+        timetable_ids = list(timetable_ids)
+        for offset in range(0, len(timetable_ids), 500):
+            chunk = timetable_ids[offset:offset + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            conn.execute(f'''
+                DELETE FROM timetable_occurrences
+                WHERE timetable_id IN ({placeholders}) AND date >= ?
+            ''', chunk + [since])
+            self._expand(conn, f't.id IN ({placeholders}) AND c.date >= ?', chunk + [since])
+
+    def reset(self, conn, since):
+        # Forget materialized weeks from the one containing `since`, e.g.
+        # after a holiday is added; they are rebuilt on next use
+        since = week_start(since).isoformat()
+        conn.execute('DELETE FROM timetable_occurrences WHERE date >= ?', (since,))
+        conn.execute('DELETE FROM calendar_days WHERE date >= ?', (since,))
+
+    def staff_occurrences(self, conn, staff_id, start, end):
+        # A staff member's dated periods in start..end: their own periods not
+        # handed to someone else, plus the periods they cover. The weeks must
+        # already be materialized (ensure_weeks).
+        start, end = parse_date(start).isoformat(), parse_date(end).isoformat()
+        return conn.execute('''
+            SELECT o.date, o.day_order AS day, o.timetable_id AS id, o.start_time, o.end_time,
+                   o.location, o.class_name, 'Original' AS assignment_type
+            FROM timetable_occurrences o
+            WHERE o.staff_id = ? AND o.date BETWEEN ? AND ?
+            AND NOT EXISTS (
+                SELECT 1 FROM reassignments r
+                WHERE r.timetable_id = o.timetable_id AND r.leave_date = o.date
+            )
+            UNION ALL
+            SELECT o.date, o.day_order, o.timetable_id, o.start_time, o.end_time,
+                   o.location, o.class_name, 'Reassigned'
+            FROM reassignments r
+            JOIN timetable_occurrences o ON o.date = r.leave_date AND o.timetable_id = r.timetable_id
+            WHERE r.new_staff_id = ? AND r.leave_date BETWEEN ? AND ?
+            ORDER BY 1, 4
+        ''', (staff_id, start, end, staff_id, start, end)).fetchall()